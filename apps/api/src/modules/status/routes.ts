@@ -1,21 +1,49 @@
 import { FastifyInstance } from 'fastify';
 import { query } from '../../db.js';
 
+// Last price load per chain from the ingest scripts' run reports (scripts/run_metrics.py)
+async function lastRuns() {
+  try {
+    const { rows } = await query(`
+      WITH last AS (
+        SELECT DISTINCT ON (chain) chain, run_id, script
+        FROM ingest_run WHERE chain <> '' AND stage = 'prices'
+        ORDER BY chain, finished_at DESC
+      )
+      SELECT l.chain, l.script,
+             MAX(r.finished_at) as finished_at,
+             SUM(r.seconds)::float as seconds,
+             SUM(r.rows) FILTER (WHERE r.stage = 'prices')::int as rows,
+             BOOL_AND(r.ok) as ok,
+             EXTRACT(EPOCH FROM NOW() - MAX(r.finished_at))::float / 3600 as age_hours
+      FROM last l JOIN ingest_run r ON r.run_id = l.run_id AND r.chain = l.chain
+      GROUP BY l.chain, l.script
+    `);
+    return new Map(rows.map(r => [r.chain, {
+      script: r.script, finishedAt: r.finished_at, seconds: Math.round(r.seconds * 10) / 10,
+      rows: r.rows, ok: r.ok, ageHours: Math.round(r.age_hours * 10) / 10,
+    }]));
+  } catch {
+    // ingest_run is created by the first instrumented run
+    return new Map();
+  }
+}
+
 export async function statusRoutes(app: FastifyInstance) {
   app.get('/api/status', async () => {
-    const { rows } = await query(`
+    const [{ rows }, runs] = await Promise.all([query(`
       SELECT rc.name,
              COUNT(DISTINCT s.id)::int as stores,
-             COUNT(sp.id)::int as prices,
+             COUNT(*)::int as prices,
              COUNT(DISTINCT sp.product_id)::int as products,
              MAX(sp.updated_at) as last_update
       FROM retailer_chain rc
       JOIN store s ON s.chain_id = rc.id
       JOIN store_price sp ON sp.store_id = s.id
       GROUP BY rc.name
-      ORDER BY COUNT(sp.id) DESC
-    `);
-    const chains = rows.map(r => ({ name: r.name, stores: r.stores, products: r.products, prices: r.prices, lastUpdate: r.last_update }));
+      ORDER BY COUNT(*) DESC
+    `), lastRuns()]);
+    const chains = rows.map(r => ({ name: r.name, stores: r.stores, products: r.products, prices: r.prices, lastUpdate: r.last_update, lastRun: runs.get(r.name) || null }));
     const totals = { stores: chains.reduce((s, c) => s + c.stores, 0), products: chains.reduce((s, c) => s + c.products, 0), prices: chains.reduce((s, c) => s + c.prices, 0) };
     return { chains, totals, lastUpdate: chains[0]?.lastUpdate || null };
   });
@@ -0,0 +1,62 @@
+"""Batch sizes for DB writes, tuned at run time from how long each batch took.
+
+    sizer = BatchSizer('promos', start=5000)
+    for batch in batches:                    # each cut at sizer.size, read before the batch
+        with sizer.timed(len(batch)) as t:
+            t.bytes = len(sql)               # statement size, if known
+            cur.execute(sql); conn.commit()
+    print(sizer.summary())
+
+Each batch's seconds per row (smoothed) gives the size that would take
+BATCH_TARGET_SECONDS; the size moves toward it by at most 2x per batch,
+stays within [lo, hi], and is capped so one batch's statement stays under
+BATCH_MAX_MB. A fast, nearby Postgres ends up with big batches, a slow or
+distant one with smaller batches that still commit regularly.
+BATCH_ADAPT=0 keeps every sizer at its start size.
+"""
+import os, time
+from contextlib import contextmanager
+
+TARGET_SECONDS = float(os.environ.get('BATCH_TARGET_SECONDS', '2'))
+MAX_BYTES = int(float(os.environ.get('BATCH_MAX_MB', '64')) * 1024 * 1024)
+# Weight of the newest batch in the smoothed seconds/row and bytes/row
+SMOOTHING = 0.3
+
+class _Timing:
+    bytes = 0
+
+class BatchSizer:
+    def __init__(self, name, start, lo=100, hi=200000, target=TARGET_SECONDS, max_bytes=MAX_BYTES):
+        self.name, self.size, self.lo, self.hi = name, start, lo, hi
+        self.target, self.max_bytes = target, max_bytes
+        self.adapt = os.environ.get('BATCH_ADAPT', '1') != '0'
+        self.per_row = self.bytes_per_row = None
+        self.sizes = []     # size in effect for each observed batch
+        self.seconds = 0.0
+
+    @contextmanager
+    def timed(self, rows):
+        """Time the block as one batch of `rows`; set .bytes on the yielded object to count statement size."""
+        t, t0 = _Timing(), time.perf_counter()
+        yield t
+        self.observe(rows, time.perf_counter() - t0, t.bytes)
+
+    def observe(self, rows, seconds, nbytes=0):
+        """Record a finished batch and pick the next size."""
+        self.sizes.append(self.size); self.seconds += seconds
+        if not rows or not self.adapt: return
+        self.per_row = _smooth(self.per_row, seconds / rows)
+        if nbytes: self.bytes_per_row = _smooth(self.bytes_per_row, nbytes / rows)
+        want = self.target / self.per_row if self.per_row > 0 else self.hi
+        want = min(max(want, self.size / 2), self.size * 2)
+        if self.bytes_per_row: want = min(want, self.max_bytes / self.bytes_per_row)
+        self.size = int(min(max(want, self.lo), self.hi))
+
+    def summary(self):
+        """One line for the log: the sizes chosen and the time spent writing."""
+        if not self.sizes: return f"{self.name}: no batches"
+        return (f"{self.name}: {len(self.sizes)} batches in {self.seconds:.1f}s, "
+                f"size {self.sizes[0]} -> {self.size} (min {min(self.sizes)}, max {max(self.sizes)})")
+
+def _smooth(old, new):
+    return new if old is None else old + SMOOTHING * (new - old)
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""Benchmark the ingest scripts on synthetic Kaggle-shaped data.
+
+Generates price_full_file_* / store_file_* / promo_full_file_* CSVs for N
+chains (promo files rotate through the items_json, itemcode and groups
+formats), packs them as a cached Kaggle archive, and runs each stage as a
+subprocess against a throwaway Postgres. Per stage it reports wall time,
+rows/sec, peak RSS (including worker processes) and DB round trips
+(statements, COPYs and commits), and saves everything as JSON.
+
+The benchmark database is wiped: it must be empty or one this script set up
+before, and it can never be the DATABASE_URL database.
+
+  python scripts/benchmark.py --db postgresql://localhost/savy_bench --stores 50 --items 20000
+  python scripts/benchmark.py --db ... --compare bench-results/20261001-120000.json
+"""
+import argparse, csv, functools, json, os, platform, random, runpy, shutil, subprocess, sys, tempfile, time, zipfile
+from pathlib import Path
+
+SCRIPTS = Path(__file__).resolve().parent
+DATASET = "erlichsefi/israeli-supermarkets-2024"
+# (file key, retailer_chain.name) pairs every ingest script knows
+CHAINS = [('shufersal', 'Shufersal'), ('rami_levy', 'Rami Levy'), ('osher_ad', 'Osher Ad'),
+          ('tiv_taam', 'Tiv Taam'), ('hazi_hinam', 'Hazi Hinam'), ('bareket', 'Bareket'),
+          ('dor_alon', 'Dor Alon'), ('good_pharm', 'Good Pharm'), ('king_store', 'King Store'),
+          ('maayan_2000', 'Maayan 2000')]
+PROMO_FORMATS = ['items_json', 'itemcode', 'groups']
+
+# stage -> (script, extra args, what its rows/sec is counted in, INGEST_FORCE).
+# The warm stage is not forced: it measures the ledger skip and cache reuse of a rerun.
+STAGES = {
+    'update_prices': ('update_prices.py', [], 'prices', True),
+    'update_prices_warm': ('update_prices.py', [], 'prices', False),
+    'promo_engine': ('promo_engine.py', [], 'promos', True),
+}
+
+SCHEMA = """SET client_min_messages = warning;
+DROP SCHEMA public CASCADE; CREATE SCHEMA public;
+CREATE TABLE bench_marker (created_at TIMESTAMP DEFAULT NOW());
+CREATE TABLE retailer_chain (id SERIAL PRIMARY KEY, name TEXT UNIQUE, name_he TEXT, is_active BOOLEAN DEFAULT true);
+CREATE TABLE store (id SERIAL PRIMARY KEY, chain_id INT REFERENCES retailer_chain(id), store_code TEXT, name TEXT,
+    city TEXT, address TEXT, lat DOUBLE PRECISION, lng DOUBLE PRECISION, subchain_name TEXT, subchain_id INT,
+    UNIQUE (chain_id, store_code));
+CREATE TABLE product (id SERIAL PRIMARY KEY, barcode TEXT UNIQUE, name TEXT, min_price NUMERIC, store_count INT,
+    category TEXT, subcategory TEXT, image_url TEXT, brand TEXT);
+CREATE TABLE store_price (id SERIAL PRIMARY KEY, product_id INT REFERENCES product(id), store_id INT REFERENCES store(id),
+    price NUMERIC, is_promo BOOLEAN DEFAULT false, promo_price NUMERIC, UNIQUE (product_id, store_id));
+CREATE TABLE promotion (id SERIAL PRIMARY KEY, store_id INT, chain_promotion_id TEXT, description TEXT,
+    start_date TIMESTAMP, end_date TIMESTAMP, discounted_price NUMERIC, discount_rate NUMERIC, discount_type TEXT,
+    min_qty NUMERIC, max_qty NUMERIC, min_purchase_amount NUMERIC, is_club_only BOOLEAN, reward_type TEXT,
+    category TEXT, subcategory TEXT, item_count INT, updated_at TIMESTAMP, UNIQUE (store_id, chain_promotion_id));
+CREATE TABLE promotion_item (id SERIAL PRIMARY KEY, promotion_id INT REFERENCES promotion(id),
+    product_id INT REFERENCES product(id), UNIQUE (promotion_id, product_id));
+"""
+
+# --- data generation ---------------------------------------------------------
+
+def item_name(rng, barcode):
+    words = ['חלב', 'לחם', 'גבינה', 'שוקולד', 'קפה', 'במבה', 'אורז', 'שמן', 'טונה', 'יוגורט']
+    name = f"{rng.choice(words)} {rng.choice(words)} {rng.randint(1, 9) * 100} גרם"
+    # Real files carry quotes, commas and the odd tab inside item names
+    return name + (' "מהדורה" , מוגבלת' if barcode.endswith('7') else '') + ('\tx' if barcode.endswith('99') else '')
+
+def write_chain(out, key, chain_idx, fmt, args, rng):
+    """Write one chain's store, price and promo files. Returns (price rows, promo rows)."""
+    barcodes = [str(7290000000000 + chain_idx * 1000 + i * 7919 % 10**6 + i) for i in range(args.items)]
+    base = {bc: round(rng.uniform(1, 80), 2) for bc in barcodes}
+    stores = [str(s) for s in range(1, args.stores + 1)]
+    with open(out / f"store_file_{key}.csv", 'w', newline='', encoding='utf-8') as f:
+        w = csv.writer(f)
+        w.writerow(['chainid', 'storeid', 'storename', 'city', 'address'])
+        for s in stores:
+            w.writerow([chain_idx, s, f"סניף {s}", f"עיר {int(s) % 40}", f"רחוב {s} {int(s) * 3}"])
+    prices = 0
+    with open(out / f"price_full_file_{key}.csv", 'w', newline='', encoding='utf-8') as f:
+        w = csv.writer(f)
+        w.writerow(['chainid', 'storeid', 'itemcode', 'itemname', 'itemprice', 'manufacturername'])
+        for s in stores:
+            first = True
+            for bc in barcodes:
+                if rng.random() > args.assortment: continue
+                # Most items cost the same chain-wide; a few stores deviate
+                price = base[bc] if rng.random() > args.store_variance else round(base[bc] * rng.uniform(0.8, 1.2), 2)
+                # storeid is often only on a store's first row (the loaders carry it forward)
+                sid = s if first or rng.random() < 0.3 else ''
+                w.writerow([chain_idx, sid, bc, item_name(rng, bc), f"{price:.2f}", 'יצרן'])
+                first = False; prices += 1
+            w.writerow([chain_idx, s, '12', 'קוד פנימי', '1.00', ''])
+            prices += 1
+    promos = 0
+    pick = lambda n: rng.sample(barcodes, min(n, len(barcodes)))
+    with open(out / f"promo_full_file_{key}.csv", 'w', newline='', encoding='utf-8') as f:
+        w = csv.writer(f)
+        if fmt == 'items_json':
+            w.writerow(['chainid', 'storeid', 'promotionid', 'promotiondescription', 'promotionstartdate',
+                        'promotionenddate', 'minqty', 'maxqty', 'discountedprice', 'discountrate', 'discounttype',
+                        'minpurchaseamnt', 'rewardtype', 'clubs', 'promotionitems'])
+        elif fmt == 'itemcode':
+            w.writerow(['chainid', 'storeid', 'promotionid', 'promotiondescription', 'promotionstartdatetime',
+                        'promotionenddatetime', 'minnoofitemoffered', 'discountedprice', 'itemcode', 'promoprice', 'itemprice'])
+        else:
+            w.writerow(['chainid', 'storeid', 'promotionid', 'promotiondescription', 'promotionstartdate',
+                        'promotionenddate', 'groups'])
+        for s in stores:
+            for p in range(args.promos):
+                pid, desc, price = str(100000 + p), f"מבצע {p}", f"{rng.uniform(2, 50):.2f}"
+                if fmt == 'items_json':
+                    items = [{'itemcode': bc, 'isgiftitem': '0', 'itemtype': '1'} for bc in pick(rng.randint(1, 40))]
+                    blob = {'item': items if len(items) > 1 else items[0]}
+                    # Both Python-repr and JSON encodings appear in the dump
+                    w.writerow([chain_idx, s, pid, desc, '2026-10-01 00:00:00', '2026-10-30 23:59:00', '1', '', price,
+                                '', '1', '', '1', repr({'clubid': str(p % 2)}), repr(blob) if p % 3 else json.dumps(blob)])
+                    promos += 1
+                elif fmt == 'itemcode':
+                    for j, bc in enumerate(pick(rng.randint(1, 10))):
+                        w.writerow([chain_idx, s if p == 0 and j == 0 else '', pid if j == 0 else '', desc if j == 0 else '',
+                                    '2026-10-01T00:00:00', '2026-10-30T00:00:00', '2', price, bc,
+                                    f"{rng.uniform(2, 50):.2f}", ''])
+                        promos += 1
+                else:
+                    groups = []
+                    for g in range(rng.randint(1, 3)):
+                        its = [{'itemcode': bc} for bc in pick(rng.randint(1, 8))]
+                        groups.append({'groupid': str(g), 'promotionitems': repr({'promotionitem': its if len(its) > 1 else its[0]})})
+                    w.writerow([chain_idx, s, pid, desc, '2026-10-01', '2026-10-30',
+                                repr({'group': groups if len(groups) > 1 else groups[0]})])
+                    promos += 1
+    return prices, promos
+
+def generate(workdir, args):
+    """Write all chains' CSVs and pack them as the cached Kaggle archive the loaders read offline."""
+    rng = random.Random(args.seed)
+    csvs = workdir / 'csv'
+    csvs.mkdir(parents=True)
+    rows = {'prices': 0, 'promos': 0}
+    for i, (key, _) in enumerate(CHAINS[:args.chains]):
+        prices, promos = write_chain(csvs, key, i + 1, PROMO_FORMATS[i % len(PROMO_FORMATS)], args, rng)
+        rows['prices'] += prices; rows['promos'] += promos
+    archive = workdir / '.cache' / 'kaggle' / DATASET.replace('/', '__') / 'bench.zip'
+    archive.parent.mkdir(parents=True)
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for p in sorted(csvs.iterdir()):
+            zf.write(p, p.name)
+    rows['bytes'] = sum(p.stat().st_size for p in csvs.iterdir())
+    return rows
+
+# --- running stages ----------------------------------------------------------
+
+def reset_db(db_url, chains):
+    import psycopg2
+    conn = psycopg2.connect(db_url)
+    cur = conn.cursor()
+    cur.execute("""SELECT to_regclass('bench_marker') IS NOT NULL,
+        (SELECT COUNT(*) FROM pg_tables WHERE schemaname = 'public')""")
+    marked, tables = cur.fetchone()
+    if tables and not marked:
+        sys.exit(f"Refusing to wipe {db_url}: it has tables and was not created by the benchmark")
+    cur.execute(SCHEMA)
+    cur.execute("INSERT INTO bench_marker DEFAULT VALUES")
+    cur.execute("INSERT INTO retailer_chain (name) SELECT unnest(%s::text[])", ([name for _, name in CHAINS[:chains]],))
+    cur.execute("SHOW server_version")
+    version = cur.fetchone()[0]
+    conn.commit(); conn.close()
+    return version
+
+def run_stage(name, args, workdir, rows):
+    script, extra, unit, force = STAGES[name]
+    counters = Path(tempfile.mkdtemp(dir=workdir, prefix=f'{name}-'))
+    cmd = [sys.executable, str(SCRIPTS / 'benchmark.py'), '--exec', str(counters), str(SCRIPTS / script), *extra]
+    if script == 'update_prices.py': cmd += ['--workers', str(args.workers)]
+    report = workdir / f'{name}.report.json'
+    env = dict(os.environ, DATABASE_URL=args.db, KAGGLE_OFFLINE='1', INGEST_FORCE='1' if force else '0',
+               PRODUCT_CACHE=str(workdir / '.cache' / 'product_index.bin'), RUN_REPORT=str(report), RUN_REPORT_DB='0')
+    log = open(workdir / f'{name}.log', 'w')
+    t0 = time.time()
+    proc = subprocess.Popen(cmd, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    # wait4 reports the peak RSS of the stage and of the worker processes it reaped
+    _, status, usage = os.wait4(proc.pid, 0)
+    elapsed = time.time() - t0
+    log.close()
+    trips = sum(int(p.read_text() or 0) for p in counters.iterdir())
+    ok = os.waitstatus_to_exitcode(status) == 0
+    if not ok:
+        print(f"  {name} FAILED, last lines of {name}.log:")
+        print(''.join((workdir / f'{name}.log').read_text(errors='replace').splitlines(True)[-15:]))
+    return {'ok': ok, 'seconds': round(elapsed, 3), 'rows': rows[unit], 'rows_per_sec': round(rows[unit] / elapsed, 1),
+            'peak_rss_mb': round(usage.ru_maxrss / 1024, 1), 'round_trips': trips,
+            # The script's own per-stage breakdown (run_metrics)
+            'breakdown': json.loads(report.read_text())['stages'] if report.exists() else None}
+
+def exec_counted(counter_dir, script, argv):
+    """Stage subprocess entry point: count DB round trips, then run the script as __main__."""
+    import psycopg2, psycopg2.extensions as ext
+    state = {'pid': None, 'n': 0}
+    def hit(n=1):
+        # Per-process counter files, rewritten on every call: pool workers are killed, not exited
+        if state['pid'] != os.getpid(): state.update(pid=os.getpid(), n=0)
+        state['n'] += n
+        (Path(counter_dir) / str(state['pid'])).write_text(str(state['n']))
+
+    class CountingCursor(ext.cursor):
+        def execute(self, *a, **k): hit(); return super().execute(*a, **k)
+        def executemany(self, query, params): params = list(params); hit(len(params)); return super().executemany(query, params)
+        def copy_expert(self, *a, **k): hit(); return super().copy_expert(*a, **k)
+        def copy_from(self, *a, **k): hit(); return super().copy_from(*a, **k)
+        def callproc(self, *a, **k): hit(); return super().callproc(*a, **k)
+
+    @functools.lru_cache(None)
+    def counting(base, mixin):
+        # Stack the counter under whatever factory the script asked for (run_metrics has its own)
+        return base if issubclass(base, mixin) else type(f'Bench{base.__name__}', (base, mixin), {})
+
+    class CountingConnection(ext.connection):
+        def cursor(self, *a, **k):
+            k['cursor_factory'] = counting(k.get('cursor_factory') or ext.cursor, CountingCursor)
+            return super().cursor(*a, **k)
+        def commit(self): hit(); return super().commit()
+        def rollback(self): hit(); return super().rollback()
+
+    connect = psycopg2.connect
+    def counted_connect(*a, connection_factory=None, **k):
+        return connect(*a, connection_factory=counting(connection_factory or ext.connection, CountingConnection), **k)
+    psycopg2.connect = counted_connect
+    sys.argv = [script, *argv]
+    runpy.run_path(script, run_name='__main__')
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SCRIPTS, capture_output=True,
+                              text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+def compare(old_path, result):
+    old = json.loads(Path(old_path).read_text())
+    print(f"\nvs {old_path} ({old['meta'].get('revision')}):")
+    for name, cur in result['stages'].items():
+        prev = old['stages'].get(name)
+        if not prev: continue
+        pct = lambda a, b: f"{(b - a) / a * 100:+.0f}%" if a else "n/a"
+        print(f"  {name:<20} {prev['seconds']:>8.1f}s -> {cur['seconds']:>8.1f}s ({pct(prev['seconds'], cur['seconds'])})"
+              f"  rss {prev['peak_rss_mb']:.0f} -> {cur['peak_rss_mb']:.0f}MB"
+              f"  trips {prev['round_trips']} -> {cur['round_trips']}")
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--exec':
+        return exec_counted(sys.argv[2], sys.argv[3], sys.argv[4:])
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=os.environ.get('BENCH_DATABASE_URL'), help="throwaway database (BENCH_DATABASE_URL)")
+    parser.add_argument('--chains', type=int, default=3, help=f"chains to generate (max {len(CHAINS)})")
+    parser.add_argument('--stores', type=int, default=20, help="stores per chain")
+    parser.add_argument('--items', type=int, default=5000, help="items in each chain's assortment")
+    parser.add_argument('--promos', type=int, default=30, help="promotions per store")
+    parser.add_argument('--assortment', type=float, default=0.9, help="share of the assortment each store carries")
+    parser.add_argument('--store-variance', type=float, default=0.05, help="share of store prices that differ from the chain price")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=1, help="passed to update_prices")
+    parser.add_argument('--stages', default=','.join(STAGES), help="comma-separated, in run order")
+    parser.add_argument('--out', default=None, help="result JSON (default bench-results/<timestamp>.json)")
+    parser.add_argument('--compare', help="earlier result JSON to diff against")
+    parser.add_argument('--keep', action='store_true', help="keep the generated data and stage logs")
+    args = parser.parse_args()
+    if not args.db: parser.error("--db or BENCH_DATABASE_URL is required")
+    if args.db == os.environ.get('DATABASE_URL'): parser.error("the benchmark database must not be DATABASE_URL")
+    args.chains = min(args.chains, len(CHAINS))
+    stages = [s for s in args.stages.split(',') if s]
+    unknown = [s for s in stages if s not in STAGES]
+    if unknown: parser.error(f"unknown stages: {', '.join(unknown)}")
+
+    workdir = Path(tempfile.mkdtemp(prefix='savy-bench-'))
+    try:
+        t0 = time.time()
+        rows = generate(workdir, args)
+        print(f"Generated {rows['prices']} price rows, {rows['promos']} promo rows "
+              f"({rows['bytes'] / 1024 / 1024:.1f}MB) in {time.time() - t0:.1f}s", flush=True)
+        server = reset_db(args.db, args.chains)
+
+        result = {'meta': {'revision': git_revision(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                           'python': platform.python_version(), 'postgres': server,
+                           'scale': {k: getattr(args, k) for k in ('chains', 'stores', 'items', 'promos', 'assortment',
+                                                                   'store_variance', 'seed', 'workers')},
+                           'data': rows},
+                  'stages': {}}
+        for name in stages:
+            r = run_stage(name, args, workdir, rows)
+            result['stages'][name] = r
+            print(f"  {name:<20} {r['seconds']:>8.1f}s {r['rows_per_sec']:>10.0f} rows/s "
+                  f"{r['peak_rss_mb']:>7.0f}MB RSS {r['round_trips']:>8} round trips{'' if r['ok'] else '  FAILED'}", flush=True)
+
+        out = Path(args.out or f"bench-results/{time.strftime('%Y%m%d-%H%M%S')}.json")
+        out.parent.mkdir(parents=True, exist_ok=True)
+        out.write_text(json.dumps(result, indent=2))
+        print(f"Saved {out}")
+        if args.compare: compare(args.compare, result)
+    finally:
+        if args.keep: print(f"Kept {workdir}")
+        else: shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -4,9 +4,9 @@ categorize_with_claude.py
 מסווג מוצרים ללא קטגוריה באמצעות Claude API — batch של 50 מוצרים בכל קריאה.
 """
 import os, logging, sys, json, time
-import psycopg2
 from psycopg2.extras import execute_values
 import anthropic
+from run_metrics import RunMetrics
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s", handlers=[logging.StreamHandler(sys.stdout)])
 log = logging.getLogger(__name__)
@@ -58,7 +58,8 @@ def main():
     if not api_key: raise ValueError("ANTHROPIC_API_KEY not set")
 
     client = anthropic.Anthropic(api_key=api_key)
-    conn = psycopg2.connect(db_url)
+    metrics = RunMetrics("categorize_with_claude")
+    conn = metrics.connect(db_url)
     conn.autocommit = False
     cur = conn.cursor()
 
@@ -85,7 +86,9 @@ def main():
         batch_num = i // BATCH_SIZE + 1
         total_batches = (total + BATCH_SIZE - 1) // BATCH_SIZE
         try:
-            classifications = classify_batch(client, batch)
+            with metrics.stage("classify") as s:
+                classifications = classify_batch(client, batch)
+                s.add(rows=len(batch))
             for local_idx, (product_id, name) in enumerate(batch):
                 category = classifications.get(local_idx, "אחר")
                 if category not in CATEGORIES:
@@ -98,23 +101,28 @@ def main():
             errors += len(batch)
 
         if len(updates) >= DB_COMMIT_EVERY:
-            execute_values(cur,
-                "UPDATE product SET category=data.cat FROM (VALUES %s) AS data(cat, id) WHERE product.id=data.id::integer",
-                updates)
-            conn.commit()
+            with metrics.stage("update") as s:
+                execute_values(cur,
+                    "UPDATE product SET category=data.cat FROM (VALUES %s) AS data(cat, id) WHERE product.id=data.id::integer",
+                    updates)
+                conn.commit()
+                s.add(rows=len(updates))
             log.info("💾 commit — %d מוצרים נשמרו", len(updates))
             updates = []
 
         time.sleep(SLEEP_BETWEEN)
 
     if updates:
-        execute_values(cur,
-            "UPDATE product SET category=data.cat FROM (VALUES %s) AS data(cat, id) WHERE product.id=data.id::integer",
-            updates)
-        conn.commit()
+        with metrics.stage("update") as s:
+            execute_values(cur,
+                "UPDATE product SET category=data.cat FROM (VALUES %s) AS data(cat, id) WHERE product.id=data.id::integer",
+                updates)
+            conn.commit()
+            s.add(rows=len(updates))
         log.info("💾 commit סופי — %d מוצרים נשמרו", len(updates))
 
     log.info("✅ הסתיים! %d סווגו, %d שגיאות", done, errors)
+    metrics.finish(conn, ok=errors == 0)
     conn.close()
 
 if __name__ == "__main__":
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""Chain-level prices with sparse per-store overrides, read through a store_price view.
+
+Most chains charge the same price for an item in every branch, so after
+`migrate` the rows live in:
+  chain_price            one row per (chain, product): the dominant price, and whether
+                         the product is sold in most of the chain's stores ("everywhere")
+  store_price_override   (store, product) rows that differ from that: another price, a
+                         store carrying a non-everywhere product, or price NULL for an
+                         everywhere product the store does not sell
+  store_promo            is_promo / promo_price per (store, product)
+  price_store            stores that have a price list
+  store_price            a view with the old (product_id, store_id, price, is_promo,
+                         promo_price, updated_at) shape, without the surrogate id (count
+                         rows with COUNT(*)); INSTEAD OF triggers turn the promo scripts'
+                         and scrapers' writes into writes on the tables above
+
+update_prices stages a chain's whole price file and rebuilds its rows in one
+transaction (ChainLoad). The old table is kept as store_price_rows.
+
+Usage:
+  python scripts/chain_prices.py migrate    # store_price table -> tables + view
+  python scripts/chain_prices.py rollback   # materialize the view back into the store_price table
+"""
+import os, sys
+import psycopg2
+from price_history import history_ctes
+
+VIEW = """CREATE VIEW store_price AS
+    SELECT cp.product_id, ps.store_id, COALESCE(o.price, cp.price) AS price,
+        pr.store_id IS NOT NULL AS is_promo, pr.promo_price,
+        COALESCE(o.updated_at, cp.updated_at) AS updated_at
+    FROM chain_price cp
+    JOIN price_store ps ON ps.chain_id = cp.chain_id
+    LEFT JOIN store_price_override o ON o.store_id = ps.store_id AND o.product_id = cp.product_id
+    LEFT JOIN store_promo pr ON pr.store_id = ps.store_id AND pr.product_id = cp.product_id
+    WHERE CASE WHEN cp.everywhere THEN o.store_id IS NULL OR o.price IS NOT NULL ELSE o.price IS NOT NULL END"""
+
+TRIGGER = """CREATE OR REPLACE FUNCTION store_price_write() RETURNS trigger LANGUAGE plpgsql AS $$
+    DECLARE chain INTEGER;
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            INSERT INTO store_price_override (store_id, product_id, price) VALUES (OLD.store_id, OLD.product_id, NULL)
+            ON CONFLICT (store_id, product_id) DO UPDATE SET price = NULL, updated_at = NOW();
+            DELETE FROM store_promo WHERE store_id = OLD.store_id AND product_id = OLD.product_id;
+            RETURN OLD;
+        END IF;
+        IF TG_OP = 'INSERT' OR NEW.price IS DISTINCT FROM OLD.price THEN
+            SELECT chain_id INTO chain FROM store WHERE id = NEW.store_id;
+            INSERT INTO price_store (store_id, chain_id) VALUES (NEW.store_id, chain) ON CONFLICT DO NOTHING;
+            INSERT INTO chain_price (chain_id, product_id, price, everywhere) VALUES (chain, NEW.product_id, NEW.price, false)
+            ON CONFLICT DO NOTHING;
+            INSERT INTO store_price_override (store_id, product_id, price) VALUES (NEW.store_id, NEW.product_id, NEW.price)
+            ON CONFLICT (store_id, product_id) DO UPDATE SET price = EXCLUDED.price, updated_at = NOW();
+        END IF;
+        IF NEW.is_promo THEN
+            INSERT INTO store_promo (store_id, product_id, promo_price) VALUES (NEW.store_id, NEW.product_id, NEW.promo_price)
+            ON CONFLICT (store_id, product_id) DO UPDATE SET promo_price = EXCLUDED.promo_price;
+        ELSIF TG_OP = 'UPDATE' AND OLD.is_promo THEN
+            DELETE FROM store_promo WHERE store_id = NEW.store_id AND product_id = NEW.product_id;
+        END IF;
+        RETURN NEW;
+    END $$"""
+
+def is_chain_layout(cur):
+    cur.execute("SELECT relkind = 'v' FROM pg_class WHERE oid = to_regclass('store_price')")
+    row = cur.fetchone()
+    return bool(row and row[0])
+
+def create_stage(cur):
+    """Per-session table holding one chain's full snapshot."""
+    cur.execute("""CREATE TEMP TABLE IF NOT EXISTS chain_stage (
+        product_id INTEGER, store_id INTEGER, price NUMERIC, PRIMARY KEY (product_id, store_id))""")
+    cur.execute("TRUNCATE chain_stage")
+
+def apply_stage(cur, chain_id):
+    """Rewrite the chain's chain_price / override / price_store rows from chain_stage, touching only what differs."""
+    cur.execute("SELECT COUNT(DISTINCT store_id) FROM chain_stage")
+    stores = cur.fetchone()[0]
+    cur.execute("DROP TABLE IF EXISTS chain_dom")
+    cur.execute("""CREATE TEMP TABLE chain_dom AS
+        SELECT product_id, mode() WITHIN GROUP (ORDER BY price) AS price, COUNT(*) * 2 > %s AS everywhere
+        FROM chain_stage GROUP BY product_id""", (stores,))
+    cur.execute("ALTER TABLE chain_dom ADD PRIMARY KEY (product_id)")
+    cur.execute("""WITH gone AS (DELETE FROM price_store ps WHERE ps.chain_id = %(c)s
+            AND NOT EXISTS (SELECT 1 FROM chain_stage s WHERE s.store_id = ps.store_id) RETURNING 1)
+        INSERT INTO price_store (store_id, chain_id) SELECT DISTINCT store_id, %(c)s FROM chain_stage
+        ON CONFLICT (store_id) DO NOTHING""", {'c': chain_id})
+    cur.execute("""WITH gone AS (DELETE FROM chain_price cp WHERE cp.chain_id = %(c)s
+            AND NOT EXISTS (SELECT 1 FROM chain_dom d WHERE d.product_id = cp.product_id) RETURNING 1)
+        INSERT INTO chain_price (chain_id, product_id, price, everywhere) SELECT %(c)s, product_id, price, everywhere FROM chain_dom
+        ON CONFLICT (chain_id, product_id) DO UPDATE SET price = EXCLUDED.price, everywhere = EXCLUDED.everywhere, updated_at = NOW()
+        WHERE (chain_price.price, chain_price.everywhere) IS DISTINCT FROM (EXCLUDED.price, EXCLUDED.everywhere)""",
+        {'c': chain_id})
+    cur.execute("DROP TABLE IF EXISTS chain_ovr")
+    cur.execute("""CREATE TEMP TABLE chain_ovr AS
+        SELECT s.store_id, s.product_id, s.price FROM chain_stage s JOIN chain_dom d USING (product_id)
+        WHERE NOT d.everywhere OR s.price <> d.price
+        UNION ALL
+        SELECT ps.store_id, d.product_id, NULL FROM chain_dom d JOIN price_store ps ON ps.chain_id = %s
+        WHERE d.everywhere AND NOT EXISTS (SELECT 1 FROM chain_stage s WHERE s.product_id = d.product_id AND s.store_id = ps.store_id)""",
+        (chain_id,))
+    cur.execute("""WITH gone AS (DELETE FROM store_price_override o
+            WHERE o.store_id IN (SELECT id FROM store WHERE chain_id = %s)
+            AND NOT EXISTS (SELECT 1 FROM chain_ovr n WHERE n.store_id = o.store_id AND n.product_id = o.product_id) RETURNING 1)
+        INSERT INTO store_price_override (store_id, product_id, price) SELECT store_id, product_id, price FROM chain_ovr
+        ON CONFLICT (store_id, product_id) DO UPDATE SET price = EXCLUDED.price, updated_at = NOW()
+        WHERE store_price_override.price IS DISTINCT FROM EXCLUDED.price""", (chain_id,))
+    cur.execute("SELECT (SELECT COUNT(*) FROM chain_dom), (SELECT COUNT(*) FROM chain_ovr)")
+    return cur.fetchone()
+
+class ChainLoad:
+    """One chain's snapshot, collected chunk by chunk from tmp_prices and applied in one transaction.
+
+    The dominant price needs every store of the chain, so nothing is written
+    until finish(). Stores missing from the file keep their current prices.
+    """
+    def __init__(self, cur, chain_id):
+        self.chain_id = chain_id
+        create_stage(cur)
+
+    def stage(self, cur, stores):
+        cur.execute("""INSERT INTO chain_stage SELECT product_id, store_id, price FROM tmp_prices
+            ON CONFLICT (product_id, store_id) DO UPDATE SET price = EXCLUDED.price""")
+        return 0, 0, []
+
+    def finish(self, conn):
+        """Diff against the view, record history and rebuild. Returns (inserted, changed, removed, touched ids)."""
+        cur = conn.cursor()
+        cur.execute("""INSERT INTO chain_stage SELECT v.product_id, v.store_id, v.price FROM store_price v
+            WHERE v.store_id IN (SELECT store_id FROM price_store WHERE chain_id = %s)
+            AND v.store_id NOT IN (SELECT DISTINCT store_id FROM chain_stage)""", (self.chain_id,))
+        cur.execute(f"""WITH old AS (
+                SELECT v.product_id, v.store_id, v.price FROM store_price v
+                WHERE v.store_id IN (SELECT store_id FROM price_store WHERE chain_id = %s)),
+            d AS (
+                SELECT COALESCE(n.product_id, o.product_id) AS product_id, COALESCE(n.store_id, o.store_id) AS store_id,
+                    o.price AS old_price, n.price AS new_price
+                FROM chain_stage n FULL JOIN old o ON o.product_id = n.product_id AND o.store_id = n.store_id
+                WHERE o.price IS DISTINCT FROM n.price),
+            {history_ctes("SELECT product_id, store_id, new_price AS price FROM d WHERE new_price IS NOT NULL",
+                          "SELECT product_id, store_id FROM d WHERE old_price IS NOT NULL")}
+            SELECT COUNT(*) FILTER (WHERE old_price IS NULL), COUNT(*) FILTER (WHERE old_price IS NOT NULL AND new_price IS NOT NULL),
+                COUNT(*) FILTER (WHERE new_price IS NULL), ARRAY(SELECT DISTINCT product_id FROM d) FROM d""",
+            (self.chain_id,))
+        counts = cur.fetchone()
+        apply_stage(cur, self.chain_id)
+        cur.execute("TRUNCATE chain_stage")
+        conn.commit()
+        return counts
+
+    def drop(self, cur):
+        cur.execute("TRUNCATE chain_stage")
+
+def migrate(conn):
+    cur = conn.cursor()
+    if is_chain_layout(cur):
+        print("store_price is already a chain-level view"); return
+    cur.execute("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('store_price'))")
+    if cur.fetchone()[0]:
+        print("store_price is partitioned; the two layouts cannot be combined"); sys.exit(1)
+    cur.execute("LOCK TABLE store_price IN ACCESS EXCLUSIVE MODE")
+    cur.execute("CREATE TABLE price_store (store_id INTEGER PRIMARY KEY, chain_id INTEGER NOT NULL)")
+    cur.execute("CREATE INDEX ON price_store (chain_id)")
+    cur.execute("""CREATE TABLE chain_price (chain_id INTEGER NOT NULL, product_id INTEGER NOT NULL, price NUMERIC NOT NULL,
+        everywhere BOOLEAN NOT NULL, updated_at TIMESTAMP NOT NULL DEFAULT NOW(), PRIMARY KEY (chain_id, product_id))""")
+    cur.execute("CREATE INDEX ON chain_price (product_id)")
+    cur.execute("""CREATE TABLE store_price_override (store_id INTEGER NOT NULL, product_id INTEGER NOT NULL, price NUMERIC,
+        updated_at TIMESTAMP NOT NULL DEFAULT NOW(), PRIMARY KEY (store_id, product_id))""")
+    cur.execute("CREATE INDEX ON store_price_override (product_id)")
+    cur.execute("""CREATE TABLE store_promo (store_id INTEGER NOT NULL, product_id INTEGER NOT NULL, promo_price NUMERIC,
+        PRIMARY KEY (store_id, product_id))""")
+    cur.execute("""INSERT INTO store_promo SELECT store_id, product_id, promo_price FROM store_price
+        WHERE is_promo ON CONFLICT DO NOTHING""")
+    create_stage(cur)
+    cur.execute("SELECT DISTINCT s.chain_id FROM store s WHERE s.chain_id IS NOT NULL ORDER BY 1")
+    rows = 0
+    for (chain_id,) in cur.fetchall():
+        cur.execute("TRUNCATE chain_stage")
+        cur.execute("""INSERT INTO chain_stage SELECT sp.product_id, sp.store_id, sp.price FROM store_price sp
+            JOIN store s ON s.id = sp.store_id WHERE s.chain_id = %s AND sp.price IS NOT NULL""", (chain_id,))
+        n = cur.rowcount
+        if not n: continue
+        chain_rows, overrides = apply_stage(cur, chain_id)
+        print(f"  chain {chain_id}: {n} rows -> {chain_rows} chain prices + {overrides} overrides", flush=True)
+        rows += n
+    cur.execute("ALTER TABLE store_price RENAME TO store_price_rows")
+    cur.execute(VIEW)
+    cur.execute(TRIGGER)
+    cur.execute("""CREATE TRIGGER store_price_write INSTEAD OF INSERT OR UPDATE OR DELETE ON store_price
+        FOR EACH ROW EXECUTE FUNCTION store_price_write()""")
+    cur.execute("SELECT COUNT(*) FROM store_price")
+    if cur.fetchone()[0] != rows:
+        conn.rollback(); print("View does not reproduce store_price, nothing changed"); sys.exit(1)
+    conn.commit()
+    print(f"Done: {rows} rows. store_price_rows is kept for rollback.")
+
+def rollback(conn):
+    cur = conn.cursor()
+    if not is_chain_layout(cur):
+        print("store_price is not a chain-level view"); return
+    cur.execute("CREATE TEMP TABLE snapshot AS SELECT * FROM store_price")
+    cur.execute("DROP VIEW store_price")
+    cur.execute("ALTER TABLE store_price_rows RENAME TO store_price")
+    cur.execute("TRUNCATE store_price")
+    cur.execute("""INSERT INTO store_price (product_id, store_id, price, is_promo, promo_price, updated_at)
+        SELECT product_id, store_id, price, is_promo, promo_price, updated_at FROM snapshot""")
+    print(f"Restored {cur.rowcount} rows into the store_price table")
+    cur.execute("DROP TABLE chain_price, store_price_override, store_promo, price_store")
+    cur.execute("DROP FUNCTION store_price_write()")
+    conn.commit()
+
+def main():
+    db_url = os.environ.get('DATABASE_URL')
+    if not db_url: raise ValueError("DATABASE_URL not set")
+    if len(sys.argv) < 2 or sys.argv[1] not in ('migrate', 'rollback'):
+        print(__doc__); sys.exit(1)
+    conn = psycopg2.connect(db_url)
+    if sys.argv[1] == 'migrate': migrate(conn)
+    else: rollback(conn)
+    conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""Promotion items linked once per chain promotion, read through a promotion_item view.
+
+A chain publishes the same promotion (same promotionid, same item list) for
+every one of its stores, so promotion_item holds the list once per store.
+After `migrate` it is held once per chain:
+  chain_promotion_item   (chain_id, chain_promotion_id, product_id)
+  promotion_item         a view with the (promotion_id, product_id) columns the API
+                         joins on: each store's promotion row picks up its chain's items
+
+promo_engine writes chain_promotion_item directly in this layout (link_chain_items); an
+INSTEAD OF INSERT trigger covers plain INSERTs from anything else.
+The old table is kept as promotion_item_rows.
+
+Usage:
+  python scripts/chain_promo_items.py migrate    # promotion_item table -> chain table + view
+  python scripts/chain_promo_items.py rollback   # materialize the view back into the promotion_item table
+"""
+import os, sys
+import psycopg2
+
+VIEW = """CREATE VIEW promotion_item AS
+    SELECT pr.id AS promotion_id, ci.product_id
+    FROM promotion pr
+    JOIN store s ON s.id = pr.store_id
+    JOIN chain_promotion_item ci ON ci.chain_id = s.chain_id AND ci.chain_promotion_id = pr.chain_promotion_id"""
+
+TRIGGER = """CREATE OR REPLACE FUNCTION promotion_item_write() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        INSERT INTO chain_promotion_item (chain_id, chain_promotion_id, product_id)
+        SELECT s.chain_id, pr.chain_promotion_id, NEW.product_id
+        FROM promotion pr JOIN store s ON s.id = pr.store_id WHERE pr.id = NEW.promotion_id
+        ON CONFLICT DO NOTHING;
+        RETURN NEW;
+    END $$"""
+
+def is_chain_promo_layout(cur):
+    cur.execute("SELECT relkind = 'v' FROM pg_class WHERE oid = to_regclass('promotion_item')")
+    row = cur.fetchone()
+    return bool(row and row[0])
+
+def link_chain_items(cur, chain_id, pairs):
+    """Add (chain_promotion_id, barcode) pairs of one chain, resolving barcodes with a join on product.
+    Unknown barcodes are skipped. Returns how many links were new."""
+    if not pairs: return 0
+    cpids, barcodes = zip(*pairs)
+    cur.execute("""
+        INSERT INTO chain_promotion_item (chain_id, chain_promotion_id, product_id)
+        SELECT %s, v.chain_promotion_id, p.id
+        FROM unnest(%s::text[], %s::text[]) AS v(chain_promotion_id, barcode)
+        JOIN product p ON p.barcode = v.barcode
+        ON CONFLICT DO NOTHING
+    """, (chain_id, list(cpids), list(barcodes)))
+    return cur.rowcount
+
+def migrate(conn):
+    cur = conn.cursor()
+    if is_chain_promo_layout(cur):
+        print("promotion_item is already a chain-level view"); return
+    cur.execute("LOCK TABLE promotion_item IN ACCESS EXCLUSIVE MODE")
+    cur.execute("""CREATE TABLE chain_promotion_item (chain_id INTEGER NOT NULL, chain_promotion_id TEXT NOT NULL,
+        product_id INTEGER NOT NULL, PRIMARY KEY (chain_id, chain_promotion_id, product_id))""")
+    cur.execute("CREATE INDEX ON chain_promotion_item (product_id)")
+    cur.execute("""INSERT INTO chain_promotion_item
+        SELECT DISTINCT s.chain_id, pr.chain_promotion_id, pi.product_id
+        FROM promotion_item pi JOIN promotion pr ON pr.id = pi.promotion_id JOIN store s ON s.id = pr.store_id
+        WHERE s.chain_id IS NOT NULL AND pi.product_id IS NOT NULL""")
+    links = cur.rowcount
+    cur.execute("SELECT COUNT(*) FROM promotion_item")
+    rows = cur.fetchone()[0]
+    cur.execute("ALTER TABLE promotion_item RENAME TO promotion_item_rows")
+    cur.execute(VIEW)
+    cur.execute(TRIGGER)
+    cur.execute("""CREATE TRIGGER promotion_item_write INSTEAD OF INSERT ON promotion_item
+        FOR EACH ROW EXECUTE FUNCTION promotion_item_write()""")
+    # Stores of a chain that carried different lists under one promotion id now share the union
+    cur.execute("""SELECT COUNT(*) FROM promotion_item_rows r
+        WHERE NOT EXISTS (SELECT 1 FROM promotion_item v WHERE v.promotion_id = r.promotion_id AND v.product_id = r.product_id)
+        AND r.product_id IS NOT NULL""")
+    if cur.fetchone()[0]:
+        conn.rollback(); print("View does not cover every promotion_item row, nothing changed"); sys.exit(1)
+    cur.execute("SELECT COUNT(*) FROM promotion_item")
+    conn.commit()
+    print(f"Done: {rows} promotion_item rows -> {links} chain links ({cur.fetchone()[0]} rows through the view). "
+          "promotion_item_rows is kept for rollback.")
+
+def rollback(conn):
+    cur = conn.cursor()
+    if not is_chain_promo_layout(cur):
+        print("promotion_item is not a chain-level view"); return
+    cur.execute("CREATE TEMP TABLE snapshot AS SELECT * FROM promotion_item")
+    cur.execute("DROP VIEW promotion_item")
+    cur.execute("ALTER TABLE promotion_item_rows RENAME TO promotion_item")
+    cur.execute("TRUNCATE promotion_item")
+    cur.execute("INSERT INTO promotion_item (promotion_id, product_id) SELECT promotion_id, product_id FROM snapshot")
+    print(f"Restored {cur.rowcount} rows into the promotion_item table")
+    cur.execute("DROP TABLE chain_promotion_item")
+    cur.execute("DROP FUNCTION promotion_item_write()")
+    conn.commit()
+
+def main():
+    db_url = os.environ.get('DATABASE_URL')
+    if not db_url: raise ValueError("DATABASE_URL not set")
+    if len(sys.argv) < 2 or sys.argv[1] not in ('migrate', 'rollback'):
+        print(__doc__); sys.exit(1)
+    conn = psycopg2.connect(db_url)
+    if sys.argv[1] == 'migrate': migrate(conn)
+    else: rollback(conn)
+    conn.close()
+
+if __name__ == '__main__':
+    main()
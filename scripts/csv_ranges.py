@@ -0,0 +1,96 @@
+"""Parse one large CSV in parallel: split it into byte ranges on record boundaries.
+
+Cut points are simply the next newline after every `chunk_bytes`, which is a
+record boundary unless it falls inside a quoted field. Each range is parsed by
+a pool task that reads the records *starting* inside it (the last one may run
+past the range end) and reports where its last record ended. The first range
+starts right after the header, a known boundary, so a range that ends anywhere
+but its planned end means the next cut was mid-record: its results are
+dropped and the file is re-cut from the true boundary. The concatenated output
+is therefore exactly what a single csv.reader pass produces.
+"""
+import collections, csv, os, tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+CHUNK_BYTES = 8 << 20
+
+@contextmanager
+def seekable(source):
+    """A real file path for `source`; an archive member is unpacked next to its archive for the duration."""
+    if not hasattr(source, 'extract'):
+        yield source; return
+    with tempfile.TemporaryDirectory(dir=Path(source.archive).parent) as tmp:
+        yield source.extract(tmp)
+
+def read_header(path):
+    """(fieldnames, offset of the first data record)."""
+    reader = RangeReader(path, 0, 1, None)
+    with open(path, 'rb') as f:
+        rows = csv.reader(reader.lines(f))
+        fieldnames = next(rows, [])
+    return fieldnames, reader.stop
+
+class RangeReader:
+    """The records that start in [start, end) of a CSV file, as csv.reader rows.
+
+    After iterating, .stop is the offset just past the last record read: `end`
+    itself, unless `start` or `end` was not a record boundary.
+    """
+    def __init__(self, path, start, end, fieldnames):
+        self.path, self.start, self.end, self.fieldnames = path, start, end, fieldnames
+        self.stop = start
+
+    def lines(self, f):
+        # Same newline handling as a text-mode open(), with the byte position kept
+        for line in f:
+            self.stop += len(line)
+            yield line.decode('utf-8').replace('\r\n', '\n')
+
+    def rows(self):
+        """The records, as csv.reader lists."""
+        with open(self.path, 'rb') as f:
+            f.seek(self.start)
+            self.stop = self.start
+            reader = csv.reader(self.lines(f))
+            while self.stop < self.end:
+                row = next(reader, None)
+                if row is None: return
+                if not row: continue  # DictReader skips blank lines too
+                yield row
+
+def iter_ranges(path, start, chunk_bytes=CHUNK_BYTES):
+    """(start, end) byte ranges from `start` to EOF, each cut at the next newline after chunk_bytes."""
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        while start < size:
+            f.seek(start + chunk_bytes)
+            f.readline()
+            end = min(f.tell(), size) if start + chunk_bytes < size else size
+            yield start, end
+            start = end
+
+def parse_parallel(pool, workers, task, path, args=(), chunk_bytes=CHUNK_BYTES, ahead=None):
+    """Yield task's results for consecutive ranges of the file, in file order.
+
+    task((path, start, end, fieldnames, *args)) runs in the pool (of `workers`
+    processes) and must return (result, stop) with stop = RangeReader.stop. At
+    most `ahead` ranges (default two per pool process) are parsed or buffered
+    at a time, so memory stays bounded however big the file is.
+    """
+    fieldnames, data_start = read_header(path)
+    ahead = ahead or 2 * workers
+    ranges, pending = iter_ranges(path, data_start, chunk_bytes), collections.deque()
+    while True:
+        while len(pending) < ahead:
+            r = next(ranges, None)
+            if r is None: break
+            pending.append((r[1], pool.apply_async(task, ((path, r[0], r[1], fieldnames, *args),))))
+        if not pending: return
+        end, res = pending.popleft()
+        result, stop = res.get()
+        yield result
+        if stop != end:
+            # Cut inside a quoted field: the ranges after it started mid-record
+            pending.clear()
+            ranges = iter_ranges(path, stop, chunk_bytes)
@@ -0,0 +1,141 @@
+"""Local cache of Kaggle dataset archives, read member by member.
+
+Archives are kept zipped under .cache/kaggle/<owner>__<name>/<version>.zip
+(the directory the workflows persist with actions/cache, keyed on the version
+`python scripts/kaggle_cache.py version <dataset>` prints), so a script only
+downloads when the dataset has a new version. Scripts then stream the CSV
+members they need (price_full / store / promo_full) straight out of the zip.
+Use Member.extract() only when something needs a real file.
+
+A member's content hash is a SHA-256 of its bytes, computed once per archive
+and kept next to it in <version>.zip.sha256.json.
+"""
+import csv, hashlib, io, json, os, shutil, subprocess, sys, tempfile, time, zipfile
+from pathlib import Path
+
+DATA_DIR = Path("kaggle_data")
+ARCHIVE_DIR = Path(os.environ.get("KAGGLE_CACHE_DIR", Path(".cache") / "kaggle"))
+
+class Member:
+    """One CSV inside a cached archive. Mirrors the bits of Path the loaders use; picklable for worker processes."""
+    def __init__(self, archive, info):
+        self.archive = str(archive)
+        self.member = info.filename
+        self.name = Path(info.filename).name
+        self.stem = Path(info.filename).stem
+        self.size = info.file_size
+        self._hash = None
+
+    def __repr__(self):
+        return f"Member({self.name!r})"
+
+    @property
+    def content_hash(self):
+        """SHA-256 of the member's bytes; read from the archive's sidecar, or computed and added to it."""
+        if self._hash: return self._hash
+        sidecar = Path(self.archive + ".sha256.json")
+        try: known = json.loads(sidecar.read_text())
+        except (OSError, ValueError): known = {}
+        if self.member not in known:
+            h = hashlib.sha256()
+            with self.open("rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""): h.update(block)
+            known[self.member] = f"sha256:{h.hexdigest()}"
+            tmp = sidecar.with_suffix(".tmp")
+            tmp.write_text(json.dumps(known)); os.replace(tmp, sidecar)
+        self._hash = known[self.member]
+        return self._hash
+
+    def open(self, mode="r", encoding="utf-8", errors=None, newline=None):
+        with zipfile.ZipFile(self.archive) as zf:
+            # The archive's file handle stays open until the member stream is closed
+            raw = zf.open(self.member)
+        if "b" in mode: return raw
+        return io.TextIOWrapper(raw, encoding=encoding, errors=errors, newline=newline)
+
+    def extract(self, dest=DATA_DIR / ".extracted"):
+        """Unpack just this member (for readers that need a seekable file). Returns its path."""
+        out = Path(dest) / self.name
+        if out.exists() and out.stat().st_size == self.size: return out
+        out.parent.mkdir(parents=True, exist_ok=True)
+        with self.open("rb") as src, open(out, "wb") as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+        return out
+
+class Dataset:
+    def __init__(self, archive, version):
+        self.archive, self.version = Path(archive), version
+        with zipfile.ZipFile(self.archive) as zf:
+            self.infos = [i for i in zf.infolist() if i.filename.endswith(".csv")]
+
+    def members(self, kind):
+        """CSV members whose name contains `kind`, e.g. 'price_full_file'."""
+        return sorted((Member(self.archive, i) for i in self.infos if kind in Path(i.filename).name),
+                      key=lambda m: m.name)
+
+def dataset_dir(dataset):
+    return ARCHIVE_DIR / dataset.replace("/", "__")
+
+def current_version(dataset):
+    """The dataset's lastUpdated stamp from the Kaggle listing, or today's date if the listing is unavailable.
+
+    With KAGGLE_OFFLINE=1 the newest cached archive is used without asking Kaggle.
+    """
+    if os.environ.get("KAGGLE_OFFLINE") == "1":
+        cached = sorted(dataset_dir(dataset).glob("*.zip"), key=lambda p: p.stat().st_mtime)
+        if cached: return cached[-1].stem
+    owner, name = dataset.split("/", 1)
+    try:
+        r = subprocess.run(["kaggle", "datasets", "list", "-s", name, "--user", owner, "--csv"],
+                           capture_output=True, text=True, timeout=60)
+        for row in csv.DictReader(io.StringIO(r.stdout)):
+            if row.get("ref") == dataset and row.get("lastUpdated"):
+                return "".join(c if c.isalnum() else "-" for c in row["lastUpdated"])
+    except (OSError, subprocess.SubprocessError):
+        pass
+    return "day-" + time.strftime("%Y%m%d", time.gmtime())
+
+def open_dataset(dataset, log=print):
+    """Return the cached archive for the dataset's current version, downloading it only if missing."""
+    version = current_version(dataset)
+    d = dataset_dir(dataset)
+    archive = d / f"{version}.zip"
+    if archive.exists():
+        log(f"Using cached {dataset} ({version})")
+        return Dataset(archive, version)
+    log(f"Downloading {dataset} ({version})...")
+    d.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=d) as tmp:
+        r = subprocess.run(["kaggle", "datasets", "download", "-d", dataset, "-p", tmp], capture_output=True, text=True)
+        zips = list(Path(tmp).glob("*.zip"))
+        if r.returncode != 0 or not zips:
+            raise RuntimeError(f"Kaggle download failed:\n{r.stderr}")
+        os.replace(zips[0], archive)
+    for old in d.glob("*.zip*"):
+        if not old.name.startswith(archive.name): old.unlink()
+    return Dataset(archive, version)
+
+class LocalFile(type(Path())):
+    """An unpacked CSV, with the same .size as Member."""
+    @property
+    def size(self):
+        return self.stat().st_size
+
+def local_files(kind):
+    """CSV files already unpacked under kaggle_data/ (older runs, manual downloads)."""
+    return sorted((LocalFile(p) for p in DATA_DIR.glob(f"**/*{kind}*.csv")
+                   if not any(part.startswith(".") for part in p.parts)), key=lambda p: p.name)
+
+def find_files(kind):
+    """Unpacked CSVs if present, otherwise members of the newest cached archive that has any."""
+    files = local_files(kind)
+    if files: return files
+    archives = sorted(ARCHIVE_DIR.glob("*/*.zip"), key=lambda p: p.stat().st_mtime, reverse=True)
+    for archive in archives:
+        members = Dataset(archive, archive.stem).members(kind)
+        if members: return members
+    return []
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] != "version": sys.exit(__doc__)
+    print(current_version(sys.argv[2]))
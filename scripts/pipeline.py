@@ -0,0 +1,94 @@
+"""Overlap parsing and DB writes: a generator runs on a thread, a bounded number of items ahead.
+
+    chunks = Prefetch(iter_batches(...), depth=2)
+    for chunk in chunks: write(chunk)
+    chunks.timings('parse', 'write')  # {'parse_busy': s, 'parse_blocked': s, 'write_busy': s, 'write_idle': s}
+
+psycopg2 releases the GIL while it waits on the server, so the parser keeps
+going during COPY and merge statements. A full queue blocks the producer
+(backpressure), which bounds memory to `depth` items. A producer that spends
+its time blocked is waiting on the DB; a consumer that spends its time idle is
+waiting on the parser. depth=0 runs the generator inline instead, which still
+splits the time into parse and write but overlaps nothing.
+"""
+import queue, threading, time
+
+_DONE = object()
+
+class _Raised:
+    def __init__(self, exc): self.exc = exc
+
+class Prefetch:
+    def __init__(self, source, depth=2):
+        self.source, self.depth = source, depth
+        self.queue = queue.Queue(depth) if depth else None
+        self.produce_busy = self.produce_blocked = self.consume_idle = 0.0
+        self.started = self.finished = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._produce, daemon=True)
+
+    def _produce(self):
+        items = iter(self.source)
+        try:
+            while True:
+                t0 = time.perf_counter()
+                item = next(items, _DONE)
+                t1 = time.perf_counter()
+                self.produce_busy += t1 - t0
+                if not self._put(item): return
+                self.produce_blocked += time.perf_counter() - t1
+                if item is _DONE: return
+        except BaseException as e:
+            self._put(_Raised(e))
+
+    def _put(self, item):
+        # Gives up once the consumer has stopped, so an abandoned producer does not hang
+        while not self._stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.2)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def __iter__(self):
+        self.started = time.perf_counter()
+        if not self.depth:
+            yield from self._inline(); return
+        self._thread.start()
+        try:
+            while True:
+                t0 = time.perf_counter()
+                item = self.queue.get()
+                self.consume_idle += time.perf_counter() - t0
+                if item is _DONE: return
+                if isinstance(item, _Raised): raise item.exc
+                yield item
+        finally:
+            self.finished = time.perf_counter()
+            self._stop.set()
+            self._thread.join()
+
+    def _inline(self):
+        items = iter(self.source)
+        try:
+            while True:
+                t0 = time.perf_counter()
+                item = next(items, _DONE)
+                self.produce_busy += time.perf_counter() - t0
+                if item is _DONE: return
+                yield item
+        finally:
+            self.finished = time.perf_counter()
+
+    def timings(self, producer='produce', consumer='consume'):
+        """Seconds each side spent working and waiting for the other. In inline mode nobody waits,
+        and the consumer's busy time excludes the producer's."""
+        total = (self.finished or time.perf_counter()) - (self.started or time.perf_counter())
+        busy = total - self.consume_idle - (0 if self.depth else self.produce_busy)
+        return {f'{producer}_busy': round(self.produce_busy, 3), f'{producer}_blocked': round(self.produce_blocked, 3),
+                f'{consumer}_busy': round(max(busy, 0.0), 3), f'{consumer}_idle': round(self.consume_idle, 3)}
+
+def bottleneck(timings, producer='produce', consumer='consume'):
+    """'DB-bound' if the consumer (the writer) did more of the work, else 'CPU-bound'."""
+    return 'DB-bound' if timings[f'{consumer}_busy'] >= timings[f'{producer}_busy'] else 'CPU-bound'
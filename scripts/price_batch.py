@@ -0,0 +1,57 @@
+"""Columnar batch of parsed price rows, the unit update_prices stages and merges.
+
+A tuple per row costs ~200 bytes of object headers for ~20 bytes of data, so a
+batch keeps its rows as parallel typed arrays instead: an index into the
+batch's barcode dictionary (each distinct barcode stored once, interned), the
+store id and the price in agorot. The product-id lookup, the per-store dedup
+and the COPY into tmp_prices all work on the arrays directly.
+"""
+import sys
+from array import array
+
+class PriceBatch:
+    def __init__(self):
+        self.codes = {}          # barcode -> index into barcodes / names
+        self.barcodes = []       # distinct barcodes, interned
+        self.names = []          # latest name seen per barcode, for products that do not exist yet
+        self.code = array('i')   # per row: index into barcodes
+        self.store = array('i')  # per row: store.id
+        self.price = array('q')  # per row: price in agorot
+        self.stores = set()
+        self._run_store, self._run = None, {}
+
+    def __len__(self):
+        return len(self.code)
+
+    def add(self, barcode, name, store_id, agorot):
+        """Append a row. Within one run of a store a repeated barcode overwrites its earlier price in place."""
+        if store_id != self._run_store:
+            self._run_store, self._run = store_id, {}
+            self.stores.add(store_id)
+        c = self.codes.get(barcode)
+        if c is None:
+            c = self.codes[barcode] = len(self.barcodes)
+            self.barcodes.append(sys.intern(barcode)); self.names.append(name)
+        else:
+            self.names[c] = name
+        i = self._run.get(c)
+        if i is None:
+            self._run[c] = len(self.code)
+            self.code.append(c); self.store.append(store_id); self.price.append(agorot)
+        else:
+            self.price[i] = agorot
+
+    def names_by_barcode(self):
+        """{barcode: name} for ProductCache.resolve_or_create."""
+        return dict(zip(self.barcodes, self.names))
+
+    def copy_lines(self, ids):
+        """COPY text lines (product_id, store_id, price) given {barcode: product id}."""
+        pids = array('i', (ids[bc] for bc in self.barcodes))
+        for c, sid, p in zip(self.code, self.store, self.price):
+            yield f"{pids[c]}\t{sid}\t{p // 100}.{p % 100:02d}\n"
+
+def agorot(price_str):
+    """'12.90' -> 1290; None if it is not a number."""
+    try: return round(float(price_str) * 100)
+    except (ValueError, OverflowError): return None
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""Append-only price history: one (product, store, price, valid_from, valid_to) row per price interval.
+
+price_history is range-partitioned by valid_from into monthly tables
+(price_history_YYYY_MM). The ingest diff closes the open interval of a price
+that changed or disappeared and opens a new one; unchanged prices write
+nothing. At the start of each month open intervals are closed at the month
+boundary and re-opened in the new month, so every interval lies inside the
+partition it is stored in: a query for a date range only touches the months
+it covers, and old months can be detached or dropped whole.
+
+Usage:
+  python scripts/price_history.py series <barcode> [days]   # price series across chains
+  python scripts/price_history.py prune <months>            # drop partitions older than that
+"""
+import os, sys
+from datetime import date, datetime, timedelta
+import psycopg2
+
+def month_start(d):
+    return date(d.year, d.month, 1)
+
+def next_month(d):
+    return date(d.year + d.month // 12, d.month % 12 + 1, 1)
+
+def partition_name(d):
+    return f"price_history_{d.year:04d}_{d.month:02d}"
+
+def ensure_month(cur, d):
+    m = month_start(d)
+    cur.execute(f"""CREATE TABLE IF NOT EXISTS {partition_name(m)} PARTITION OF price_history
+        FOR VALUES FROM ('{m}') TO ('{next_month(m)}')""")
+
+def ensure_history(cur):
+    """Create price_history (seeded with the current prices) and this and next month's partitions, then roll over."""
+    cur.execute("SELECT to_regclass('price_history') IS NOT NULL")
+    created = not cur.fetchone()[0]
+    if created:
+        cur.execute("""CREATE TABLE price_history (
+            product_id INTEGER NOT NULL,
+            store_id INTEGER NOT NULL,
+            price NUMERIC NOT NULL,
+            valid_from TIMESTAMP NOT NULL,
+            valid_to TIMESTAMP) PARTITION BY RANGE (valid_from)""")
+        cur.execute("CREATE INDEX ON price_history (product_id, store_id, valid_from)")
+    cur.execute("SELECT LOCALTIMESTAMP::date")
+    today = cur.fetchone()[0]
+    ensure_month(cur, today)
+    ensure_month(cur, next_month(today))
+    if created:
+        cur.execute("""INSERT INTO price_history (product_id, store_id, price, valid_from)
+            SELECT product_id, store_id, price, LOCALTIMESTAMP FROM store_price WHERE price IS NOT NULL""")
+    roll_over(cur)
+
+def roll_over(cur):
+    """Split intervals still open from earlier months into one interval per month. Returns intervals rolled."""
+    cur.execute("""SELECT MIN(valid_from)::date, LOCALTIMESTAMP::date FROM price_history
+        WHERE valid_to IS NULL AND valid_from < date_trunc('month', LOCALTIMESTAMP)""")
+    oldest, today = cur.fetchone()
+    if not oldest: return 0
+    m = month_start(oldest)
+    while m <= today:
+        ensure_month(cur, m); m = next_month(m)
+    cur.execute("""WITH old AS (
+            UPDATE price_history SET valid_to = date_trunc('month', valid_from) + interval '1 month'
+            WHERE valid_to IS NULL AND valid_from < date_trunc('month', LOCALTIMESTAMP)
+            RETURNING product_id, store_id, price, valid_from)
+        INSERT INTO price_history (product_id, store_id, price, valid_from, valid_to)
+        SELECT old.product_id, old.store_id, old.price, m,
+            CASE WHEN m < date_trunc('month', LOCALTIMESTAMP) THEN m + interval '1 month' END
+        FROM old, generate_series(date_trunc('month', old.valid_from) + interval '1 month',
+                                  date_trunc('month', LOCALTIMESTAMP), interval '1 month') m""")
+    return cur.rowcount
+
+def history_ctes(opened, closed):
+    """CTEs (for a WITH list) that record a diff: `opened` yields (product_id, store_id, price)
+    of prices that start now, `closed` yields (product_id, store_id) of prices that end now."""
+    return f"""hist_closed AS (
+            UPDATE price_history h SET valid_to = LOCALTIMESTAMP FROM ({closed}) c
+            WHERE h.product_id = c.product_id AND h.store_id = c.store_id AND h.valid_to IS NULL
+            AND h.valid_from >= date_trunc('month', LOCALTIMESTAMP)
+            RETURNING 1),
+        hist_opened AS (
+            INSERT INTO price_history (product_id, store_id, price, valid_from)
+            SELECT o.product_id, o.store_id, o.price, LOCALTIMESTAMP FROM ({opened}) o
+            RETURNING 1)"""
+
+def price_series(cur, product_id, since, until=None):
+    """[(chain, store_id, store name, price, valid_from, valid_to)] of a product's prices overlapping [since, until).
+
+    Only partitions from since's month on are scanned. Intervals split at month
+    boundaries are merged back when the price did not change.
+    """
+    until = until or datetime.now() + timedelta(days=1)
+    cur.execute("""SELECT rc.name, s.id, s.name, h.price, h.valid_from, h.valid_to
+        FROM price_history h JOIN store s ON s.id = h.store_id JOIN retailer_chain rc ON rc.id = s.chain_id
+        WHERE h.product_id = %s AND h.valid_from >= date_trunc('month', %s::timestamp) AND h.valid_from < %s
+          AND (h.valid_to IS NULL OR h.valid_to > %s)
+        ORDER BY rc.name, s.id, h.valid_from""", (product_id, since, until, since))
+    series = []
+    for row in cur.fetchall():
+        last = series[-1] if series else None
+        if last and last[1] == row[1] and last[3] == row[3] and last[5] == row[4]:
+            series[-1] = last[:5] + (row[5],)
+        else:
+            series.append(row)
+    return series
+
+def prune(cur, keep_months):
+    """Drop monthly partitions that end more than keep_months before the current month."""
+    cutoff = month_start(date.today())
+    for _ in range(keep_months):
+        cutoff = month_start(cutoff - timedelta(days=1))
+    cur.execute("""SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'price_history'::regclass ORDER BY 1""")
+    dropped = []
+    for (name,) in cur.fetchall():
+        if name < partition_name(cutoff):
+            cur.execute(f"DROP TABLE {name}"); dropped.append(name)
+    return dropped
+
+def main():
+    db_url = os.environ.get('DATABASE_URL')
+    if not db_url: raise ValueError("DATABASE_URL not set")
+    if len(sys.argv) < 3 or sys.argv[1] not in ('series', 'prune'):
+        print(__doc__); sys.exit(1)
+    conn = psycopg2.connect(db_url)
+    cur = conn.cursor()
+    if sys.argv[1] == 'prune':
+        for name in prune(cur, int(sys.argv[2])): print(f"  dropped {name}")
+        conn.commit()
+    else:
+        cur.execute("SELECT id, name FROM product WHERE barcode = %s", (sys.argv[2],))
+        row = cur.fetchone()
+        if not row: print(f"Unknown barcode {sys.argv[2]}"); sys.exit(1)
+        days = int(sys.argv[3]) if len(sys.argv) > 3 else 90
+        print(f"{row[1]} ({sys.argv[2]}), last {days} days")
+        for chain, _, store, price, start, end in price_series(cur, row[0], datetime.now() - timedelta(days=days)):
+            print(f"  {chain:<20} {store:<30} {price:>8} {start:%Y-%m-%d} -> {f'{end:%Y-%m-%d}' if end else 'now'}")
+    conn.close()
+
+if __name__ == '__main__':
+    main()
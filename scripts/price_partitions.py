@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""store_price partitioned by chain, reloaded through shadow partitions.
+
+Layout after `migrate`:
+  store_price               PARTITION BY LIST (chain_id), UNIQUE (product_id, store_id, chain_id)
+  store_price_c<id>         live partition of one chain
+  store_price_c<id>_prev    the partition it replaced, detached and kept for rollback
+  store_price_default       DEFAULT partition for chains that have no partition yet
+
+Once store_price is partitioned, update_prices loads each chain into a fresh
+store_price_c<id>_next table and swaps it in with DETACH/ATTACH in one short
+transaction, so the API never reads a half-loaded chain (queries may wait a
+few seconds on the swap's lock, see swap_in). Every partition
+carries CHECK (chain_id = <id>), which lets ATTACH skip its validation scan.
+
+Usage:
+  python scripts/price_partitions.py migrate            # one-off; locks store_price while it copies
+  python scripts/price_partitions.py rollback <chain>   # swap a chain's previous partition back in
+"""
+import os, re, sys, time
+import psycopg2
+from price_history import history_ctes
+
+# Columns the loader computes itself; every other column is carried over from the live row
+CORE_COLUMNS = ('product_id', 'store_id', 'chain_id', 'price', 'updated_at')
+
+def is_partitioned(cur):
+    cur.execute("""SELECT EXISTS (SELECT 1 FROM pg_partitioned_table
+        WHERE partrelid = to_regclass('store_price'))""")
+    return cur.fetchone()[0]
+
+def partition_name(chain_id):
+    return f"store_price_c{int(chain_id)}"
+
+def table_exists(cur, name):
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL", (name,))
+    return cur.fetchone()[0]
+
+def table_columns(cur, table):
+    cur.execute("""SELECT column_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s ORDER BY ordinal_position""", (table,))
+    return [r[0] for r in cur.fetchall()]
+
+def clone_indexes(cur, source, table, constraints=None):
+    """Recreate the unique constraints (True), the plain indexes (False) or both (None) of `source` on `table`.
+
+    Constraints are added as constraints, or ATTACH would build its own copy of the index.
+    """
+    if constraints is not False:
+        cur.execute("""SELECT pg_get_constraintdef(oid) FROM pg_constraint
+            WHERE conrelid = %s::regclass AND contype IN ('u', 'p')""", (source,))
+        for (condef,) in cur.fetchall():
+            cur.execute(f"ALTER TABLE {table} ADD {condef}")
+    if constraints is not True:
+        cur.execute("""SELECT pg_get_indexdef(i.indexrelid) FROM pg_index i WHERE i.indrelid = %s::regclass
+            AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = i.indexrelid)""", (source,))
+        for (indexdef,) in cur.fetchall():
+            cur.execute(re.sub(r'^CREATE (UNIQUE )?INDEX \S+ ON (ONLY )?\S+', rf'CREATE \1INDEX ON {table}', indexdef))
+
+def create_partition_table(cur, table, chain_id):
+    """A detached table shaped like store_price that can only hold one chain's rows."""
+    cur.execute(f"CREATE TABLE {table} (LIKE store_price INCLUDING DEFAULTS, CHECK (chain_id = {int(chain_id)}))")
+
+def ensure_partition(cur, chain_id):
+    """Give the chain its own partition, moving any of its rows out of the default partition."""
+    live = partition_name(chain_id)
+    if table_exists(cur, live): return
+    create_partition_table(cur, live, chain_id)
+    cur.execute(f"""WITH moved AS (DELETE FROM store_price_default WHERE chain_id = %s RETURNING *)
+        INSERT INTO {live} SELECT * FROM moved""", (chain_id,))
+    clone_indexes(cur, 'store_price', live)
+    cur.execute(f"ALTER TABLE store_price ATTACH PARTITION {live} FOR VALUES IN ({int(chain_id)})")
+
+def swap_in(conn, chain_id, incoming, retries=5, prepare=None):
+    """Make `incoming` the chain's live partition; the current one becomes store_price_c<id>_prev.
+
+    prepare(cur) runs first in the same transaction. DETACH takes an ACCESS EXCLUSIVE lock on
+    store_price: while it waits for running API queries, new queries queue behind it, for at
+    most lock_timeout (5s) per attempt before it gives up, backs off and retries. Once granted
+    the lock is held only for the renames and the ATTACH. DETACH ... CONCURRENTLY would not
+    queue readers, but it cannot run inside the swap's transaction (the chain would be missing
+    between DETACH and ATTACH) and is not allowed while store_price has a DEFAULT partition.
+    """
+    live = partition_name(chain_id)
+    prev = live + '_prev'
+    cur = conn.cursor()
+    for attempt in range(retries):
+        try:
+            if prepare: prepare(cur)
+            cur.execute("SET LOCAL lock_timeout = '5s'")
+            cur.execute(f"ALTER TABLE store_price DETACH PARTITION {live}")
+            cur.execute(f"ALTER TABLE {live} RENAME TO {live}_old")
+            if incoming != prev: cur.execute(f"DROP TABLE IF EXISTS {prev}")
+            cur.execute(f"ALTER TABLE {incoming} RENAME TO {live}")
+            cur.execute(f"ALTER TABLE {live}_old RENAME TO {prev}")
+            cur.execute(f"ALTER TABLE store_price ATTACH PARTITION {live} FOR VALUES IN ({int(chain_id)})")
+            conn.commit()
+            return
+        except psycopg2.errors.LockNotAvailable:
+            conn.rollback()
+            time.sleep(2 * (attempt + 1))
+    raise RuntimeError(f"could not lock store_price to swap in {incoming}")
+
+def record_swap_history(cur, live, incoming):
+    """Write the difference between the live partition and the one about to replace it to price_history."""
+    cur.execute(f"""WITH {history_ctes(
+        f"SELECT n.product_id, n.store_id, n.price FROM {incoming} n LEFT JOIN {live} o "
+        f"ON o.product_id = n.product_id AND o.store_id = n.store_id WHERE o.price IS DISTINCT FROM n.price",
+        f"SELECT o.product_id, o.store_id FROM {live} o LEFT JOIN {incoming} n "
+        f"ON n.product_id = o.product_id AND n.store_id = o.store_id WHERE n.price IS DISTINCT FROM o.price")}
+        SELECT 1""")
+
+class ShadowLoad:
+    """One chain's next snapshot, filled chunk by chunk from tmp_prices and then swapped in.
+
+    Rows that already exist keep their carried-over columns (id, promo flags, ...);
+    updated_at only moves when the price did. Stores missing from the file keep
+    their live rows, as with the in-place diff.
+    """
+    def __init__(self, cur, chain_id):
+        self.chain_id = chain_id
+        self.live = partition_name(chain_id)
+        self.table = self.live + '_next'
+        self.stores = set()
+        ensure_partition(cur, chain_id)
+        self.columns = table_columns(cur, 'store_price')
+        cur.execute(f"DROP TABLE IF EXISTS {self.table}")
+        create_partition_table(cur, self.table, chain_id)
+        # The unique constraint is needed for ON CONFLICT while loading; other indexes are built just before the swap
+        clone_indexes(cur, 'store_price', self.table, constraints=True)
+
+    def stage(self, cur, stores):
+        """Add tmp_prices to the shadow. Returns (inserted, changed, ids of products whose prices moved)."""
+        keep = [c for c in self.columns if c not in CORE_COLUMNS]
+        cols = ''.join(f', {c}' for c in keep)
+        live_cols = ''.join(f', o.{c}' for c in keep)
+        cur.execute(f"""WITH t AS (SELECT product_id, store_id, price FROM tmp_prices),
+            old AS (
+                INSERT INTO {self.table} (product_id, store_id, chain_id, price, updated_at{cols})
+                SELECT t.product_id, t.store_id, %(chain)s, t.price,
+                    CASE WHEN o.price IS DISTINCT FROM t.price THEN NOW() ELSE o.updated_at END{live_cols}
+                FROM t JOIN {self.live} o ON o.product_id = t.product_id AND o.store_id = t.store_id
+                ON CONFLICT (product_id, store_id, chain_id) DO UPDATE SET price = EXCLUDED.price, updated_at = EXCLUDED.updated_at
+                WHERE {self.table}.price IS DISTINCT FROM EXCLUDED.price
+                RETURNING 1),
+            new AS (
+                INSERT INTO {self.table} (product_id, store_id, chain_id, price)
+                SELECT t.product_id, t.store_id, %(chain)s, t.price FROM t
+                WHERE NOT EXISTS (SELECT 1 FROM {self.live} o WHERE o.product_id = t.product_id AND o.store_id = t.store_id)
+                ON CONFLICT (product_id, store_id, chain_id) DO UPDATE SET price = EXCLUDED.price, updated_at = NOW()
+                WHERE {self.table}.price IS DISTINCT FROM EXCLUDED.price
+                RETURNING product_id),
+            moved AS (
+                SELECT t.product_id FROM t JOIN {self.live} o ON o.product_id = t.product_id AND o.store_id = t.store_id
+                WHERE o.price IS DISTINCT FROM t.price)
+            SELECT (SELECT COUNT(*) FROM new), (SELECT COUNT(*) FROM moved),
+                ARRAY(SELECT product_id FROM new UNION SELECT product_id FROM moved)""",
+            {'chain': self.chain_id})
+        self.stores |= stores
+        return cur.fetchone()
+
+    def finish(self, conn):
+        """Fill in untouched stores, index, and swap the shadow in. Returns (0, 0, removed, ids of removed products)."""
+        cur = conn.cursor()
+        stores = sorted(self.stores)
+        cols = ', '.join(self.columns)
+        cur.execute(f"INSERT INTO {self.table} ({cols}) SELECT {cols} FROM {self.live} WHERE store_id <> ALL(%s)", (stores,))
+        cur.execute(f"""SELECT ARRAY(SELECT o.product_id FROM {self.live} o WHERE o.store_id = ANY(%s)
+            AND NOT EXISTS (SELECT 1 FROM {self.table} n WHERE n.product_id = o.product_id AND n.store_id = o.store_id))""",
+            (stores,))
+        removed = cur.fetchone()[0]
+        clone_indexes(cur, 'store_price', self.table, constraints=False)
+        cur.execute(f"ANALYZE {self.table}")
+        conn.commit()
+        swap_in(conn, self.chain_id, self.table, prepare=self.record_history)
+        return 0, 0, len(removed), removed
+
+    def record_history(self, cur):
+        record_swap_history(cur, self.live, self.table)
+
+    def drop(self, cur):
+        cur.execute(f"DROP TABLE IF EXISTS {self.table}")
+
+def migrate(conn):
+    """Convert a plain store_price into the partitioned layout. The old table is kept as store_price_unpartitioned."""
+    cur = conn.cursor()
+    if is_partitioned(cur):
+        print("store_price is already partitioned"); return
+    cur.execute("SELECT relkind = 'v' FROM pg_class WHERE oid = to_regclass('store_price')")
+    if cur.fetchone()[0]:
+        print("store_price is a chain-level view; the two layouts cannot be combined"); sys.exit(1)
+    cur.execute("LOCK TABLE store_price IN ACCESS EXCLUSIVE MODE")
+    cur.execute("ALTER TABLE store_price RENAME TO store_price_unpartitioned")
+    # No foreign keys: ATTACH would re-validate them against every swapped-in partition
+    cur.execute("""CREATE TABLE store_price (LIKE store_price_unpartitioned INCLUDING DEFAULTS,
+        chain_id INTEGER NOT NULL) PARTITION BY LIST (chain_id)""")
+    cur.execute("ALTER TABLE store_price ADD UNIQUE (product_id, store_id, chain_id)")
+    cur.execute("CREATE INDEX ON store_price (store_id)")
+    # The id sequence must outlive the old table
+    if 'id' in table_columns(cur, 'store_price'):
+        cur.execute("SELECT pg_get_serial_sequence('store_price_unpartitioned', 'id')")
+        seq = cur.fetchone()[0]
+        if seq: cur.execute(f"ALTER SEQUENCE {seq} OWNED BY store_price.id")
+    cur.execute("CREATE TABLE store_price_default PARTITION OF store_price DEFAULT")
+    cols = [c for c in table_columns(cur, 'store_price') if c != 'chain_id']
+    select = ', '.join(f'sp.{c}' for c in cols)
+    cur.execute("SELECT DISTINCT chain_id FROM store WHERE chain_id IS NOT NULL ORDER BY 1")
+    for (chain_id,) in cur.fetchall():
+        live = partition_name(chain_id)
+        create_partition_table(cur, live, chain_id)
+        cur.execute(f"""INSERT INTO {live} ({', '.join(cols)}, chain_id)
+            SELECT {select}, s.chain_id FROM store_price_unpartitioned sp JOIN store s ON s.id = sp.store_id
+            WHERE s.chain_id = %s""", (chain_id,))
+        print(f"  {live}: {cur.rowcount} rows", flush=True)
+        clone_indexes(cur, 'store_price', live)
+        cur.execute(f"ALTER TABLE store_price ATTACH PARTITION {live} FOR VALUES IN ({int(chain_id)})")
+    cur.execute("""SELECT COUNT(*) FROM store_price_unpartitioned sp
+        WHERE NOT EXISTS (SELECT 1 FROM store s WHERE s.id = sp.store_id AND s.chain_id IS NOT NULL)""")
+    orphans = cur.fetchone()[0]
+    conn.commit()
+    if orphans: print(f"  {orphans} rows without a chain were left in store_price_unpartitioned", flush=True)
+    print("Done. Drop store_price_unpartitioned once the new layout has been checked.")
+
+def rollback(conn, chain_id):
+    """Swap the chain's previous partition back in (the rolled-back one becomes _prev)."""
+    prev = partition_name(chain_id) + '_prev'
+    if not table_exists(conn.cursor(), prev):
+        print(f"No previous partition for chain {chain_id}"); sys.exit(1)
+    # The restored prices start (and the rolled-back ones end) now in price_history
+    swap_in(conn, chain_id, prev, prepare=lambda cur: record_swap_history(cur, partition_name(chain_id), prev))
+    print(f"Chain {chain_id}: previous prices restored")
+
+def main():
+    db_url = os.environ.get('DATABASE_URL')
+    if not db_url: raise ValueError("DATABASE_URL not set")
+    if len(sys.argv) < 2 or sys.argv[1] not in ('migrate', 'rollback') or (sys.argv[1] == 'rollback' and len(sys.argv) < 3):
+        print(__doc__); sys.exit(1)
+    conn = psycopg2.connect(db_url)
+    if sys.argv[1] == 'migrate': migrate(conn)
+    else: rollback(conn, int(sys.argv[2]))
+    conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""Compact barcode -> product.id index shared by the ingest scripts.
+
+Numeric barcodes (almost all of them) are packed into two parallel sorted
+arrays, int64 keys and int32 ids, searched with bisect. That is ~12 bytes per
+product instead of a dict of Python strings. The index is saved to disk
+between runs and topped up from the DB with only the products added since.
+"""
+import os, struct
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+
+CACHE_PATH = Path(os.environ.get('PRODUCT_CACHE', '.cache/product_index.bin'))
+MAGIC = b'PIDX1'
+
+def barcode_key(barcode):
+    """Pack a digit-only barcode into an int64 (value * 32 + length keeps leading zeros). None if it does not fit."""
+    if len(barcode) > 17 or not barcode.isascii() or not barcode.isdigit(): return None
+    return int(barcode) * 32 + len(barcode)
+
+class ProductCache:
+    def __init__(self):
+        self.keys = array('q')   # sorted
+        self.ids = array('i')    # ids[i] belongs to keys[i]
+        self.recent = {}         # key -> id, added since the last compact()
+        self.extra = {}          # non-numeric barcode -> id
+        self.max_id = 0
+
+    def __len__(self):
+        return len(self.keys) + len(self.recent) + len(self.extra)
+
+    @classmethod
+    def load(cls, cur, path=CACHE_PATH):
+        """Load the saved index if there is one, then catch up with the product table."""
+        cache = cls()
+        if path and Path(path).exists():
+            try: cache._read(path)
+            except (OSError, ValueError, EOFError): cache = cls()
+        cache.refresh(cur)
+        return cache
+
+    def refresh(self, cur):
+        """Add products created since the last load; rebuild from scratch if the table shrank or was rewritten."""
+        cur.execute("SELECT COUNT(*), COALESCE(MAX(id), 0) FROM product WHERE barcode IS NOT NULL")
+        count, max_id = cur.fetchone()
+        if max_id < self.max_id or count < len(self):
+            self.__init__()
+        cur.execute("SELECT id, barcode FROM product WHERE barcode IS NOT NULL AND id > %s", (self.max_id,))
+        for pid, barcode in cur.fetchall():
+            self.add(barcode, pid)
+        self.compact()
+        if len(self) != count:
+            # Barcodes were reassigned or rows deleted below our watermark: full rebuild
+            self.__init__()
+            cur.execute("SELECT id, barcode FROM product WHERE barcode IS NOT NULL")
+            for pid, barcode in cur.fetchall():
+                self.add(barcode, pid)
+            self.compact()
+
+    def add(self, barcode, pid):
+        key = barcode_key(barcode)
+        if key is None: self.extra[barcode] = pid
+        else: self.recent[key] = pid
+        if pid > self.max_id: self.max_id = pid
+
+    def compact(self):
+        """Merge recently added keys into the sorted arrays."""
+        if not self.recent: return
+        merged = dict(zip(self.keys, self.ids))
+        merged.update(self.recent)
+        order = sorted(merged)
+        self.keys = array('q', order)
+        self.ids = array('i', (merged[k] for k in order))
+        self.recent = {}
+
+    def get(self, barcode, default=None):
+        key = barcode_key(barcode)
+        if key is None: return self.extra.get(barcode, default)
+        i = bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key: return self.ids[i]
+        return self.recent.get(key, default)
+
+    def resolve(self, barcodes):
+        """Map each known barcode to its product id; unknown barcodes are left out."""
+        out = {}
+        for bc in barcodes:
+            pid = self.get(bc)
+            if pid is not None: out[bc] = pid
+        return out
+
+    def resolve_or_create(self, cur, names):
+        """Map {barcode: name} to product ids, inserting all missing products in one statement."""
+        out = self.resolve(names)
+        missing = sorted(bc for bc in names if bc not in out)
+        if not missing: return out
+        cur.execute("""WITH v(barcode, name) AS (SELECT * FROM unnest(%s::text[], %s::text[])),
+            ins AS (INSERT INTO product (barcode, name) SELECT barcode, name FROM v
+                    ON CONFLICT (barcode) DO NOTHING RETURNING id, barcode)
+            SELECT id, barcode FROM ins
+            UNION ALL SELECT p.id, p.barcode FROM product p JOIN v ON v.barcode = p.barcode""",
+            (missing, [names[bc] for bc in missing]))
+        rows = cur.fetchall()
+        if len(rows) < len(missing):
+            # Inserted concurrently by another loader after our snapshot was taken
+            cur.execute("SELECT id, barcode FROM product WHERE barcode = ANY(%s)", (missing,))
+            rows = cur.fetchall()
+        for pid, bc in rows:
+            self.add(bc, pid); out[bc] = pid
+        if len(self.recent) > 50000: self.compact()
+        return out
+
+    def save(self, path=CACHE_PATH):
+        """Write the index atomically so the next run only fetches newer products."""
+        self.compact()
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        extra = '\n'.join(f"{bc}\t{pid}" for bc, pid in self.extra.items()).encode('utf-8')
+        tmp = path.with_suffix('.tmp')
+        with open(tmp, 'wb') as f:
+            f.write(MAGIC + struct.pack('<qqq', len(self.keys), self.max_id, len(extra)))
+            self.keys.tofile(f); self.ids.tofile(f)
+            f.write(extra)
+        os.replace(tmp, path)
+
+    def _read(self, path):
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC: raise ValueError("not a product index")
+            n, self.max_id, extra_len = struct.unpack('<qqq', f.read(24))
+            self.keys.fromfile(f, n); self.ids.fromfile(f, n)
+            extra = f.read(extra_len).decode('utf-8')
+        for line in extra.split('\n') if extra else []:
+            bc, pid = line.rsplit('\t', 1)
+            self.extra[bc] = int(pid)
@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+"""Single-pass promo ingest: each promo file is read once and fills promotion,
+promotion_item and the store_price promo flags.
+
+A chain is refreshed as a unit, from all of its promo files (several file
+names can map to one chain), in one transaction:
+  - promotions are upserted in batches as the files are read
+  - item lists are linked per promotion (or per chain promotion in the
+    chain_promo_items layout), each distinct blob parsed once
+  - flag rows are COPied into the session's tmp_promos as they are read, and
+    once every file is in, the chain's store_price flags are diffed against
+    them: newly on promo, changed promo price, no longer on promo
+Only the batch being built and the parsed item lists stay in memory.
+
+The ledger keeps one checkpoint per chain, over the hashes of all its files:
+a chain is skipped only when none of its files changed. update_prices runs
+refresh() as its promo step and passes the chains whose prices it reloaded,
+which are refreshed regardless, since their new price rows carry no flags.
+
+The file formats are plugins (FORMATS): the first whose column is in the
+header handles the file, turning a row into its item barcodes and, for the
+one-item-per-row format, the (barcode, promo price) pairs for the flags.
+
+  python scripts/promo_engine.py [--profile DIR]    # promo files in kaggle_data/ or the cached archive
+"""
+import argparse, ast, csv, hashlib, io, os, sys, time
+from datetime import datetime
+from psycopg2.extras import execute_values
+from kaggle_cache import find_files
+from run_ledger import RunLedger, file_hash
+from run_metrics import RunMetrics, profiled
+from batch_size import BatchSizer
+from chain_promo_items import is_chain_promo_layout, link_chain_items
+import promo_items
+
+# File key -> retailer_chain.name, for the key spellings of both Kaggle datasets
+CHAIN_MAP = {
+    'shufersal': 'Shufersal', 'rami_levy': 'Rami Levy', 'rami-levy': 'Rami Levy',
+    'yochananof': 'Yochananof', 'yohananof': 'Yochananof',
+    'victory': 'Victory', 'victory_new_source': 'Victory', 'osher_ad': 'Osher Ad', 'mega': 'Mega',
+    'tiv_taam': 'Tiv Taam', 'hazi_hinam': 'Hazi Hinam', 'keshet_taamim': 'Keshet Taamim', 'keshet': 'Keshet Taamim',
+    'freshmarket': 'Freshmarket', 'fresh_market': 'Freshmarket', 'fresh_market_and_super_dosh': 'Freshmarket',
+    'bareket': 'Bareket', 'city_market': 'City Market', 'city_market_shops': 'City Market',
+    'dor_alon': 'Dor Alon', 'good_pharm': 'Good Pharm', 'het_cohen': 'Het Cohen', 'het_cohen_new_source': 'Het Cohen',
+    'king_store': 'King Store', 'maayan_2000': 'Maayan 2000', 'mahsani_ashuk': 'Mahsani Ashuk',
+    'mahsani_ashuk_new_source': 'Mahsani Ashuk', 'mahsani_shuk': 'Mahsani Ashuk',
+    'meshmat_yosef': 'Meshmat Yosef', 'meshmat_yosef_1': 'Meshmat Yosef', 'meshmat_yosef_2': 'Meshmat Yosef',
+    'netiv_hased': 'Netiv Hased', 'polizer': 'Polizer', 'salach_dabach': 'Salach Dabach',
+    'shefa_barcart_ashem': 'Shefa Barcart Ashem', 'shuk_ahir': 'Shuk Ahir',
+    'stop_market': 'Stop Market', 'super_sapir': 'Super Sapir', 'super_yuda': 'Super Yuda',
+    'super_dosh': 'Super Dosh', 'zol_vebegadol': 'Zol Vebegadol', 'wolt': 'Wolt',
+    'yayno_bitan_and_carrefour': 'Carrefour', 'carrefour': 'Carrefour', 'yayno_bitan': 'Yayno Bitan',
+    'super_pharm': 'Super Pharm',
+}
+# Shortest item code linked to a promotion, and shortest that gets a store_price promo flag
+MIN_BARCODE, MIN_FLAG_BARCODE = 7, 5
+# Flag rows buffered before they are COPied into tmp_promos
+FLAG_ROWS = 50000
+
+# --- field parsing -------------------------------------------------------------
+
+def parse_date(val):
+    """Parse date string to something psycopg2 can handle."""
+    if not val or not val.strip():
+        return None
+    val = val.strip()
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d', '%d/%m/%Y', '%Y%m%d'):
+        try:
+            return datetime.strptime(val, fmt)
+        except ValueError:
+            continue
+    return None
+
+def parse_float(val):
+    if not val or not val.strip() or val.strip() == 'NO_BODY':
+        return None
+    try:
+        return float(val.strip())
+    except ValueError:
+        return None
+
+def is_club_only(clubs_str):
+    """Check if promotion is club-only."""
+    if not clubs_str:
+        return False
+    try:
+        data = ast.literal_eval(clubs_str.strip())
+        club_id = data.get('clubid', '0')
+        return str(club_id) != '0'
+    except Exception:
+        return False
+
+PROMO_COLUMNS = ('store_id', 'chain_promotion_id', 'description', 'start_date', 'end_date', 'min_qty', 'max_qty',
+                 'discounted_price', 'discount_rate', 'discount_type', 'min_purchase_amount', 'is_club_only',
+                 'reward_type')
+
+def promotion_row(row, store_id, promo_id):
+    """The PROMO_COLUMNS tuple for a row that opens a promotion, whichever format's column names it uses."""
+    return (
+        store_id, promo_id, (row.get('promotiondescription') or '').strip(),
+        parse_date(row.get('promotionstartdate') or row.get('promotionstartdatetime') or ''),
+        parse_date(row.get('promotionenddate') or row.get('promotionenddatetime') or ''),
+        parse_float(row.get('minqty') or row.get('minnoofitemoffered') or row.get('minnoofitemsoffered') or ''),
+        parse_float(row.get('maxqty') or ''),
+        parse_float(row.get('discountedprice') or ''), parse_float(row.get('discountrate') or ''),
+        (row.get('discounttype') or '').strip() or None, parse_float(row.get('minpurchaseamnt') or ''),
+        is_club_only(row.get('clubs') or ''), (row.get('rewardtype') or '').strip() or None)
+
+# --- format plugins ------------------------------------------------------------
+
+class ItemsJson:
+    """promotionitems: one row per promotion, its items as a dict repr / JSON blob."""
+    name, column = 'items_json', 'promotionitems'
+    decode = staticmethod(promo_items.decode_items)
+
+    def __init__(self):
+        decode = self.decode
+        self.items_of = promo_items.ParseCache(
+            lambda raw: tuple(bc for bc in promo_items.extract(raw, decode) if len(bc) >= MIN_BARCODE))
+
+    def items(self, row):
+        return self.items_of(row.get(self.column) or '')
+
+    def flags(self, row):
+        """(barcode, promo price) pairs for the store_price flags; none when the format has no item prices."""
+        return ()
+
+class ItemCode:
+    """itemcode: one row per promotion item, the promotion id carried forward, with the item's promo price."""
+    name, column = 'itemcode', 'itemcode'
+
+    def items(self, row):
+        bc = (row.get('itemcode') or '').strip()
+        return (bc,) if len(bc) >= MIN_BARCODE else ()
+
+    def flags(self, row):
+        bc = (row.get('itemcode') or '').strip()
+        price = parse_float(row.get('promoprice') or row.get('discountedprice') or row.get('itemprice') or '')
+        return ((bc, price),) if len(bc) >= MIN_FLAG_BARCODE and price and price > 0 else ()
+
+class Groups(ItemsJson):
+    """groups: a dict repr of groups, each with its own (possibly nested repr) promotionitems."""
+    name, column = 'groups', 'groups'
+    decode = staticmethod(promo_items.decode_groups)
+
+# Detection order: the first plugin whose column is in the header
+FORMATS = [ItemsJson, ItemCode, Groups]
+
+def detect(headers):
+    """A new plugin instance for a file with these (lower-cased) headers, or None."""
+    for plugin in FORMATS:
+        if plugin.column in headers: return plugin()
+    return None
+
+# --- writers -------------------------------------------------------------------
+
+def write_promo_batch(cur, promos, items, link_chain=None):
+    """Upsert a batch of promotions and link their items. Returns (promotions, new item links, bytes sent).
+
+    promos maps (store_id, chain_promotion_id) to a PROMO_COLUMNS tuple and items
+    is [(that key, barcodes)]. One INSERT ... RETURNING for all promotions, then
+    one INSERT ... SELECT that resolves every barcode with a join on product.
+    With link_chain (a chain id, chain_promo_items layout) items are linked once
+    per chain promotion instead.
+    """
+    if not promos: return 0, 0, 0
+    rows = execute_values(cur, f"""
+        INSERT INTO promotion ({', '.join(PROMO_COLUMNS)}, updated_at) VALUES %s
+        ON CONFLICT (store_id, chain_promotion_id)
+        DO UPDATE SET
+            description = EXCLUDED.description,
+            start_date = EXCLUDED.start_date,
+            end_date = EXCLUDED.end_date,
+            min_qty = EXCLUDED.min_qty,
+            discounted_price = EXCLUDED.discounted_price,
+            discount_rate = EXCLUDED.discount_rate,
+            is_club_only = EXCLUDED.is_club_only,
+            updated_at = NOW()
+        RETURNING id, store_id, chain_promotion_id
+    """, list(promos.values()), template=f"({','.join(['%s'] * len(PROMO_COLUMNS))},NOW())",
+        page_size=len(promos), fetch=True)
+    sent = len(cur.query)
+    if link_chain:
+        lists = {(key[1], id(codes)): codes for key, codes in items}
+        pairs = {(cpid, bc) for (cpid, _), codes in lists.items() for bc in codes}
+        if not pairs: return len(rows), 0, sent
+        added = link_chain_items(cur, link_chain, pairs)
+        return len(rows), added, sent + len(cur.query)
+    ids = {(store_id, str(cpid)): pid for pid, store_id, cpid in rows}
+    pairs = {(ids[key], bc) for key, codes in items if key in ids for bc in codes}
+    if not pairs: return len(rows), 0, sent
+    promo_ids, barcodes = zip(*pairs)
+    cur.execute("""
+        INSERT INTO promotion_item (promotion_id, product_id)
+        SELECT v.promotion_id, p.id
+        FROM unnest(%s::int[], %s::text[]) AS v(promotion_id, barcode)
+        JOIN product p ON p.barcode = v.barcode
+        ON CONFLICT DO NOTHING
+    """, (list(promo_ids), list(barcodes)))
+    return len(rows), cur.rowcount, sent + len(cur.query)
+
+def begin_promos(cur):
+    """Empty the session's tmp_promos / promo_new for one chain's flag rows."""
+    cur.execute("CREATE TEMP TABLE IF NOT EXISTS tmp_promos (barcode TEXT, store_id INTEGER, promo_price NUMERIC, "
+                "seq BIGINT GENERATED ALWAYS AS IDENTITY)")
+    cur.execute("CREATE TEMP TABLE IF NOT EXISTS promo_new (product_id INTEGER, store_id INTEGER, promo_price NUMERIC, "
+                "PRIMARY KEY (product_id, store_id))")
+    cur.execute("TRUNCATE tmp_promos, promo_new")
+
+def add_promos(cur, rows):
+    """COPY (barcode, store_id, promo_price) rows into tmp_promos, after the ones already there."""
+    if not rows: return
+    cur.copy_expert("COPY tmp_promos (barcode, store_id, promo_price) FROM STDIN",
+                    io.StringIO(''.join(f"{bc}\t{sid}\t{price}\n" for bc, sid, price in rows)))
+
+def resolve_promos(cur):
+    """Fill promo_new from tmp_promos by product id; the last row of a (product, store) wins."""
+    cur.execute("""INSERT INTO promo_new SELECT DISTINCT ON (p.id, t.store_id) p.id, t.store_id, t.promo_price
+        FROM tmp_promos t JOIN product p ON p.barcode = t.barcode ORDER BY p.id, t.store_id, t.seq DESC""")
+
+def apply_promos(cur, chain_id):
+    """Make the chain's promo flags match promo_new, writing only rows that differ. Returns (on, changed, off)."""
+    cur.execute("""WITH u AS (
+            UPDATE store_price sp SET is_promo = true, promo_price = n.promo_price
+            FROM promo_new n JOIN store_price old ON old.product_id = n.product_id AND old.store_id = n.store_id
+            WHERE sp.product_id = n.product_id AND sp.store_id = n.store_id
+              AND (sp.is_promo IS NOT TRUE OR sp.promo_price IS DISTINCT FROM n.promo_price)
+            RETURNING COALESCE(old.is_promo, false) AS was)
+        SELECT COUNT(*) FILTER (WHERE NOT was), COUNT(*) FILTER (WHERE was) FROM u""")
+    on, changed = cur.fetchone()
+    cur.execute("""WITH u AS (
+            UPDATE store_price sp SET is_promo = false, promo_price = NULL
+            WHERE sp.is_promo AND sp.store_id IN (SELECT id FROM store WHERE chain_id = %s)
+              AND NOT EXISTS (SELECT 1 FROM promo_new n WHERE n.product_id = sp.product_id AND n.store_id = sp.store_id)
+            RETURNING 1)
+        SELECT COUNT(*) FROM u""", (chain_id,))
+    return on, changed, cur.fetchone()[0]
+
+# --- the pass ------------------------------------------------------------------
+
+def chain_files(files):
+    """{chain name: [files]} in file order. Files without a chain mapping, or all but empty, are left out."""
+    chains = {}
+    for f in files:
+        chain_key = f.stem.replace('promo_full_file_', '').replace('promo_file_', '')
+        chain_name = CHAIN_MAP.get(chain_key)
+        if not chain_name:
+            print(f"  SKIP {f.stem} (no chain mapping for '{chain_key}')", flush=True); continue
+        if f.size < 1024: continue
+        chains.setdefault(chain_name, []).append(f)
+    return chains
+
+def chains_hash(files):
+    """One content hash over a chain's files, so the ledger sees the chain change when any file (or the set) does."""
+    h = hashlib.sha256()
+    for f in sorted(files, key=lambda f: f.name):
+        h.update(f"{f.name}\t{getattr(f, 'content_hash', None) or file_hash(f)}\n".encode())
+    return f"sha256:{h.hexdigest()}"
+
+def process_chain(cur, files, chain_name):
+    """Read a chain's promo files once each and write everything they feed, without committing.
+
+    Returns {'promotions', 'items', 'flags': (on, changed, off)}, or None if the
+    chain or its stores are unknown.
+    """
+    cur.execute("SELECT id FROM retailer_chain WHERE name=%s", (chain_name,))
+    row = cur.fetchone()
+    if not row:
+        print(f"    Chain '{chain_name}' not in DB", flush=True); return None
+    chain_id = row[0]
+    cur.execute("SELECT id, store_code FROM store WHERE chain_id=%s", (chain_id,))
+    store_map = {code: sid for sid, code in cur.fetchall()}
+    if not store_map:
+        print(f"    No stores for '{chain_name}'", flush=True); return None
+
+    link_chain = chain_id if is_chain_promo_layout(cur) else None
+    sizer = BatchSizer(f'{chain_name} promotions', 1000, lo=50, hi=20000)
+    counts = {'promotions': 0, 'items': 0}
+    # Promotions of the batch being built: key -> promotion row, and [(key, item tuple)]
+    promos, items, flags = {}, [], []
+
+    def flush():
+        with sizer.timed(len(promos)) as t:
+            p, i, t.bytes = write_promo_batch(cur, promos, items, link_chain)
+        counts['promotions'] += p; counts['items'] += i
+        promos.clear(); items.clear()
+
+    begin_promos(cur)
+    csv.field_size_limit(100 * 1024 * 1024)
+    for filepath in files:
+        last_store = store_id = promo_id = None
+        with filepath.open(newline='', encoding='utf-8-sig', errors='replace') as f:
+            reader = csv.DictReader(f)
+            reader.fieldnames = [h.strip().lower() for h in (reader.fieldnames or [])]
+            plugin = detect(reader.fieldnames)
+            if plugin is None:
+                print(f"    {filepath.stem}: unknown promo format ({reader.fieldnames[:10]}), skipping", flush=True)
+                continue
+            print(f"    {filepath.stem}: format {plugin.name}", flush=True)
+            for row in reader:
+                # Store and promotion id carry forward over continuation rows
+                sid = (row.get('storeid') or '').strip()
+                if sid and sid != last_store:
+                    last_store = sid
+                    store_id = store_map.get(sid)
+                    if not store_id and sid.isdigit(): store_id = store_map.get(str(int(sid)))
+                if not store_id: continue
+                pid = (row.get('promotionid') or '').strip()
+                if pid:
+                    promo_id = pid
+                    # Batches are cut only where a promotion starts, so its continuation rows stay with it
+                    if len(promos) >= sizer.size: flush()
+                if not promo_id: continue
+
+                key = (store_id, promo_id)
+                if pid or key not in promos:
+                    promos[key] = promotion_row(row, store_id, promo_id)
+                codes = plugin.items(row)
+                if codes: items.append((key, codes))
+                for bc, price in plugin.flags(row):
+                    flags.append((bc, store_id, price))
+                    if len(flags) >= FLAG_ROWS: add_promos(cur, flags); flags.clear()
+            if hasattr(plugin, 'items_of'): print(f"    {plugin.items_of.summary()}", flush=True)
+    if promos: flush()
+    print(f"    {sizer.summary()}", flush=True)
+
+    # Files without per-item prices still refresh the flags: the chain has none now
+    add_promos(cur, flags)
+    resolve_promos(cur)
+    counts['flags'] = apply_promos(cur, chain_id)
+    return counts
+
+def refresh(conn, files, metrics, ledger, reload=()):
+    """Refresh every chain that has promo files, one transaction and ledger checkpoint per chain.
+
+    A chain that fails is rolled back as a whole, left out of the ledger and
+    retried next run; the other chains still commit. Chains in `reload` are
+    refreshed even if their files are unchanged. Once every chain has
+    succeeded, chains without promo files lose their flags,
+    unless no chain is current at all (no files, or none of their chains known).
+    Returns (totals, complete).
+    """
+    cur = conn.cursor()
+    totals = {'promotions': 0, 'items': 0, 'flags': 0}
+    # Chains whose flags are current: refreshed now, or unchanged since a committed run
+    current, complete = set(), True
+    for chain_name, files in chain_files(files).items():
+        checkpoint = ledger.open(f"promos:{chain_name}", content_hash=chains_hash(files),
+                                 reuse=chain_name not in reload)
+        if checkpoint.done:
+            note = "already committed" if ledger.resuming else "unchanged since last run"
+            print(f"  {chain_name}: promos {note}, skipping", flush=True)
+            current.add(chain_name); continue
+        fbytes = sum(f.size for f in files)
+        print(f"  {chain_name} ({fbytes / (1024 * 1024):.1f}MB in {len(files)} file(s))...", flush=True)
+        t0 = time.time()
+        try:
+            with profiled('promos', chain_name) as prof, metrics.stage('promos', chain_name) as s:
+                counts = process_chain(cur, files, chain_name)
+                checkpoint.finish(cur, counts['promotions'] if counts else 0)
+                conn.commit()
+                s.add(rows=counts['promotions'] if counts else 0, bytes=fbytes)
+            if prof: s.profiles.append(prof)
+        except Exception as e:
+            conn.rollback()
+            print(f"    ERROR {e}", flush=True); complete = False; continue
+        if not counts: continue
+        current.add(chain_name)
+        on, changed, off = counts['flags']
+        print(f"    -> {counts['promotions']} promotions, {counts['items']} items, "
+              f"flags +{on} {changed} changed -{off} in {time.time() - t0:.1f}s", flush=True)
+        totals['promotions'] += counts['promotions']; totals['items'] += counts['items']
+        totals['flags'] += on + changed + off
+
+    if not current:
+        # No promo files, or none of their chains loaded: an empty feed must not clear every flag
+        print("  No chain's promos are current, keeping existing promo flags", flush=True)
+    elif complete:
+        # Chains with no promo file have no current promos
+        with metrics.stage('stale') as s:
+            cur.execute("""UPDATE store_price SET is_promo = false, promo_price = NULL
+                WHERE is_promo AND store_id NOT IN (SELECT s.id FROM store s JOIN retailer_chain rc ON rc.id = s.chain_id
+                                                    WHERE rc.name = ANY(%s))""", (sorted(current),))
+            s.add(rows=cur.rowcount)
+            print(f"  Cleared {cur.rowcount} promos of chains without a promo file", flush=True)
+            conn.commit()
+    if promo_items.report(): print(f"  {promo_items.report()}", flush=True)
+    return totals, complete
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--profile', metavar='DIR', default=os.environ.get('INGEST_PROFILE'),
+                        help="write per-chain cProfile, tracemalloc and peak RSS reports to DIR")
+    args = parser.parse_args()
+    if args.profile: os.environ['INGEST_PROFILE'] = args.profile
+    db_url = os.environ.get('DATABASE_URL')
+    if not db_url:
+        print("ERROR: DATABASE_URL not set"); sys.exit(1)
+
+    # kaggle_data/ or the cached archive - prefer the full snapshot
+    promo_files = find_files("promo_full_file") or find_files("promo_file_")
+    promo_files = [f for f in promo_files if '_temp' not in f.stem]
+    print(f"Found {len(promo_files)} promo files", flush=True)
+    if not promo_files: sys.exit(1)
+
+    metrics = RunMetrics('promo_engine')
+    conn = metrics.connect(db_url, connect_timeout=30)
+    ledger = RunLedger(conn, 'promo_engine')
+    if ledger.resuming: print("Previous run did not finish, resuming", flush=True)
+    totals, complete = refresh(conn, promo_files, metrics, ledger)
+    if complete: ledger.finish_run()
+    print(f"\n=== DONE: {totals['promotions']} promotions, {totals['items']} item links, "
+          f"{totals['flags']} promo flags changed, {ledger.summary()} ===", flush=True)
+    metrics.finish(conn, ok=complete)
+    conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""Pull itemcode values out of promotionitems / groups cells without decoding them.
+
+The cells are Python reprs (sometimes JSON) of nested dicts, up to megabytes
+each, and the groups format nests a second repr inside a string. Building the
+object tree with ast.literal_eval only to read one key per item is the
+slowest step of promo ingest, so itemcodes() scans the text for the itemcode
+keys instead, quoted or escaped at any depth.
+
+The same blob is repeated for every store of a chain; ParseCache decodes
+each distinct cell once and hands every promotion the same tuple.
+
+Verification: with PROMO_ITEMS_VERIFY=1 every cell is also decoded the old
+way (decode_items / decode_groups); differences are counted and the first few
+logged, and the decoded result is what the caller gets. Or check whole files
+offline:
+
+  python scripts/promo_items.py kaggle_data/promo_full_file_*.csv
+"""
+import ast, csv, hashlib, json, os, re, sys, time
+
+# 'itemcode': '729...' / "ItemCode": 729... / \'itemcode\': \'729...\' (inside a nested repr)
+ITEMCODE = re.compile(r"""\\*(["'])(?:itemcode|ItemCode)\\*\1\s*:\s*(?:\\*(["'])(.*?)\\*\2|(-?\d[\d.eE+-]*))""")
+VERIFY = os.environ.get('PROMO_ITEMS_VERIFY') == '1'
+SHOW = 5
+
+stats = {'checked': 0, 'mismatched': 0, 'fast_s': 0.0, 'decode_s': 0.0}
+
+def itemcodes(raw):
+    """Every non-empty itemcode in the cell, in order. 'NO_BODY' placeholders are dropped."""
+    if not raw: return []
+    out = []
+    for m in ITEMCODE.finditer(raw):
+        code = (m.group(3) if m.group(2) else m.group(4)).strip()
+        if code and code != 'NO_BODY': out.append(code)
+    return out
+
+def extract(raw, decode):
+    """itemcodes(raw), or in verify mode decode(raw) after comparing the two."""
+    if not VERIFY: return itemcodes(raw)
+    t0 = time.perf_counter()
+    fast = itemcodes(raw)
+    t1 = time.perf_counter()
+    slow = decode(raw)
+    stats['fast_s'] += t1 - t0; stats['decode_s'] += time.perf_counter() - t1
+    stats['checked'] += 1
+    if fast != slow:
+        stats['mismatched'] += 1
+        if stats['mismatched'] <= SHOW:
+            print(f"    promo_items mismatch: fast {fast[:5]}... ({len(fast)}), decoded {slow[:5]}... ({len(slow)})"
+                  f" in {raw[:120]!r}", file=sys.stderr, flush=True)
+    return slow
+
+def report():
+    """One line on the verify counters, or None when nothing was verified."""
+    if not stats['checked']: return None
+    return (f"promo_items verify: {stats['mismatched']}/{stats['checked']} cells differ, "
+            f"scan {stats['fast_s']:.2f}s vs decode {stats['decode_s']:.2f}s")
+
+class ParseCache:
+    """parse(raw) memoized by a digest of the cell, so the cell itself is not kept."""
+    def __init__(self, parse):
+        self.parse, self.lists, self.hits = parse, {}, 0
+
+    def __call__(self, raw):
+        if not raw: return self.parse(raw)
+        key = hashlib.blake2b(raw.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+        value = self.lists.get(key)
+        if value is None: value = self.lists[key] = self.parse(raw)
+        else: self.hits += 1
+        return value
+
+    def summary(self):
+        return f"{len(self.lists)} distinct item lists, {self.hits} repeats parsed from cache"
+
+def _decode(raw):
+    try: return json.loads(raw)
+    except ValueError:
+        try: return ast.literal_eval(raw)
+        except (ValueError, SyntaxError, MemoryError, RecursionError): return None
+
+def decode_items(raw):
+    """Reference parser for promotionitems cells: decode, then read item / promotionitem -> itemcode."""
+    if not raw or not raw.strip(): return []
+    data = _decode(raw)
+    if not isinstance(data, dict): return []
+    items = data.get("item", data.get("promotionitem", []))
+    if isinstance(items, dict): items = [items]
+    codes = [str(i.get("itemcode") or i.get("ItemCode", "")).strip()
+             for i in items if isinstance(i, dict) and (i.get("itemcode") or i.get("ItemCode"))]
+    return [c for c in codes if c and c != "NO_BODY"]
+
+def decode_groups(raw):
+    """Reference parser for groups cells: group -> promotionitems (maybe itself a repr) -> promotionitem -> itemcode."""
+    if not raw or not raw.strip(): return []
+    data = _decode(raw)
+    if not isinstance(data, dict): return []
+    groups = data.get("group", [])
+    if isinstance(groups, dict): groups = [groups]
+    barcodes = []
+    for g in groups:
+        if not isinstance(g, dict): continue
+        promo_items = g.get("promotionitems", {})
+        if isinstance(promo_items, str): promo_items = _decode(promo_items)
+        if not isinstance(promo_items, dict): continue
+        items = promo_items.get("promotionitem", [])
+        if isinstance(items, dict): items = [items]
+        for item in items:
+            if not isinstance(item, dict): continue
+            bc = str(item.get("itemcode", "")).strip()
+            if bc and bc != "NO_BODY": barcodes.append(bc)
+    return barcodes
+
+def verify_file(path):
+    """Compare scan and decode on every promotionitems / groups cell of a CSV. Returns (cells, mismatches)."""
+    csv.field_size_limit(100 * 1024 * 1024)
+    cells = bad = 0
+    with open(path, encoding='utf-8', newline='') as f:
+        reader = csv.DictReader(f)
+        cols = [(c, d) for c, d in (('promotionitems', decode_items), ('groups', decode_groups))
+                if c in (reader.fieldnames or [])]
+        for row in reader:
+            for col, decode in cols:
+                raw = row.get(col) or ''
+                if not raw.strip(): continue
+                t0 = time.perf_counter()
+                fast = itemcodes(raw)
+                t1 = time.perf_counter()
+                slow = decode(raw)
+                stats['fast_s'] += t1 - t0; stats['decode_s'] += time.perf_counter() - t1
+                cells += 1
+                if fast != slow:
+                    bad += 1
+                    if bad <= SHOW: print(f"  {path}: {col} differs: {fast[:5]} vs {slow[:5]} in {raw[:120]!r}")
+    stats['checked'] += cells; stats['mismatched'] += bad
+    return cells, bad
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2: sys.exit(__doc__)
+    for p in sys.argv[1:]:
+        cells, bad = verify_file(p)
+        print(f"{p}: {cells} cells, {bad} differ", flush=True)
+    print(report() or "no promotionitems / groups cells found")
+    sys.exit(1 if stats['mismatched'] else 0)
@@ -4,9 +4,9 @@ reclassify_categories.py - סיווג מחדש של כל המוצרים עם Cla
 עלות משוערת: ~$0.50 לכל 256K מוצרים
 """
 import os, sys, json, time
-import psycopg2
 from psycopg2.extras import execute_values
 import urllib.request
+from run_metrics import RunMetrics
 
 ANTHROPIC_API_KEY = os.environ.get("ANTHROPIC_API_KEY")
 DB_URL = os.environ.get("DATABASE_URL")
@@ -92,7 +92,8 @@ def main():
     if not DB_URL:
         print("ERROR: DATABASE_URL not set"); sys.exit(1)
 
-    conn = psycopg2.connect(DB_URL)
+    metrics = RunMetrics("reclassify_categories")
+    conn = metrics.connect(DB_URL)
     conn.autocommit = False
     cur = conn.cursor()
 
@@ -129,7 +130,9 @@ def main():
             print(f"  batch {batch_num}/{total_batches} ({i}-{min(i+BATCH_SIZE,total)})...", flush=True)
 
         try:
-            result = call_claude(batch)
+            with metrics.stage("classify") as s:
+                result = call_claude(batch)
+                s.add(rows=len(batch))
 
             updates = []
             for idx, (pid, name) in enumerate(batch):
@@ -141,10 +144,12 @@ def main():
                         updates.append((cat, sub, pid))
 
             if updates:
-                execute_values(cur,
-                    "UPDATE product SET category=data.cat, subcategory=data.sub FROM (VALUES %s) AS data(cat,sub,id) WHERE product.id=data.id",
-                    updates)
-                conn.commit()
+                with metrics.stage("update") as s:
+                    execute_values(cur,
+                        "UPDATE product SET category=data.cat, subcategory=data.sub FROM (VALUES %s) AS data(cat,sub,id) WHERE product.id=data.id",
+                        updates)
+                    conn.commit()
+                    s.add(rows=len(updates))
                 classified += len(updates)
 
         except Exception as e:
@@ -158,6 +163,7 @@ def main():
         time.sleep(0.3)
 
     print(f"\n=== סיום: {classified}/{total} סווגו, {errors} שגיאות ===")
+    metrics.finish(conn, ok=errors == 0)
     conn.close()
 
 
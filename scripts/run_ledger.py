@@ -0,0 +1,100 @@
+"""Run ledger: what each ingest script has committed, per source file and chunk.
+
+Every script run puts a run marker row (file_name '*') into 'running' and sets
+it to 'done' only when the run completes. If the previous run never reached
+'done' (it timed out or lost its connection), the next run resumes. Files that
+were cut off mid-way restart from their last committed chunk offset.
+
+The per-file rows double as a manifest of what was last loaded: a file whose
+content hash matches a 'done' row is byte-identical to what is already in
+the DB and is skipped, resume or not (INGEST_FORCE=1 reloads everything).
+
+Checkpoints are written with the caller's cursor, so they commit in the same
+transaction as the data they describe.
+"""
+import hashlib, os
+from pathlib import Path
+
+def ensure_ledger(cur):
+    cur.execute("""CREATE TABLE IF NOT EXISTS ingest_ledger (
+        script TEXT NOT NULL,
+        file_name TEXT NOT NULL,
+        content_hash TEXT NOT NULL DEFAULT '',
+        chunk_offset BIGINT NOT NULL DEFAULT 0,
+        rows BIGINT NOT NULL DEFAULT 0,
+        status TEXT NOT NULL DEFAULT 'running',
+        updated_at TIMESTAMP NOT NULL DEFAULT NOW(),
+        PRIMARY KEY (script, file_name))""")
+
+def file_hash(path):
+    """'sha256:<hex>' of the file, the same form kaggle_cache.Member.content_hash gives an archive member."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return f"sha256:{h.hexdigest()}"
+
+class Checkpoint:
+    """Resume point for one source file. Plain data, so it can be handed to worker processes."""
+    def __init__(self, script, file_name, content_hash, offset=0, done=False, rows=0):
+        self.script, self.file_name, self.content_hash = script, file_name, content_hash
+        self.offset, self.done, self.rows = offset, done, rows
+
+    def save(self, cur, offset, rows):
+        """Record that source records before `offset` are committed (call before conn.commit())."""
+        cur.execute("""UPDATE ingest_ledger SET chunk_offset=%s, rows=rows+%s, updated_at=NOW()
+            WHERE script=%s AND file_name=%s""", (offset, rows, self.script, self.file_name))
+        self.offset = offset
+
+    def finish(self, cur, rows=0):
+        cur.execute("""UPDATE ingest_ledger SET status='done', rows=rows+%s, updated_at=NOW()
+            WHERE script=%s AND file_name=%s""", (rows, self.script, self.file_name))
+        self.done = True
+
+class RunLedger:
+    def __init__(self, conn, script, force=None):
+        self.conn, self.script = conn, script
+        self.force = os.environ.get('INGEST_FORCE') == '1' if force is None else force
+        self.unchanged, self.unchanged_rows = 0, 0
+        cur = conn.cursor()
+        ensure_ledger(cur)
+        cur.execute("SELECT status FROM ingest_ledger WHERE script=%s AND file_name='*'", (script,))
+        row = cur.fetchone()
+        self.resuming = bool(row) and row[0] == 'running'
+        cur.execute("""INSERT INTO ingest_ledger (script, file_name, status) VALUES (%s, '*', 'running')
+            ON CONFLICT (script, file_name) DO UPDATE SET status='running', updated_at=NOW()""", (script,))
+        conn.commit()
+
+    def open(self, path, content_hash=None, reuse=True):
+        """Checkpoint for a source file; resumes it if the previous run was cut off on the same content.
+
+        The checkpoint comes back done if the file is unchanged since it was last
+        loaded, unless the ledger is forced or the caller passes reuse=False.
+        """
+        name = getattr(path, 'name', None) or Path(path).name
+        # Archive members carry their own hash; plain files are hashed here
+        content_hash = content_hash or getattr(path, 'content_hash', None) or file_hash(path)
+        cur = self.conn.cursor()
+        cur.execute("""SELECT content_hash, chunk_offset, status, rows FROM ingest_ledger
+            WHERE script=%s AND file_name=%s""", (self.script, name))
+        row = cur.fetchone()
+        if row and row[0] == content_hash:
+            done = row[2] == 'done'
+            if done and reuse and not self.force and not self.resuming:
+                self.unchanged += 1; self.unchanged_rows += row[3]
+            if self.resuming or (done and reuse and not self.force):
+                return Checkpoint(self.script, name, content_hash, row[1], done, row[3])
+        cur.execute("""INSERT INTO ingest_ledger (script, file_name, content_hash) VALUES (%s, %s, %s)
+            ON CONFLICT (script, file_name) DO UPDATE SET content_hash=EXCLUDED.content_hash,
+              chunk_offset=0, rows=0, status='running', updated_at=NOW()""", (self.script, name, content_hash))
+        self.conn.commit()
+        return Checkpoint(self.script, name, content_hash)
+
+    def summary(self):
+        return f"{self.unchanged} unchanged files skipped ({self.unchanged_rows} rows)"
+
+    def finish_run(self):
+        cur = self.conn.cursor()
+        cur.execute("UPDATE ingest_ledger SET status='done', updated_at=NOW() WHERE script=%s AND file_name='*'",
+                    (self.script,))
+        self.conn.commit()
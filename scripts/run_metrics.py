@@ -0,0 +1,228 @@
+"""Run metrics: stage timers, row/byte counters and DB round trips for one script run.
+
+    metrics = RunMetrics('update_prices')
+    conn = metrics.connect(DB_URL)
+    with metrics.stage('prices', chain='Shufersal') as s:
+        ...
+        s.add(rows=n, bytes=f.size)
+    metrics.finish(conn)
+
+Connections opened through connect() count every execute, COPY and commit,
+and a stage adds the round trips its connections made while it ran. Stages
+with the same (name, chain) accumulate. finish() prints the report as one
+JSON line starting with RUN_REPORT, writes it to the file named by
+$RUN_REPORT if set, and records it in ingest_run (one row per stage plus a
+'*' row for the whole run) unless RUN_REPORT_DB=0. The API reads ingest_run
+for per-chain freshness.
+
+Profiling is opt-in: with INGEST_PROFILE=<dir> (or a script's --profile),
+profiled() blocks write a cProfile dump, the tracemalloc top allocations and
+the block's peak RSS to <dir>/<run_id>/, one set of files per chain file.
+"""
+import cProfile, io, json, os, pstats, re, resource, time, tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+import psycopg2, psycopg2.extensions as ext
+from psycopg2.extras import execute_values
+
+class CountingCursor(ext.cursor):
+    def execute(self, query, vars=None):
+        self.connection.round_trips += 1
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        vars_list = list(vars_list)
+        self.connection.round_trips += len(vars_list)
+        return super().executemany(query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        self.connection.round_trips += 1
+        return super().copy_expert(sql, file, size)
+
+    def copy_from(self, *args, **kwargs):
+        self.connection.round_trips += 1
+        return super().copy_from(*args, **kwargs)
+
+class CountingConnection(ext.connection):
+    round_trips = 0
+
+    def cursor(self, *args, **kwargs):
+        kwargs.setdefault('cursor_factory', CountingCursor)
+        return super().cursor(*args, **kwargs)
+
+    def commit(self):
+        self.round_trips += 1
+        return super().commit()
+
+    def rollback(self):
+        self.round_trips += 1
+        return super().rollback()
+
+def connect(db_url, **kwargs):
+    """psycopg2.connect() whose connection counts round trips (for worker processes)."""
+    return psycopg2.connect(db_url, connection_factory=CountingConnection, **kwargs)
+
+def ensure_run_table(cur):
+    cur.execute("""CREATE TABLE IF NOT EXISTS ingest_run (
+        run_id TEXT NOT NULL,
+        script TEXT NOT NULL,
+        stage TEXT NOT NULL,
+        chain TEXT NOT NULL DEFAULT '',
+        started_at TIMESTAMP NOT NULL,
+        finished_at TIMESTAMP NOT NULL,
+        seconds DOUBLE PRECISION NOT NULL,
+        rows BIGINT NOT NULL DEFAULT 0,
+        bytes BIGINT NOT NULL DEFAULT 0,
+        round_trips BIGINT NOT NULL DEFAULT 0,
+        ok BOOLEAN NOT NULL,
+        report JSONB,
+        PRIMARY KEY (run_id, stage, chain))""")
+    cur.execute("CREATE INDEX IF NOT EXISTS ingest_run_chain_idx ON ingest_run (chain, finished_at)")
+
+def peak_rss_mb(reset=False):
+    """This process's peak RSS; reset=True restarts the high-water mark (Linux) so a block can measure its own."""
+    try:
+        if reset:
+            with open('/proc/self/clear_refs', 'w') as f: f.write('5')
+        with open('/proc/self/status') as f:
+            return next(int(l.split()[1]) for l in f if l.startswith('VmHWM')) / 1024
+    except (OSError, StopIteration, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+@contextmanager
+def profiled(stage, chain=None, top=25):
+    """Profile the block if INGEST_PROFILE is set: yields a dict that is filled with the block's
+    peak_rss_mb / alloc_peak_mb and artifact paths afterwards, or with nothing when profiling is off."""
+    out = os.environ.get('INGEST_PROFILE_RUN') or os.environ.get('INGEST_PROFILE')
+    summary = {}
+    if not out:
+        yield summary; return
+    out = Path(out); out.mkdir(parents=True, exist_ok=True)
+    base = out / re.sub(r'[^\w.-]+', '_', f"{stage}-{chain}" if chain else stage)
+    rss_before = peak_rss_mb(reset=True)
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing: tracemalloc.start()
+    tracemalloc.reset_peak()
+    prof = cProfile.Profile()
+    t0 = time.time()
+    prof.enable()
+    try:
+        yield summary
+    finally:
+        prof.disable()
+        snapshot = tracemalloc.take_snapshot()
+        alloc_peak = tracemalloc.get_traced_memory()[1]
+        if started_tracing: tracemalloc.stop()
+        summary.update(seconds=round(time.time() - t0, 3), peak_rss_mb=round(peak_rss_mb(), 1),
+                       rss_before_mb=round(rss_before, 1), alloc_peak_mb=round(alloc_peak / 1024 / 1024, 1),
+                       profile=str(base) + '.prof', report=str(base) + '.txt')
+        prof.dump_stats(summary['profile'])
+        text = io.StringIO()
+        text.write(f"{stage} {chain or ''}: {summary['seconds']}s, peak RSS {summary['peak_rss_mb']}MB "
+                   f"(from {summary['rss_before_mb']}MB), traced allocation peak {summary['alloc_peak_mb']}MB\n")
+        text.write(f"\nTop {top} allocations still held at the end, by line:\n")
+        for stat in snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)]).statistics('lineno')[:top]:
+            text.write(f"  {stat}\n")
+        text.write(f"\nTop {top} functions by cumulative time:\n")
+        pstats.Stats(prof, stream=text).sort_stats('cumulative').print_stats(top)
+        Path(summary['report']).write_text(text.getvalue())
+
+class Stage:
+    def __init__(self, name, chain=None):
+        self.name, self.chain = name, chain
+        self.started, self.finished = None, None
+        self.seconds, self.rows, self.bytes, self.round_trips, self.ok = 0.0, 0, 0, 0, True
+        self.external_trips, self.profiles, self.timers = 0, [], {}
+
+    def add(self, rows=0, bytes=0, round_trips=0, timers=None):
+        """Count work done inside the stage; round_trips is for connections the run does not own (workers),
+        timers are named seconds such as the parse/write busy and idle split of a pipeline."""
+        self.rows += rows; self.bytes += bytes
+        self.round_trips += round_trips; self.external_trips += round_trips
+        for k, v in (timers or {}).items(): self.timers[k] = self.timers.get(k, 0.0) + v
+
+    def as_dict(self):
+        d = {'stage': self.name, 'chain': self.chain, 'seconds': round(self.seconds, 3), 'rows': self.rows,
+             'bytes': self.bytes, 'round_trips': self.round_trips,
+             'rows_per_sec': round(self.rows / self.seconds, 1) if self.seconds else None, 'ok': self.ok}
+        if self.timers: d['timers'] = {k: round(v, 3) for k, v in self.timers.items()}
+        if self.profiles: d['profiles'] = self.profiles
+        return d
+
+class RunMetrics:
+    def __init__(self, script):
+        self.script = script
+        self.started = datetime.now()
+        self.run_id = f"{script}-{self.started:%Y%m%dT%H%M%S}-{os.getpid()}"
+        self.stages, self.conns = {}, []
+        if os.environ.get('INGEST_PROFILE'):
+            # Exported so worker processes write into the same run directory
+            os.environ['INGEST_PROFILE_RUN'] = str(Path(os.environ['INGEST_PROFILE']) / self.run_id)
+
+    def connect(self, db_url, **kwargs):
+        conn = connect(db_url, **kwargs)
+        self.conns.append(conn)
+        return conn
+
+    def round_trips(self):
+        return sum(c.round_trips for c in self.conns)
+
+    @contextmanager
+    def stage(self, name, chain=None):
+        s = self.stages.setdefault((name, chain), Stage(name, chain))
+        s.started = s.started or datetime.now()
+        t0, trips = time.time(), self.round_trips()
+        try:
+            yield s
+        except BaseException:
+            s.ok = False
+            raise
+        finally:
+            s.seconds += time.time() - t0
+            s.round_trips += self.round_trips() - trips
+            s.finished = datetime.now()
+
+    def record(self, name, chain=None, seconds=0.0, ok=True, rows=0, bytes=0, round_trips=0, profile=None, timers=None):
+        """Add a stage timed elsewhere, e.g. by a worker process."""
+        s = self.stages.setdefault((name, chain), Stage(name, chain))
+        now = datetime.now()
+        s.started, s.finished = s.started or now, now
+        s.seconds += seconds; s.ok = s.ok and ok
+        s.add(rows, bytes, round_trips, timers)
+        if profile: s.profiles.append(profile)
+
+    def report(self, ok=True):
+        stages = [s.as_dict() for s in self.stages.values()]
+        return {'run_id': self.run_id, 'script': self.script, 'started_at': self.started.isoformat(timespec='seconds'),
+                'seconds': round((datetime.now() - self.started).total_seconds(), 3), 'ok': ok,
+                'rows': sum(s['rows'] for s in stages), 'bytes': sum(s['bytes'] for s in stages),
+                'round_trips': self.round_trips() + sum(s.external_trips for s in self.stages.values()),
+                'stages': stages}
+
+    def finish(self, conn=None, ok=True):
+        """Emit the run report (stdout, $RUN_REPORT, ingest_run). Returns it as a dict."""
+        report = self.report(ok)
+        line = json.dumps(report, ensure_ascii=False)
+        print(f"RUN_REPORT {line}", flush=True)
+        if os.environ.get('RUN_REPORT'):
+            Path(os.environ['RUN_REPORT']).write_text(line + "\n")
+        if conn is not None and os.environ.get('RUN_REPORT_DB') != '0':
+            try:
+                self.save(conn, report)
+            except psycopg2.Error as e:
+                conn.rollback()
+                print(f"WARNING: run report not saved: {e}", flush=True)
+        return report
+
+    def save(self, conn, report):
+        cur = conn.cursor()
+        ensure_run_table(cur)
+        rows = [(self.run_id, self.script, s.name, s.chain or '', s.started, s.finished, s.seconds, s.rows,
+                 s.bytes, s.round_trips, s.ok, None) for s in self.stages.values()]
+        rows.append((self.run_id, self.script, '*', '', self.started, datetime.now(), report['seconds'], report['rows'],
+                     report['bytes'], report['round_trips'], report['ok'], json.dumps(report, ensure_ascii=False)))
+        execute_values(cur, """INSERT INTO ingest_run (run_id, script, stage, chain, started_at, finished_at,
+                seconds, rows, bytes, round_trips, ok, report) VALUES %s
+            ON CONFLICT (run_id, stage, chain) DO NOTHING""", rows)
+        conn.commit()
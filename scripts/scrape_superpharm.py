@@ -3,9 +3,14 @@
 scrape_superpharm.py - סופרפארם מחירים יומיים
 """
 import os, gzip, xml.etree.ElementTree as ET
-import psycopg2, requests, time, re
+import requests, time, re, argparse
 from datetime import datetime, timedelta
 from psycopg2.extras import execute_values
+from product_cache import ProductCache
+from price_partitions import ensure_partition, is_partitioned
+from chain_prices import is_chain_layout
+from price_history import ensure_history, history_ctes
+from run_metrics import RunMetrics, profiled
 
 DB_URL = os.environ['DATABASE_URL']
 BASE_URL = "https://prices.super-pharm.co.il"
@@ -85,7 +90,7 @@ def parse_stores_xml(xml_content, chain_id, conn):
     conn.commit()
     return count
 
-def parse_prices_xml(xml_content, chain_id, conn):
+def parse_prices_xml(xml_content, chain_id, conn, cache):
     cur = conn.cursor()
     root = ET.fromstring(xml_content)
     
@@ -111,7 +116,8 @@ def parse_prices_xml(xml_content, chain_id, conn):
         return 0
     store_id = store_row[0]
     
-    updates = []
+    items = {}
+    names = {}
     for item in root.iter('Item'):
         barcode = (item.findtext('ItemCode') or '').strip()
         name = (item.findtext('ItemName') or '').strip()
@@ -124,29 +130,48 @@ def parse_prices_xml(xml_content, chain_id, conn):
             continue
         if price <= 0 or price > 10000:
             continue
-        
-        cur.execute("SELECT id FROM product WHERE barcode=%s", (barcode,))
-        prod = cur.fetchone()
-        if not prod:
-            cur.execute("""
-                INSERT INTO product (barcode, name) VALUES (%s, %s)
-                ON CONFLICT (barcode) DO UPDATE SET name=COALESCE(NULLIF(EXCLUDED.name,''), product.name)
-                RETURNING id
-            """, (barcode, name))
-            prod = cur.fetchone()
-        if not prod:
-            continue
-        updates.append((store_id, prod[0], price, False))
+        items[barcode] = price
+        names[barcode] = name
+    
+    product_ids = cache.resolve_or_create(cur, names)
+    updates = [(store_id, product_ids[bc], price, False) for bc, price in items.items() if bc in product_ids]
+    # Only prices that moved are written, and their history with them in the same transaction
+    changed = record_history(cur, updates) if updates else []
     
-    if updates:
+    if changed and is_partitioned(cur):
+        ensure_partition(cur, chain_id)
+        execute_values(cur, """
+            INSERT INTO store_price (store_id, product_id, price, is_promo, chain_id)
+            VALUES %s
+            ON CONFLICT (product_id, store_id, chain_id) DO UPDATE SET price=EXCLUDED.price
+        """, [u + (chain_id,) for u in changed])
+    elif changed and is_chain_layout(cur):
+        # The view's trigger upserts; ON CONFLICT cannot target a view
+        execute_values(cur, "INSERT INTO store_price (store_id, product_id, price, is_promo) VALUES %s", changed)
+    elif changed:
         execute_values(cur, """
             INSERT INTO store_price (store_id, product_id, price, is_promo)
             VALUES %s
             ON CONFLICT (store_id, product_id) DO UPDATE SET price=EXCLUDED.price
-        """, updates)
-        conn.commit()
+        """, changed)
+    conn.commit()
     return len(updates)
 
+def record_history(cur, updates):
+    """Close and open the price_history intervals of the (store_id, product_id, price, ...) updates whose
+    price differs from store_price. Returns those updates."""
+    cur.execute("CREATE TEMP TABLE IF NOT EXISTS sp_prices (store_id INTEGER, product_id INTEGER, price NUMERIC)")
+    cur.execute("TRUNCATE sp_prices")
+    execute_values(cur, "INSERT INTO sp_prices (store_id, product_id, price) VALUES %s", [u[:3] for u in updates])
+    cur.execute(f"""WITH chg AS (
+            SELECT t.product_id, t.store_id, t.price FROM sp_prices t
+            LEFT JOIN store_price sp ON sp.product_id = t.product_id AND sp.store_id = t.store_id
+            WHERE sp.price IS DISTINCT FROM t.price),
+        {history_ctes("SELECT * FROM chg", "SELECT product_id, store_id FROM chg")}
+        SELECT ARRAY(SELECT product_id FROM chg)""")
+    moved = set(cur.fetchone()[0])
+    return [u for u in updates if u[1] in moved]
+
 def try_download(session, fname):
     """מנסה להוריד קובץ"""
     url = f"{BASE_URL}/{fname}"
@@ -159,9 +184,18 @@ def try_download(session, fname):
     return None
 
 def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--profile', metavar='DIR', default=os.environ.get('INGEST_PROFILE'),
+                        help="write per-file cProfile, tracemalloc and peak RSS reports to DIR")
+    args = parser.parse_args()
+    if args.profile: os.environ['INGEST_PROFILE'] = args.profile
     session = make_session()
-    conn = psycopg2.connect(DB_URL)
+    metrics = RunMetrics('scrape_superpharm')
+    conn = metrics.connect(DB_URL)
     chain_id = get_or_create_chain(conn)
+    ensure_history(conn.cursor())
+    conn.commit()
+    cache = ProductCache.load(conn.cursor())
     
     print("מביא רשימת קבצים...")
     files = get_file_list(session)
@@ -170,9 +204,13 @@ def main():
     stores_files = [f for f in files if 'StoresFull' in f or 'Stores' in f]
     for fname in stores_files[:1]:
         print(f"מוריד סניפים: {fname}")
-        xml = try_download(session, fname)
+        with metrics.stage('download', CHAIN_NAME) as s:
+            xml = try_download(session, fname)
+            s.add(bytes=len(xml or ''))
         if xml:
-            count = parse_stores_xml(xml, chain_id, conn)
+            with metrics.stage('stores', CHAIN_NAME) as s:
+                count = parse_stores_xml(xml, chain_id, conn)
+                s.add(rows=count, bytes=len(xml))
             print(f"✓ {count} סניפים")
     
     # מחירים
@@ -182,9 +220,15 @@ def main():
     success = 0
     
     for i, fname in enumerate(price_files):
-        xml = try_download(session, fname)
+        with metrics.stage('download', CHAIN_NAME) as s:
+            xml = try_download(session, fname)
+            s.add(bytes=len(xml or ''))
         if xml:
-            count = parse_prices_xml(xml, chain_id, conn)
+            # Super-Pharm ships one price file per store, so each file gets its own profile
+            with profiled('prices', fname) as prof, metrics.stage('prices', CHAIN_NAME) as s:
+                count = parse_prices_xml(xml, chain_id, conn, cache)
+                s.add(rows=count, bytes=len(xml))
+            if prof: s.profiles.append(prof)
             total += count
             success += 1
             print(f"  [{i+1}] {fname}: {count} מחירים ✓")
@@ -193,6 +237,8 @@ def main():
         time.sleep(0.3)
     
     print(f"\n✅ {success} קבצים, {total} מחירים עודכנו")
+    cache.save()
+    metrics.finish(conn, ok=success > 0)
     conn.close()
 
 if __name__ == "__main__":
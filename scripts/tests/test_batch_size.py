@@ -0,0 +1,52 @@
+import pytest
+
+from batch_size import BatchSizer
+
+@pytest.fixture(autouse=True)
+def adapt(monkeypatch):
+    monkeypatch.delenv('BATCH_ADAPT', raising=False)
+
+def test_grows_at_most_twofold_toward_target():
+    s = BatchSizer('t', start=1000, target=2.0)
+    s.observe(1000, 0.1)            # 10000 rows would take 2s
+    assert s.size == 2000
+    s.observe(2000, 0.2)
+    assert s.size == 4000
+
+def test_shrinks_at_most_by_half():
+    s = BatchSizer('t', start=1000, target=2.0)
+    s.observe(1000, 100.0)
+    assert s.size == 500
+
+def test_settles_on_the_target():
+    s = BatchSizer('t', start=100, hi=10**6, target=1.0)
+    for _ in range(30):
+        s.observe(s.size, s.size * 0.001)   # 1ms per row -> 1000 rows per second
+    assert s.size == pytest.approx(1000, rel=0.01)
+
+def test_stays_within_bounds():
+    s = BatchSizer('t', start=100, lo=50, hi=300, target=2.0)
+    for _ in range(5): s.observe(s.size, 0.0001)
+    assert s.size == 300
+    for _ in range(10): s.observe(s.size, 1000.0)
+    assert s.size == 50
+
+def test_statement_size_caps_the_batch():
+    s = BatchSizer('t', start=1000, hi=10**6, target=100.0, max_bytes=1_000_000)
+    s.observe(1000, 0.001, nbytes=1000 * 500)   # fast, but 500 bytes per row
+    assert s.size == 2000
+    s.observe(2000, 0.002, nbytes=2000 * 5000)  # now 5000 bytes/row smoothed in
+    assert s.size * s.bytes_per_row <= 1_000_000
+
+def test_adapt_off_keeps_the_start_size(monkeypatch):
+    monkeypatch.setenv('BATCH_ADAPT', '0')
+    s = BatchSizer('t', start=1000)
+    s.observe(1000, 0.001); s.observe(1000, 100.0)
+    assert s.size == 1000 and len(s.sizes) == 2
+
+def test_timed_records_a_batch():
+    s = BatchSizer('t', start=10)
+    with s.timed(10) as t:
+        t.bytes = 1234
+    assert s.sizes == [10] and s.bytes_per_row == pytest.approx(123.4)
+    assert s.summary().startswith('t: 1 batches')
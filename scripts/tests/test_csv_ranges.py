@@ -0,0 +1,65 @@
+import csv
+from multiprocessing.pool import ThreadPool
+
+import pytest
+
+from csv_ranges import RangeReader, iter_ranges, parse_parallel, read_header
+
+def write_csv(path, rows, newline='\n'):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        csv.writer(f, lineterminator=newline).writerows(rows)
+    return path
+
+def sequential(path):
+    with open(path, encoding='utf-8', newline='') as f:
+        return [row for row in csv.reader(f)][1:]
+
+def rows_task(job):
+    reader = RangeReader(*job)
+    return [row for row in reader.rows()], reader.stop
+
+@pytest.fixture
+def price_file(tmp_path):
+    rows = [['storeid', 'itemcode', 'itemname', 'itemprice']]
+    for i in range(400):
+        name = f'מוצר {i}'
+        # Quoted fields with embedded newlines and commas land on some cut points
+        if i % 7 == 0: name += '\nשורה שנייה'
+        if i % 11 == 0: name += ', "במבצע"'
+        rows.append([str(i // 50) if i % 50 == 0 else '', f'7290000{i:06d}', name, f'{i % 90 + 0.9:.2f}'])
+    return write_csv(tmp_path / 'price_full_file_x.csv', rows)
+
+@pytest.mark.parametrize('chunk_bytes', [64, 333, 4096, 1 << 20])
+def test_parallel_parse_matches_sequential(price_file, chunk_bytes):
+    with ThreadPool(3) as pool:
+        parsed = [row for rows in parse_parallel(pool, 3, rows_task, price_file, chunk_bytes=chunk_bytes) for row in rows]
+    assert parsed == sequential(price_file)
+
+def test_crlf_and_blank_lines(tmp_path):
+    path = write_csv(tmp_path / 'f.csv', [['a', 'b'], ['1', 'x\r\ny'], [], ['2', 'z']], newline='\r\n')
+    with ThreadPool(2) as pool:
+        parsed = [row for rows in parse_parallel(pool, 2, rows_task, path, chunk_bytes=4) for row in rows]
+    assert parsed == [['1', 'x\ny'], ['2', 'z']]
+
+def test_ranges_cover_the_file_on_line_ends(price_file):
+    _, start = read_header(price_file)
+    data = price_file.read_bytes()
+    ranges = list(iter_ranges(price_file, start, 500))
+    assert ranges[0][0] == start and ranges[-1][1] == len(data)
+    assert all(a[1] == b[0] for a, b in zip(ranges, ranges[1:]))
+    assert all(data[end - 1:end] == b'\n' for _, end in ranges)
+
+def test_range_reader_rows_match_csv_reader(price_file):
+    fieldnames, start = read_header(price_file)
+    reader = RangeReader(price_file, start, price_file.stat().st_size, fieldnames)
+    with open(price_file, encoding='utf-8', newline='') as f:
+        assert list(reader.rows()) == list(csv.reader(f))[1:]
+    assert reader.stop == price_file.stat().st_size
+
+def test_range_reader_reports_overrun(tmp_path):
+    path = write_csv(tmp_path / 'f.csv', [['a'], ['one\ntwo'], ['three']])
+    fieldnames, start = read_header(path)
+    # Ending inside the quoted field: the record is read whole and stop moves past the planned end
+    reader = RangeReader(path, start, start + 3, fieldnames)
+    assert [row for row in reader.rows()] == [['one\ntwo']]
+    assert reader.stop > start + 3
@@ -0,0 +1,63 @@
+import time
+
+import pytest
+
+from pipeline import Prefetch, bottleneck
+
+def failing(n):
+    for i in range(n): yield i
+    raise ValueError('bad row')
+
+@pytest.mark.parametrize('depth', [0, 1, 3])
+def test_yields_everything_in_order(depth):
+    assert list(Prefetch(iter(range(100)), depth)) == list(range(100))
+
+@pytest.mark.parametrize('depth', [0, 2])
+def test_producer_error_reaches_consumer_after_earlier_items(depth):
+    got = []
+    with pytest.raises(ValueError, match='bad row'):
+        for item in Prefetch(failing(5), depth): got.append(item)
+    assert got == [0, 1, 2, 3, 4]
+
+def test_consumer_error_stops_the_producer():
+    produced = []
+    def source():
+        for i in range(10_000):
+            produced.append(i); yield i
+    chunks = Prefetch(source(), depth=2)
+    with pytest.raises(RuntimeError):
+        for item in chunks:
+            if item == 3: raise RuntimeError('write failed')
+    # The thread was joined and read at most a queue's worth past the failure
+    assert not chunks._thread.is_alive()
+    assert len(produced) < 10
+
+def test_abandoned_iteration_does_not_hang():
+    chunks = Prefetch(iter(range(1000)), depth=1)
+    it = iter(chunks)
+    next(it)
+    it.close()
+    assert not chunks._thread.is_alive()
+
+def test_queue_bounds_how_far_the_producer_runs_ahead():
+    produced = []
+    def source():
+        for i in range(50):
+            produced.append(i); yield i
+    it = iter(Prefetch(source(), depth=2))
+    next(it)
+    time.sleep(0.2)
+    # One item taken, two queued, one held by the blocked put
+    assert len(produced) <= 4
+    it.close()
+
+def test_timings_split_the_time():
+    def slow():
+        for i in range(3):
+            time.sleep(0.05); yield i
+    chunks = Prefetch(slow(), depth=2)
+    for _ in chunks: pass
+    t = chunks.timings('parse', 'write')
+    assert t['parse_busy'] >= 0.14
+    assert t['write_idle'] > t['write_busy']
+    assert bottleneck(t, 'parse', 'write') == 'CPU-bound'
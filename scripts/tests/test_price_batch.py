@@ -0,0 +1,36 @@
+import pytest
+
+from price_batch import PriceBatch, agorot
+
+def test_repeat_within_store_run_overwrites():
+    b = PriceBatch()
+    b.add('111', 'milk', 1, 500)
+    b.add('222', 'bread', 1, 800)
+    b.add('111', 'milk 3%', 1, 550)
+    assert len(b) == 2
+    assert list(b.price) == [550, 800]
+    assert b.names_by_barcode() == {'111': 'milk 3%', '222': 'bread'}
+
+def test_new_store_run_starts_new_rows():
+    b = PriceBatch()
+    b.add('111', 'milk', 1, 500)
+    b.add('111', 'milk', 2, 520)
+    b.add('111', 'milk', 1, 510)
+    assert len(b) == 3 and b.stores == {1, 2}
+    assert list(b.store) == [1, 2, 1] and list(b.code) == [0, 0, 0]
+    assert b.barcodes == ['111']
+
+def test_copy_lines():
+    b = PriceBatch()
+    b.add('111', 'milk', 7, 1290)
+    b.add('222', 'gum', 7, 5)
+    b.add('333', 'tv', 8, 199900)
+    assert list(b.copy_lines({'111': 10, '222': 20, '333': 30})) == [
+        "10\t7\t12.90\n", "20\t7\t0.05\n", "30\t8\t1999.00\n"]
+
+@pytest.mark.parametrize('raw, expected', [
+    ('12.90', 1290), ('12.9', 1290), ('0.1', 10), (' 3 ', 300), ('7', 700),
+    ('', None), ('abc', None), ('nan', None), ('inf', None), ('1e400', None),
+])
+def test_agorot(raw, expected):
+    assert agorot(raw) == expected
@@ -0,0 +1,36 @@
+import csv, functools
+from multiprocessing.pool import ThreadPool
+
+import pytest
+
+from csv_ranges import parse_parallel
+
+pytest.importorskip('psycopg2')
+
+@pytest.fixture
+def update_prices(monkeypatch):
+    # The module refuses to load without a DATABASE_URL; nothing here connects
+    monkeypatch.setenv('DATABASE_URL', 'postgresql://unused')
+    import update_prices
+    return update_prices
+
+def test_range_split_parse_matches_sequential(tmp_path, update_prices, monkeypatch):
+    path = tmp_path / 'price_full_file_x.csv'
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        w = csv.writer(f)
+        w.writerow(['storeid', 'itemcode', 'itemname', 'itemprice'])
+        for i in range(600):
+            # storeid only on the first row of each store, as the chains publish it
+            sid = f'{i // 40:03d}' if i % 40 == 0 else ''
+            name = f'item {i}\nsecond line' if i % 9 == 0 else f'item {i}'
+            w.writerow([sid, '12' if i % 13 == 0 else f'7290000{i:06d}', name, f'{i % 50 + 1}.90'])
+    store_map = {str(s): 100 + s for s in range(0, 15, 2)}   # odd stores are unknown
+    seq_stats, par_stats = {'store': 0, 'barcode': 0}, {'store': 0, 'barcode': 0}
+    sequential = list(update_prices.iter_price_rows(update_prices.iter_price_records(path), store_map, seq_stats))
+    # Small ranges, so many of them start inside a store's rows or a quoted field
+    monkeypatch.setattr(update_prices, 'parse_parallel', functools.partial(parse_parallel, chunk_bytes=512))
+    with ThreadPool(3) as pool:
+        parallel = list(update_prices.iter_price_rows_parallel(pool, 3, path, store_map, par_stats))
+    assert sequential and seq_stats['store'] and seq_stats['barcode']
+    assert parallel == sequential
+    assert par_stats == seq_stats
@@ -0,0 +1,58 @@
+from product_cache import ProductCache, barcode_key
+
+class ProductTable:
+    """Just enough of a cursor over product(id, barcode) for ProductCache.refresh."""
+    def __init__(self, rows):
+        self.rows = dict(rows)  # id -> barcode
+
+    def execute(self, sql, args=()):
+        if sql.startswith("SELECT COUNT(*)"):
+            self.result = [(len(self.rows), max(self.rows, default=0))]
+        elif "id > %s" in sql:
+            self.result = [(i, bc) for i, bc in self.rows.items() if i > args[0]]
+        else:
+            self.result = list(self.rows.items())
+
+    def fetchone(self): return self.result[0]
+    def fetchall(self): return self.result
+
+def test_barcode_key_keeps_leading_zeros():
+    assert barcode_key('00123') != barcode_key('123')
+    assert barcode_key('7290000000001') is not None
+    for bc in ('12a', '', '1' * 18, '١٢٣'):
+        assert barcode_key(bc) is None
+
+def test_lookup_across_arrays_recent_and_extra():
+    c = ProductCache()
+    c.add('7290001', 1); c.add('0042', 2); c.add('ABC-1', 3)
+    c.compact()
+    c.add('7290002', 4)
+    assert c.resolve(['7290001', '0042', '42', 'ABC-1', '7290002', 'nope']) == {
+        '7290001': 1, '0042': 2, 'ABC-1': 3, '7290002': 4}
+    assert len(c) == 4 and c.max_id == 4
+
+def test_save_load_round_trip_and_top_up(tmp_path):
+    path = tmp_path / 'index.bin'
+    table = ProductTable({1: '7290001', 2: '0042', 3: 'ABC-1'})
+    ProductCache.load(table, path=path).save(path)
+    table.rows[4] = 'XYZ'; table.rows[5] = '7290005'
+    c = ProductCache.load(table, path=path)
+    assert c.resolve(table.rows.values()) == {bc: i for i, bc in table.rows.items()}
+
+def test_rebuilds_when_rows_were_deleted(tmp_path):
+    path = tmp_path / 'index.bin'
+    ProductCache.load(ProductTable({1: '111', 2: '222', 3: '333'}), path=path).save(path)
+    c = ProductCache.load(ProductTable({1: '111', 3: '333'}), path=path)
+    assert c.get('222') is None and c.get('333') == 3 and len(c) == 2
+
+def test_new_id_for_known_barcode_wins():
+    c = ProductCache.load(ProductTable({1: '111', 2: '222'}), path=None)
+    table = ProductTable({1: '111', 3: '222'})
+    c.refresh(table)
+    assert c.get('222') == 3
+
+def test_corrupt_file_is_ignored(tmp_path):
+    path = tmp_path / 'index.bin'
+    path.write_bytes(b'garbage')
+    c = ProductCache.load(ProductTable({1: '111'}), path=path)
+    assert c.get('111') == 1
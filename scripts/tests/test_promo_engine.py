@@ -0,0 +1,91 @@
+import pytest
+
+pytest.importorskip('psycopg2')
+
+import promo_engine
+from kaggle_cache import LocalFile
+from run_metrics import RunMetrics
+
+class Cursor:
+    """Records statements; the chain lookup finds nothing, like a chain missing from the DB."""
+    def __init__(self): self.sql = []
+    def execute(self, sql, args=None): self.sql.append(sql); self.rowcount = 0
+    def fetchone(self): return None
+    def fetchall(self): return []
+
+class Conn:
+    def __init__(self): self.cur, self.commits = Cursor(), 0
+    def cursor(self): return self.cur
+    def commit(self): self.commits += 1
+    def rollback(self): pass
+
+class Checkpoint:
+    done = False
+    def finish(self, cur, rows): self.finished = rows
+
+class Ledger:
+    resuming = False
+    def __init__(self): self.opened = []
+    def open(self, key, **kw): self.opened.append(key); return Checkpoint()
+
+def clears(conn):
+    return [sql for sql in conn.cur.sql if 'SET is_promo = false' in sql and 'NOT IN' in sql]
+
+def test_no_promo_files_keeps_flags():
+    conn = Conn()
+    totals, complete = promo_engine.refresh(conn, [], RunMetrics('test'), Ledger())
+    assert complete and totals == {'promotions': 0, 'items': 0, 'flags': 0}
+    assert clears(conn) == []
+
+def test_no_chain_refreshed_keeps_flags(tmp_path):
+    path = tmp_path / 'promo_full_file_shufersal.csv'
+    path.write_text('storeid,promotionid,promotionitems\n' + '001,1,x\n' * 200)
+    conn, ledger = Conn(), Ledger()
+    totals, complete = promo_engine.refresh(conn, [LocalFile(path)], RunMetrics('test'), ledger)
+    assert ledger.opened == ['promos:Shufersal']
+    assert complete and clears(conn) == []
+
+def test_chain_map_covers_update_promos_keys():
+    for key, chain in [('super_pharm', 'Super Pharm'), ('carrefour', 'Carrefour'), ('yayno_bitan', 'Yayno Bitan'),
+                       ('rami-levy', 'Rami Levy'), ('fresh_market', 'Freshmarket')]:
+        assert promo_engine.CHAIN_MAP[key] == chain
+
+def test_short_item_codes_are_dropped():
+    assert promo_engine.ItemCode().items({'itemcode': '123456'}) == ()
+    assert promo_engine.ItemCode().items({'itemcode': ' 1234567 '}) == ('1234567',)
+    raw = "{'item': [{'itemcode': '12345'}, {'itemcode': '7290001'}]}"
+    assert promo_engine.ItemsJson().items({'promotionitems': raw}) == ('7290001',)
+
+def test_flags_keep_the_shorter_cutoff():
+    row = {'itemcode': '12345', 'promoprice': '9.90'}
+    assert promo_engine.ItemCode().flags(row) == (('12345', 9.9),)
+    assert promo_engine.ItemCode().flags({'itemcode': '1234', 'promoprice': '9.90'}) == ()
+    assert promo_engine.ItemCode().flags({'itemcode': '1234567', 'promoprice': '0'}) == ()
+    assert promo_engine.ItemsJson().flags(row) == ()
+
+def test_write_promo_batch_reports_bytes_sent(monkeypatch):
+    def execute_values(cur, sql, rows, **kw):
+        cur.query = b'x' * 1000
+        return [(i, key[0], key[1]) for i, key in enumerate(rows)]
+    monkeypatch.setattr(promo_engine, 'execute_values', execute_values)
+    class LinkCursor:
+        rowcount = 2
+        def execute(self, sql, args): self.query = b'y' * 300
+    promos = {(1, '5'): (1, '5'), (1, '6'): (1, '6')}
+    items = [((1, '5'), ('7290001',)), ((1, '6'), ('7290002',))]
+    assert promo_engine.write_promo_batch(LinkCursor(), promos, items) == (2, 2, 1300)
+    assert promo_engine.write_promo_batch(LinkCursor(), promos, []) == (2, 0, 1000)
+
+def test_chain_layout_links_each_chain_promotion_once(monkeypatch):
+    monkeypatch.setattr(promo_engine, 'execute_values',
+                        lambda cur, sql, rows, **kw: [(i, key[0], key[1]) for i, key in enumerate(rows)])
+    class LinkCursor:
+        query = b''
+        def execute(self, sql, args):
+            self.sql, self.args, self.rowcount = sql, args, len(args[1])
+    cur, codes = LinkCursor(), ('7290001', '7290002')
+    # Two stores carry promotion 5 with the same item list
+    promos = {(1, '5'): (1, '5'), (2, '5'): (2, '5')}
+    assert promo_engine.write_promo_batch(cur, promos, [((1, '5'), codes), ((2, '5'), codes)], link_chain=9)[:2] == (2, 2)
+    assert 'chain_promotion_item' in cur.sql and cur.args[0] == 9
+    assert sorted(zip(cur.args[1], cur.args[2])) == [('5', '7290001'), ('5', '7290002')]
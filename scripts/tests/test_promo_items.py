@@ -0,0 +1,77 @@
+import csv
+import json
+
+import pytest
+
+import promo_items
+from promo_items import ParseCache, decode_groups, decode_items, itemcodes
+
+ITEMS = {
+    'repr list': "{'item': [{'itemcode': '7290001', 'isgiftitem': '0'}, {'itemcode': '7290002'}]}",
+    'single dict': "{'promotionitem': {'itemcode': '7290003'}}",
+    'json, mixed key case': json.dumps({'item': [{'ItemCode': '7290004'}, {'itemcode': '7290005'}]}),
+    'numeric code': "{'item': [{'itemcode': 7290006}]}",
+    'padded code': "{'item': [{'itemcode': ' 7290007 '}]}",
+    'placeholders': "{'item': [{'itemcode': 'NO_BODY'}, {'itemcode': ''}, {'itemcode': '7290008'}]}",
+    'quotes in other fields': "{'item': [{'itemname': \"Ben & Jerry's\", 'itemcode': '7290009', 'note': 'a: \"b\"'}]}",
+    'hebrew': "{'item': [{'itemname': 'חלב 3%', 'itemcode': '7290010'}]}",
+    'empty': '',
+    'blank': '   ',
+    'not a dict': 'NO_BODY',
+}
+
+GROUPS = {
+    'nested repr': str({'group': [{'promotionitems': str({'promotionitem': [{'itemcode': '7290011'},
+                                                                              {'itemcode': '7290012'}]})}]}),
+    'nested repr with quotes': str({'group': [{'promotionitems': str({'promotionitem': [
+        {'itemname': "it's", 'itemcode': '7290013'}]})}]}),
+    'plain dicts': str({'group': {'promotionitems': {'promotionitem': {'itemcode': '7290014'}}}}),
+    'several groups': str({'group': [{'promotionitems': {'promotionitem': [{'itemcode': '7290015'}]}},
+                                     {'promotionitems': str({'promotionitem': {'itemcode': '7290016'}})}]}),
+    'empty': '',
+}
+
+@pytest.mark.parametrize('raw', ITEMS.values(), ids=ITEMS.keys())
+def test_scan_matches_decode_for_items(raw):
+    assert itemcodes(raw) == decode_items(raw)
+
+@pytest.mark.parametrize('raw', GROUPS.values(), ids=GROUPS.keys())
+def test_scan_matches_decode_for_groups(raw):
+    assert itemcodes(raw) == decode_groups(raw)
+
+def test_scan_keeps_order_and_duplicates():
+    raw = "{'item': [{'itemcode': '3'}, {'itemcode': '1'}, {'itemcode': '3'}]}"
+    assert itemcodes(raw) == ['3', '1', '3']
+
+def test_verify_mode_returns_decoded_and_counts_mismatches(monkeypatch, capsys):
+    monkeypatch.setattr(promo_items, 'VERIFY', True)
+    monkeypatch.setattr(promo_items, 'stats', dict.fromkeys(promo_items.stats, 0))
+    decoded = promo_items.extract(ITEMS['repr list'], lambda raw: ['other'])
+    assert decoded == ['other']
+    assert promo_items.stats['checked'] == 1 and promo_items.stats['mismatched'] == 1
+    assert '1/1 cells differ' in promo_items.report()
+    assert 'mismatch' in capsys.readouterr().err
+
+def test_verify_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(promo_items, 'stats', dict.fromkeys(promo_items.stats, 0))
+    path = tmp_path / 'promo_full_file_x.csv'
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        w = csv.writer(f)
+        w.writerow(['promotionid', 'promotionitems'])
+        for i, raw in enumerate(ITEMS.values()): w.writerow([i, raw])
+    cells, bad = promo_items.verify_file(path)
+    assert bad == 0 and cells == sum(1 for raw in ITEMS.values() if raw.strip())
+
+def test_parse_cache_shares_repeats():
+    calls = []
+    cache = ParseCache(lambda raw: calls.append(raw) or itemcodes(raw))
+    a, b = cache(ITEMS['repr list']), cache(ITEMS['repr list'][:])
+    assert a is b and a == ['7290001', '7290002']
+    assert cache(ITEMS['single dict']) == ['7290003']
+    assert len(calls) == 2 and cache.hits == 1
+    assert cache.summary().startswith('2 distinct item lists, 1 repeats')
+
+def test_parse_cache_passes_empty_through():
+    cache = ParseCache(itemcodes)
+    assert cache('') == [] and cache(None) == []
+    assert cache.lists == {} and cache.hits == 0
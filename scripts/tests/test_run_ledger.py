@@ -0,0 +1,13 @@
+import zipfile
+
+from kaggle_cache import Dataset
+from run_ledger import file_hash
+
+def test_file_hash_matches_archive_member_hash(tmp_path):
+    path = tmp_path / 'price_full_file_x.csv'
+    path.write_text('storeid,itemcode\n001,7290001\n')
+    archive = tmp_path / 'v1.zip'
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zf: zf.write(path, path.name)
+    member, = Dataset(archive, 'v1').members('price_full_file')
+    assert file_hash(path) == member.content_hash
+    assert file_hash(path).startswith('sha256:')
@@ -3,8 +3,8 @@
 update_categories.py - Classify products by Hebrew name keywords.
 """
 import os, logging, sys
-import psycopg2
 from psycopg2.extras import execute_values
+from run_metrics import RunMetrics
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s", handlers=[logging.StreamHandler(sys.stdout)])
 log = logging.getLogger(__name__)
@@ -233,7 +233,8 @@ def main():
     db_url = os.environ.get("DATABASE_URL")
     if not db_url: raise ValueError("DATABASE_URL not set")
 
-    conn = psycopg2.connect(db_url)
+    metrics = RunMetrics("update_categories")
+    conn = metrics.connect(db_url)
     conn.autocommit = False
     cur = conn.cursor()
 
@@ -254,18 +255,23 @@ def main():
     updates = []
     no_match = 0
 
-    for pid, name in products:
-        category, subcategory = classify(name)
-        if category:
-            updates.append((category, subcategory, pid))
-        else:
-            no_match += 1
+    with metrics.stage("classify") as s:
+        for pid, name in products:
+            category, subcategory = classify(name)
+            if category:
+                updates.append((category, subcategory, pid))
+            else:
+                no_match += 1
+        s.add(rows=len(products))
 
     if updates:
-        execute_values(cur, "UPDATE product SET category=data.cat, subcategory=data.sub FROM (VALUES %s) AS data(cat, sub, id) WHERE product.id=data.id", updates)
-        conn.commit()
+        with metrics.stage("update") as s:
+            execute_values(cur, "UPDATE product SET category=data.cat, subcategory=data.sub FROM (VALUES %s) AS data(cat, sub, id) WHERE product.id=data.id", updates)
+            conn.commit()
+            s.add(rows=len(updates))
 
     log.info("Done - %d/%d classified, %d no match", len(updates), len(products), no_match)
+    metrics.finish(conn)
     conn.close()
 
 if __name__ == "__main__":
@@ -8,7 +8,7 @@ Never saves irrelevant images.
 """
 import os, time, json, logging, sys
 import urllib.request, urllib.parse
-import psycopg2
+from run_metrics import RunMetrics
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s", handlers=[logging.StreamHandler(sys.stdout)])
 log = logging.getLogger(__name__)
@@ -89,7 +89,8 @@ def main():
     db_url = os.environ.get("DATABASE_URL")
     if not db_url: raise ValueError("DATABASE_URL not set")
 
-    conn = psycopg2.connect(db_url)
+    metrics = RunMetrics("update_images")
+    conn = metrics.connect(db_url)
     conn.autocommit = False
     cur = conn.cursor()
 
@@ -113,13 +114,17 @@ def main():
         img = None
 
         # שלב 1 — Open Food Facts
-        img = fetch_from_off(barcode)
+        with metrics.stage("off") as s:
+            img = fetch_from_off(barcode)
+            s.add(rows=1 if img else 0)
         if img:
             off_count += 1
         else:
             # שלב 2 — SerpAPI ברקוד בלבד
             time.sleep(DELAY)
-            img = fetch_from_serp(barcode)
+            with metrics.stage("serp") as s:
+                img = fetch_from_serp(barcode)
+                s.add(rows=1 if img else 0)
             if img:
                 serp_count += 1
             else:
@@ -135,6 +140,7 @@ def main():
 
     conn.commit()
     log.info(f"\n🎉 Done — {updated}/{len(products)} updated (OFF:{off_count} SERP:{serp_count} not_found:{not_found})")
+    metrics.finish(conn)
     conn.close()
 
 if __name__ == "__main__":
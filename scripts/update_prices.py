@@ -1,16 +1,33 @@
 #!/usr/bin/env python3
 """Daily price update from Kaggle - v5 fixed column names."""
-import os, sys, csv, psycopg2, time, glob
-def process_promos_batch(cur, conn, filepath, chain_name):
-    csv.field_size_limit(100 * 1024 * 1024)
-    cur.execute("SELECT id FROM retailer_chain WHERE name=%s", (chain_name,))
-from pathlib import Path
+import os, sys, csv, time, io, argparse, itertools
+from contextlib import nullcontext
+from multiprocessing import Pool
+from product_cache import ProductCache
+from run_ledger import RunLedger
+from kaggle_cache import open_dataset
+from price_partitions import ShadowLoad, is_partitioned
+from price_history import ensure_history, history_ctes
+from chain_prices import ChainLoad, is_chain_layout
+import run_metrics
+from run_metrics import RunMetrics, profiled
+from csv_ranges import RangeReader, parse_parallel, seekable
+from pipeline import Prefetch, bottleneck
+from batch_size import BatchSizer
+from price_batch import PriceBatch, agorot
+import promo_engine
 
 DB_URL = os.environ.get('DATABASE_URL')
 if not DB_URL:
     print("ERROR: DATABASE_URL not set"); sys.exit(1)
 
 KAGGLE_DATASET = "erlichsefi/israeli-supermarkets-2024"
+# Seconds the price stage may run; files predicted to overrun it are left for the next night
+TIME_BUDGET = int(os.environ.get('PRICE_TIME_BUDGET', '7200'))
+# Rows of the first COPY + merge round; later rounds are sized by a BatchSizer. Bounds memory regardless of file size
+CHUNK_ROWS = 50000
+# Files at least this big are parsed across --parse-workers processes
+SPLIT_BYTES = int(os.environ.get('PRICE_SPLIT_MB', '100')) * 1024 * 1024
 
 CHAIN_MAP = {
     'shufersal': 'Shufersal', 'rami_levy': 'Rami Levy', 'yohananof': 'Yochananof',
@@ -28,246 +45,557 @@ CHAIN_MAP = {
     'yellow': None, 'cofix': None,
 }
 
-def get_row_fields(row):
-    """Extract barcode, name, price, storeid handling different column names."""
-    barcode = row.get('itemcode', '').strip()
-    name = row.get('itemname', '') or row.get('itemnm', '') or row.get('manufactureritemdescription', '') or ''
-    name = name.strip()
-    price_str = row.get('itemprice', '').strip()
-    storeid = row.get('storeid', '').strip()
-    return storeid, barcode, name, price_str
+def row_fields(fieldnames):
+    """A function taking a csv.reader row to (storeid, barcode, name, price), by column position.
+
+    Chains name the item-name column differently; the first non-empty one wins.
+    Missing columns read as ''.
+    """
+    col = {name: i for i, name in enumerate(fieldnames)}
+    missing = len(fieldnames)
+    sid_i, bc_i, price_i = (col.get(c, missing) for c in ('storeid', 'itemcode', 'itemprice'))
+    name_ix = [col.get(c, missing) for c in ('itemname', 'itemnm', 'manufactureritemdescription')]
+    need = max(sid_i, bc_i, price_i, *name_ix) + 1
+    def fields(row):
+        if len(row) < need: row = row + [''] * (need - len(row))
+        name = ''
+        for i in name_ix:
+            if row[i]: name = row[i]; break
+        return row[sid_i].strip(), row[bc_i].strip(), name.strip(), row[price_i].strip()
+    return fields
 
-def process_prices_batch(cur, conn, filepath, chain_name):
+def process_prices_batch(cur, conn, filepath, chain_name, cache, checkpoint=None, parse_pool=None, parse_workers=1):
     cur.execute("SELECT id FROM retailer_chain WHERE name=%s", (chain_name,))
     row = cur.fetchone()
     if not row:
-        print(f"    Chain '{chain_name}' not in DB", flush=True); return 0
+        print(f"    Chain '{chain_name}' not in DB", flush=True); return None
     chain_id = row[0]
     cur.execute("SELECT id, store_code FROM store WHERE chain_id=%s", (chain_id,))
     store_map = {code: sid for sid, code in cur.fetchall()}
     if not store_map:
-        print(f"    No stores for '{chain_name}'", flush=True); return 0
+        print(f"    No stores for '{chain_name}'", flush=True); return None
 
-    rows = []
-    last_store = None
-    skipped_store = 0
-    skipped_barcode = 0
+    # Partitioned store_price loads a shadow partition and swaps it in at the end; the
+    # chain-level layout collects the whole chain and rebuilds it. Neither survives a
+    # crash mid-file, so those modes always start from the top.
+    if is_partitioned(cur): loader = ShadowLoad(cur, chain_id)
+    elif is_chain_layout(cur): loader = ChainLoad(cur, chain_id)
+    else: loader = None
+    conn.commit()
+    skip = checkpoint.offset if checkpoint and not loader else 0
+    if skip: print(f"    {chain_name}: resuming at record {skip}", flush=True)
+    stats = {'store': 0, 'barcode': 0}
+    # A resumed file is read from the top anyway, so it is not worth splitting
+    split = parse_pool is not None and filepath.size >= SPLIT_BYTES and not skip
+    if split: print(f"    {chain_name}: parsing on {parse_workers} processes", flush=True)
+    with seekable(filepath) if split else nullcontext() as path:
+        if split: rows = iter_price_rows_parallel(parse_pool, parse_workers, path, store_map, stats)
+        else: rows = iter_price_rows(iter_price_records(filepath), store_map, stats, skip)
+        counts = load_price_chunks(cur, conn, rows, chain_name, cache, loader, checkpoint, resumed=bool(skip))
+    if loader and counts['rows']:
+        ins, chg, rem, touched = loader.finish(conn)
+        counts['inserted'] += ins; counts['changed'] += chg; counts['removed'] += rem
+        counts['touched'].update(touched)
+    elif loader:
+        loader.drop(cur)
+    if checkpoint and not checkpoint.done: checkpoint.finish(cur, counts['rows'] if loader else 0)
+    conn.commit()
+    if stats['store'] > 0:
+        print(f"    Skipped {stats['store']} (unknown store), {stats['barcode']} (short barcode)", flush=True)
+    return counts
+
+def pipeline_depth():
+    """Chunks parsed ahead of the DB writer on a thread (--pipeline); 0 parses and writes in turn."""
+    return int(os.environ.get('PRICE_PIPELINE', '0'))
+
+def load_price_chunks(cur, conn, rows, chain_name, cache, loader, checkpoint, resumed=False):
+    """Stage and merge (or hand to the loader) the file's rows chunk by chunk. Returns the counts,
+    with the parse/write busy and idle seconds under 'timers'.
+
+    A store's rows may be spread over several chunks, so prices the file no
+    longer carries are only removed once the whole file is merged, and not
+    at all on a resumed run, which has not seen the records before the resume
+    point.
+    """
+    counts = {'rows': 0, 'inserted': 0, 'changed': 0, 'removed': 0, 'touched': set()}
+    stores, last = set(), 0
+    cur.execute("TRUNCATE seen_prices")
+    sizer = BatchSizer(f'{chain_name} prices', CHUNK_ROWS, lo=5000, hi=500000)
+    chunks = Prefetch(iter_batches(rows, sizer), pipeline_depth())
+    for chunk, next_offset in chunks:
+        with sizer.timed(len(chunk)) as t:
+            ids = cache.resolve_or_create(cur, chunk.names_by_barcode())
+            cur.execute("TRUNCATE tmp_prices")
+            stream = CopyStream(chunk.copy_lines(ids))
+            cur.copy_expert("COPY tmp_prices (product_id, store_id, price) FROM STDIN", stream)
+            t.bytes = stream.bytes
+            cur.execute("ANALYZE tmp_prices")
+            if loader:
+                ins, chg, touched = loader.stage(cur, chunk.stores)
+            else:
+                ins, chg, touched = merge_staged_prices(cur)
+                cur.execute("INSERT INTO seen_prices SELECT product_id, store_id FROM tmp_prices")
+                stores |= chunk.stores
+            # The last chunk's checkpoint is finished with the removals below
+            if checkpoint and not loader and next_offset is not None: checkpoint.save(cur, next_offset, len(chunk))
+            conn.commit()
+        last = len(chunk)
+        counts['rows'] += len(chunk); counts['inserted'] += ins; counts['changed'] += chg
+        counts['touched'].update(touched)
+        print(f"    {chain_name}: {counts['rows']} rows (next chunk {sizer.size})", flush=True)
+    counts['timers'] = chunks.timings('parse', 'write')
+    print(f"    {sizer.summary()}", flush=True)
+    if stores and not resumed:
+        counts['removed'], touched = remove_unseen_prices(cur, list(stores))
+        counts['touched'].update(touched)
+    elif stores:
+        print(f"    {chain_name}: resumed mid-file, removals wait for the next full load", flush=True)
+    if checkpoint and not loader and counts['rows']: checkpoint.finish(cur, last)
+    cur.execute("TRUNCATE tmp_prices, seen_prices")
+    conn.commit()
+    return counts
 
+def iter_price_records(filepath):
+    """Yield (recno, storeid, barcode, name, price) for every record of a price file."""
     csv.field_size_limit(100 * 1024 * 1024)
-    with open(filepath, encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            sid, barcode, name, price_str = get_row_fields(row)
-            if sid: last_store = sid
-            else: sid = last_store
-            if not sid or not barcode or not price_str or not name: continue
-            # Skip non-barcode itemcodes (internal numbers < 100)
-            if len(barcode) < 5:
-                skipped_barcode += 1
-                continue
-            store_id = store_map.get(sid)
-            if not store_id and sid.isdigit():
-                store_id = store_map.get(str(int(sid)))
-            if not store_id:
-                skipped_store += 1
-                continue
-            try: price = float(price_str)
-            except: continue
-            if price <= 0: continue
-            rows.append((barcode, name, store_id, price))
-
-    if skipped_store > 0:
-        print(f"    Skipped {skipped_store} (unknown store), {skipped_barcode} (short barcode)", flush=True)
-    if not rows: return 0
-    # Global dedup: keep last price per (barcode, store_id)
-    seen = {}
-    for r in rows:
-        seen[(r[0], r[2])] = r
-    rows = list(seen.values())
-
-    cur.execute("DELETE FROM tmp_prices")
-    BATCH = 10000
-    total = len(rows)
-    for i in range(0, total, BATCH):
-        batch = rows[i:i+BATCH]
-        args = ','.join(cur.mogrify("(%s,%s,%s,%s)", r).decode() for r in batch)
-        cur.execute(f"INSERT INTO tmp_prices (barcode, name, store_id, price) VALUES {args}")
-        cur.execute("""INSERT INTO product (barcode, name)
-            SELECT DISTINCT t.barcode, t.name FROM tmp_prices t
-            WHERE NOT EXISTS (SELECT 1 FROM product p WHERE p.barcode = t.barcode)
-            ON CONFLICT (barcode) DO NOTHING""")
-        cur.execute("""INSERT INTO store_price (product_id, store_id, price)
-            SELECT p.id, t.store_id, t.price FROM tmp_prices t JOIN product p ON p.barcode = t.barcode
-            ON CONFLICT (product_id, store_id) DO UPDATE SET price = EXCLUDED.price, updated_at = NOW()""")
-        cur.execute("DELETE FROM tmp_prices")
-        conn.commit()
-        processed = min(i + BATCH, total)
-        if processed % 50000 == 0 or processed == total:
-            print(f"    {processed}/{total}", flush=True)
-    return total
+    with filepath.open(encoding="utf-8") as f:
+        reader = csv.reader(f)
+        fields = row_fields(next(reader, []))
+        # Numbered like csv.DictReader rows (blank lines skipped), which checkpoints rely on
+        for recno, row in enumerate(row for row in reader if row):
+            yield (recno, *fields(row))
+
+def parse_price_range(job):
+    """Pool task: iter_price_rows over one byte range of a price file, with range-local record numbers.
+
+    Records before the range's first storeid depend on the previous range, so
+    they come back unresolved as `head`. last is (storeid, recno) of the
+    range's last storeid, or None.
+    """
+    *job, store_map = job
+    csv.field_size_limit(100 * 1024 * 1024)
+    reader, recnos, last = RangeReader(*job), itertools.count(), None
+    fields = row_fields(reader.fieldnames)
+    records = ((next(recnos), *fields(row)) for row in reader.rows())
+    head = []
+    for rec in records:
+        if rec[1]:
+            records = itertools.chain([rec], records); break
+        if rec[2] and rec[3] and rec[4]: head.append(rec)
+    def tracked(recs):
+        nonlocal last
+        for rec in recs:
+            if rec[1]: last = (rec[1], rec[0])
+            yield rec
+    stats = {'store': 0, 'barcode': 0}
+    rows = list(iter_price_rows(tracked(records), store_map, stats))
+    return (head, rows, stats, next(recnos), last), reader.stop
+
+def iter_price_rows_parallel(pool, workers, path, store_map, stats):
+    """iter_price_rows for a file whose byte ranges are parsed by the pool of `workers`. Same rows, same stats."""
+    base, carry = 0, (None, 0)
+    for head, rows, range_stats, n, last in parse_parallel(pool, workers, parse_price_range, path, args=(store_map,)):
+        # The head inherits the storeid in effect where the previous range ended
+        yield from iter_price_rows(((base + r[0],) + r[1:] for r in head), store_map, stats, carry=carry)
+        for r in rows:
+            yield r[:4] + (base + r[4],)
+        for k in stats: stats[k] += range_stats[k]
+        if last: carry = (last[0], base + last[1])
+        base += n
+
+def iter_price_rows(records, store_map, stats, skip=0, carry=(None, 0)):
+    """Yield (barcode, name, store_id, agorot, anchor) in file order, counting skipped rows into stats.
+
+    records are (recno, storeid, barcode, name, price) from iter_price_records.
+    anchor is the record number that set the row's storeid, i.e. the earliest
+    record a resumed run can restart from and still resolve the store. Records
+    before `skip` are not yielded. carry is the (storeid, anchor) in effect
+    before the first record.
+    """
+    last_store, anchor = carry
+    for recno, sid, barcode, name, price_str in records:
+        if sid: last_store, anchor = sid, recno
+        else: sid = last_store
+        if recno < skip: continue
+        if not sid or not barcode or not price_str or not name: continue
+        # Skip non-barcode itemcodes (internal numbers < 100)
+        if len(barcode) < 5:
+            stats['barcode'] += 1
+            continue
+        store_id = store_map.get(sid)
+        if not store_id and sid.isdigit():
+            store_id = store_map.get(str(int(sid)))
+        if not store_id:
+            stats['store'] += 1
+            continue
+        price = agorot(price_str)
+        if not price or price <= 0: continue
+        yield (barcode, name, store_id, price, anchor)
+
+def iter_batches(rows, sizer):
+    """Pack rows into (PriceBatch, next_offset) chunks of at least sizer.size rows, cut between store runs.
+
+    Files are grouped by store (the storeid carry-forward relies on it), and a
+    batch keeps the last price per barcode within a run. Each store appears at
+    most once per batch. next_offset is the anchor of the run that starts the
+    next batch, i.e. where a resumed run continues once this one is committed,
+    or None for the last batch.
+    """
+    batch, store_id = PriceBatch(), None
+    for barcode, name, sid, price, anchor in rows:
+        if sid != store_id:
+            if len(batch) and (sid in batch.stores or len(batch) >= sizer.size):
+                yield batch, anchor
+                batch = PriceBatch()
+            store_id = sid
+        batch.add(barcode, name, sid, price)
+    if len(batch): yield batch, None
+
+def create_staging(cur):
+    """Per-session staging table, so concurrent loaders never share one."""
+    cur.execute("CREATE TEMP TABLE IF NOT EXISTS tmp_prices (product_id INTEGER, store_id INTEGER, price NUMERIC)")
+    # (product, store) pairs of the file merged so far, for the removals once it is all in
+    cur.execute("CREATE TEMP TABLE IF NOT EXISTS seen_prices (product_id INTEGER, store_id INTEGER)")
+
+_worker = {}
+
+def init_worker():
+    """Pool initializer: each worker process holds its own connection and staging table."""
+    conn = run_metrics.connect(DB_URL, connect_timeout=30)
+    cur = conn.cursor()
+    create_staging(cur)
+    _worker['cache'] = ProductCache.load(cur)
+    conn.commit()
+    _worker['conn'], _worker['cur'] = conn, cur
+
+def price_job(job):
+    """Load one price file inside a worker. Returns (chain_name, counts, seconds, error); counts include round_trips."""
+    path, chain_name, checkpoint, run_start = job
+    if time.time() - run_start > TIME_BUDGET:
+        return chain_name, None, 0.0, f"skipped, past the {TIME_BUDGET}s budget"
+    conn, cur = _worker['conn'], _worker['cur']
+    t0, trips = time.time(), conn.round_trips
+    try:
+        with profiled('prices', chain_name) as prof:
+            counts = process_prices_batch(cur, conn, path, chain_name, _worker['cache'], checkpoint)
+    except Exception as e:
+        conn.rollback()
+        return chain_name, None, time.time() - t0, str(e)
+    if counts: counts.update(round_trips=conn.round_trips - trips, profile=prof)
+    return chain_name, counts, time.time() - t0, None
+
+def run_prices_serial(cur, conn, jobs, start, cache, metrics, parse_pool=None, parse_workers=1):
+    """Load price files smallest first on one connection. Returns (rows, touched product ids, completed)."""
+    total, touched = 0, set()
+    done_bytes, done_secs = 0, 0.0
+    for f, chain_name, fbytes, checkpoint in sorted(jobs, key=lambda j: j[2]):
+        # Predict this file's duration from the throughput measured so far
+        if done_secs > 0 and time.time() - start + fbytes / (done_bytes / done_secs) > TIME_BUDGET:
+            print(f"  WARNING: {chain_name} would exceed the {TIME_BUDGET}s budget, stopping", flush=True)
+            return total, touched, False
+        print(f"  {chain_name} ({fbytes / (1024*1024):.1f}MB)...", flush=True)
+        t0 = time.time()
+        # Profiling (if on) wraps the stage, so writing its reports is not timed as loading
+        with profiled('prices', chain_name) as prof, metrics.stage('prices', chain_name) as s:
+            counts = process_prices_batch(cur, conn, f, chain_name, cache, checkpoint, parse_pool, parse_workers)
+            s.add(rows=counts['rows'] if counts else 0, bytes=fbytes, timers=counts and counts['timers'])
+        if prof: s.profiles.append(prof)
+        elapsed = time.time() - t0
+        done_bytes += fbytes; done_secs += elapsed
+        if counts:
+            print(f"    -> {format_counts(counts, elapsed)}", flush=True)
+            total += counts['rows']; touched |= counts['touched']
+    return total, touched, True
+
+def run_prices_parallel(cur, conn, jobs, workers, start, cache, metrics, parse_pool=None, parse_workers=1):
+    """Spread price files over worker processes, largest first. Returns (rows, touched product ids, completed).
+
+    With a parse pool, files of SPLIT_BYTES or more are loaded by this process
+    instead (pool workers cannot start processes of their own), each parsed
+    across the parse pool, while the workers take the rest.
+    """
+    ordered = sorted(jobs, key=lambda j: -j[2])
+    big = [j for j in ordered if parse_pool is not None and j[2] >= SPLIT_BYTES]
+    ordered = [j for j in ordered if j not in big]
+    sizes = {c: b for _, c, b, _ in ordered}
+    print(f"  {len(ordered)} files on {workers} workers" + (f", {len(big)} split here" if big else ""), flush=True)
+    with Pool(workers, initializer=init_worker) as pool:
+        results = pool.imap_unordered(price_job, [(f, c, cp, start) for f, c, _, cp in ordered])
+        total, touched, complete = run_prices_serial(cur, conn, big, start, cache, metrics, parse_pool, parse_workers)
+        for chain_name, counts, elapsed, err in results:
+            metrics.record('prices', chain_name, elapsed, ok=not err, rows=counts['rows'] if counts else 0,
+                           bytes=sizes[chain_name], round_trips=counts['round_trips'] if counts else 0,
+                           profile=counts.get('profile') if counts else None, timers=counts and counts['timers'])
+            if err:
+                print(f"  {chain_name}: ERROR {err}", flush=True); complete = False; continue
+            if counts:
+                print(f"  {chain_name}: -> {format_counts(counts, elapsed)}", flush=True)
+                total += counts['rows']; touched |= counts['touched']
+    return total, touched, complete
+
+def format_counts(counts, elapsed):
+    """One-line per-chain summary: throughput plus how many rows actually changed."""
+    unchanged = counts['rows'] - counts['inserted'] - counts['changed']
+    return (f"{counts['rows']} prices in {elapsed:.1f}s ({counts['rows'] / max(elapsed, 1e-6):.0f} rows/s): "
+            f"+{counts['inserted']} new, {counts['changed']} changed, -{counts['removed']} removed, {unchanged} unchanged"
+            + (f"; {format_timers(counts['timers'])}" if counts.get('timers') else ""))
+
+def format_timers(t):
+    """Parse/write busy and waiting seconds, and which side held the other up."""
+    return (f"parse {t['parse_busy']:.1f}s busy/{t['parse_blocked']:.1f}s blocked, "
+            f"write {t['write_busy']:.1f}s busy/{t['write_idle']:.1f}s idle ({bottleneck(t, 'parse', 'write')})")
+
+class CopyStream(io.TextIOBase):
+    """Read-only file over an iterable of COPY text lines, pulled on demand."""
+    def __init__(self, lines):
+        self.lines = iter(lines)
+        self.buf = ''
+        self.count = self.bytes = 0
+    def readable(self): return True
+    def read(self, size=-1):
+        parts, n = [self.buf], len(self.buf)
+        while size is None or size < 0 or n < size:
+            line = next(self.lines, None)
+            if line is None: break
+            parts.append(line); n += len(line); self.count += 1; self.bytes += len(line)
+        data = ''.join(parts)
+        if size is None or size < 0 or n <= size:
+            self.buf = ''; return data
+        self.buf = data[size:]
+        return data[:size]
+
+def merge_staged_prices(cur):
+    """Apply tmp_prices to store_price as a diff, leaving unchanged prices untouched.
+
+    The same statement closes and opens the matching price_history intervals.
+    Returns (inserted, changed, ids of products whose prices moved).
+    """
+    cur.execute(f"""WITH t AS (SELECT product_id, store_id, price FROM tmp_prices),
+        ins AS (
+            INSERT INTO store_price (product_id, store_id, price)
+            SELECT t.product_id, t.store_id, t.price FROM t
+            WHERE NOT EXISTS (SELECT 1 FROM store_price sp WHERE sp.product_id = t.product_id AND sp.store_id = t.store_id)
+            ON CONFLICT (product_id, store_id) DO NOTHING
+            RETURNING product_id, store_id, price),
+        upd AS (
+            UPDATE store_price sp SET price = t.price, updated_at = NOW() FROM t
+            WHERE sp.product_id = t.product_id AND sp.store_id = t.store_id AND sp.price IS DISTINCT FROM t.price
+            RETURNING sp.product_id, sp.store_id, sp.price),
+        {history_ctes("SELECT * FROM ins UNION ALL SELECT * FROM upd", "SELECT product_id, store_id FROM upd")}
+        SELECT (SELECT COUNT(*) FROM ins), (SELECT COUNT(*) FROM upd),
+            ARRAY(SELECT product_id FROM ins UNION SELECT product_id FROM upd)""")
+    return cur.fetchone()
+
+def remove_unseen_prices(cur, stores):
+    """Delete prices of these stores that the file did not carry (not in seen_prices), closing their history.
+    Returns (removed, ids of those products)."""
+    cur.execute("ANALYZE seen_prices")
+    cur.execute(f"""WITH del AS (
+            DELETE FROM store_price sp WHERE sp.store_id = ANY(%s)
+            AND NOT EXISTS (SELECT 1 FROM seen_prices s WHERE s.product_id = sp.product_id AND s.store_id = sp.store_id)
+            RETURNING sp.product_id, sp.store_id),
+        {history_ctes("SELECT product_id, store_id, NULL::numeric AS price FROM del WHERE false", "SELECT * FROM del")}
+        SELECT (SELECT COUNT(*) FROM del), ARRAY(SELECT DISTINCT product_id FROM del)""", (stores,))
+    return cur.fetchone()
+
+def refresh_product_stats(cur, product_ids=None):
+    """Recompute product.min_price / store_count for product_ids, or for every product when None.
+
+    Products left without any price get store_count 0. Returns products updated.
+    """
+    if product_ids is None:
+        cur.execute("""UPDATE product p SET min_price=sub.min_price, store_count=sub.store_count
+            FROM (SELECT product_id, MIN(price) as min_price, COUNT(DISTINCT store_id) as store_count
+                  FROM store_price GROUP BY product_id) sub
+            WHERE p.id=sub.product_id
+            AND (p.min_price IS DISTINCT FROM sub.min_price OR p.store_count IS DISTINCT FROM sub.store_count)""")
+        n = cur.rowcount
+        cur.execute("""UPDATE product p SET min_price=NULL, store_count=0
+            WHERE p.store_count > 0 AND NOT EXISTS (SELECT 1 FROM store_price sp WHERE sp.product_id = p.id)""")
+        return n + cur.rowcount
+    if not product_ids: return 0
+    cur.execute("""UPDATE product p SET min_price=sub.min_price, store_count=sub.store_count
+        FROM (SELECT t.product_id, MIN(sp.price) as min_price, COUNT(DISTINCT sp.store_id) as store_count
+              FROM unnest(%s::int[]) AS t(product_id)
+              LEFT JOIN store_price sp ON sp.product_id = t.product_id
+              GROUP BY t.product_id) sub
+        WHERE p.id=sub.product_id
+        AND (p.min_price IS DISTINCT FROM sub.min_price OR p.store_count IS DISTINCT FROM sub.store_count)""",
+        (product_ids,))
+    return cur.rowcount
 
 def process_stores_file(cur, filepath, chain_name):
+    """Sync a chain's stores with its store file in one upsert. Returns (added, updated, moved).
+
+    source_address keeps the city/address the file last gave, so a store is only
+    rewritten (and flagged needs_geocode) when the source itself changes, not
+    when a fix-up script corrected the city by hand.
+    """
     cur.execute("SELECT id FROM retailer_chain WHERE name=%s", (chain_name,))
     row = cur.fetchone()
-    if not row: return 0
+    if not row: return 0, 0, 0
     chain_id = row[0]
-    cur.execute("SELECT store_code FROM store WHERE chain_id=%s", (chain_id,))
-    existing = {r[0] for r in cur.fetchall()}
-    added = 0
+    stores = {}
     csv.field_size_limit(100 * 1024 * 1024)
-    with open(filepath, encoding="utf-8") as f:
+    with filepath.open(encoding="utf-8") as f:
         for row in csv.DictReader(f):
             sid = row.get('storeid', '').strip()
             name = row.get('storename', '').strip()
-            if not sid or not name or sid in existing: continue
-            cur.execute("INSERT INTO store (chain_id, store_code, name, city, address) VALUES (%s,%s,%s,%s,%s)",
-                (chain_id, sid, name, row.get('city', '').strip(), row.get('address', '').strip()))
-            existing.add(sid); added += 1
-    return added
-
-def process_promos_batch(cur, conn, filepath, chain_name):
-    csv.field_size_limit(100 * 1024 * 1024)
-    """Process promo files and update is_promo/promo_price in store_price."""
-    cur.execute("SELECT id FROM retailer_chain WHERE name=%s", (chain_name,))
-    row = cur.fetchone()
-    if not row: return 0
-    chain_id = row[0]
-    cur.execute("SELECT id, store_code FROM store WHERE chain_id=%s", (chain_id,))
-    store_map = {code: sid for sid, code in cur.fetchall()}
-    if not store_map: return 0
-
-    rows = []
-    last_store = None
-    csv.field_size_limit(100 * 1024 * 1024)
-    with open(filepath, encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        print(f"    DEBUG headers: {reader.fieldnames}", flush=True)
-        for row in reader:
-            sid = row.get('storeid', '').strip()
-            if sid: last_store = sid
-            else: sid = last_store
-            barcode = row.get('itemcode', '').strip()
-            if not sid or not barcode or len(barcode) < 5: continue
-            store_id = store_map.get(sid) or (store_map.get(str(int(sid))) if sid.isdigit() else None)
-            if not store_id: continue
-            promo_price_str = row.get('promoprice', row.get('itemprice', '')).strip()
-            try: promo_price = float(promo_price_str)
-            except: continue
-            if promo_price <= 0: continue
-            rows.append((barcode, store_id, promo_price))
-
-    if not rows: return 0
-    # Dedup
-    seen = {}
-    for r in rows: seen[(r[0], r[1])] = r
-    rows = list(seen.values())
-
-    print(f"    {len(rows)} promo items...", end=' ', flush=True)
-    BATCH = 5000
-    updated = 0
-    for i in range(0, len(rows), BATCH):
-        batch = rows[i:i+BATCH]
-        values = ','.join(cur.mogrify("(%s,%s,%s)", r).decode() for r in batch)
-        cur.execute(f"""
-            UPDATE store_price sp SET is_promo = true, promo_price = t.promo_price
-            FROM (VALUES {values}) AS t(barcode, store_id, promo_price)
-            JOIN product p ON p.barcode = t.barcode
-            WHERE sp.product_id = p.id AND sp.store_id = t.store_id::int
-        """)
-        updated += cur.rowcount
-        conn.commit()
-    return updated
+            if not sid or not name: continue
+            stores[sid] = (name, row.get('city', '').strip(), row.get('address', '').strip())
+    if not stores: return 0, 0, 0
+    codes = list(stores)
+    cur.execute("""WITH v(store_code, name, city, address) AS (
+            SELECT * FROM unnest(%(codes)s::text[], %(names)s::text[], %(cities)s::text[], %(addrs)s::text[])),
+        m AS (
+            SELECT s.id, v.name, v.city, v.address, v.city || E'\t' || v.address AS src,
+                CASE WHEN s.source_address IS NULL THEN s.address IS DISTINCT FROM v.address
+                     ELSE s.source_address IS DISTINCT FROM v.city || E'\t' || v.address END AS moved
+            FROM v JOIN store s ON s.chain_id = %(chain)s AND s.store_code = v.store_code
+            WHERE s.name IS DISTINCT FROM v.name OR s.source_address IS DISTINCT FROM v.city || E'\t' || v.address),
+        upd AS (
+            UPDATE store s SET name = m.name, source_address = m.src,
+                city = CASE WHEN m.moved THEN m.city ELSE s.city END,
+                address = CASE WHEN m.moved THEN m.address ELSE s.address END,
+                needs_geocode = s.needs_geocode OR m.moved
+            FROM m WHERE s.id = m.id
+            RETURNING m.moved),
+        ins AS (
+            INSERT INTO store (chain_id, store_code, name, city, address, source_address)
+            SELECT %(chain)s, v.store_code, v.name, v.city, v.address, v.city || E'\t' || v.address FROM v
+            WHERE NOT EXISTS (SELECT 1 FROM store s WHERE s.chain_id = %(chain)s AND s.store_code = v.store_code)
+            RETURNING 1)
+        SELECT (SELECT COUNT(*) FROM ins), (SELECT COUNT(*) FROM upd), (SELECT COUNT(*) FROM upd WHERE moved)""",
+        {'chain': chain_id, 'codes': codes, 'names': [stores[c][0] for c in codes],
+         'cities': [stores[c][1] for c in codes], 'addrs': [stores[c][2] for c in codes]})
+    return cur.fetchone()
 
 def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('PRICE_WORKERS', '1')),
+                        help="price files loaded in parallel, one DB connection each")
+    parser.add_argument('--full-stats', action='store_true',
+                        help="recompute min_price/store_count for every product, not just the ones touched")
+    parser.add_argument('--force', action='store_true',
+                        help="reload files even if they are byte-identical to the last run's")
+    parser.add_argument('--parse-workers', type=int, default=int(os.environ.get('PRICE_PARSE_WORKERS', '1')),
+                        help="processes that parse one big price file in parallel (files over PRICE_SPLIT_MB)")
+    parser.add_argument('--profile', metavar='DIR', default=os.environ.get('INGEST_PROFILE'),
+                        help="write per-chain cProfile, tracemalloc and peak RSS reports to DIR")
+    parser.add_argument('--pipeline', type=int, metavar='N', default=pipeline_depth(),
+                        help="parse on a thread up to N chunks ahead of the DB writes (default 0: in turn)")
+    args = parser.parse_args()
+    if args.profile: os.environ['INGEST_PROFILE'] = args.profile
+    os.environ['PRICE_PIPELINE'] = str(args.pipeline)
+    # Started before any DB connection exists, so the parse processes hold none
+    parse_pool = Pool(args.parse_workers) if args.parse_workers > 1 else None
     start = time.time()
-    print("Downloading dataset...", flush=True)
-    ret = os.system(f"kaggle datasets download -d {KAGGLE_DATASET} -p kaggle_data --unzip")
-    if ret != 0:
-        print("ERROR: Kaggle download failed"); sys.exit(1)
-
-    # Find CSVs
-    all_csvs = glob.glob("kaggle_data/**/*.csv", recursive=True)
-    print(f"Found {len(all_csvs)} CSV files", flush=True)
-    price_full = sorted([f for f in all_csvs if 'price_full_file' in f])
-    store_files = sorted([f for f in all_csvs if 'store_file' in f])
+    metrics = RunMetrics('update_prices')
+    try:
+        with metrics.stage('download'):
+            dataset = open_dataset(KAGGLE_DATASET, log=lambda m: print(m, flush=True))
+    except RuntimeError as e:
+        print(f"ERROR: {e}"); sys.exit(1)
+
+    # CSVs are streamed out of the archive, only the members used below are read
+    print(f"Found {len(dataset.infos)} CSV files", flush=True)
+    price_full = dataset.members('price_full_file')
+    store_files = dataset.members('store_file')
     print(f"  price_full: {len(price_full)}, store: {len(store_files)}", flush=True)
 
     if not price_full:
         print("ERROR: No price_full files found")
-        for f in all_csvs[:10]: print(f"  {f}")
+        for i in dataset.infos[:10]: print(f"  {i.filename}")
         sys.exit(1)
 
-    data_dir = str(Path(price_full[0]).parent)
-    data_path = Path(data_dir)
-    print(f"Data dir: {data_dir}", flush=True)
-
     print("\nConnecting to DB...", flush=True)
-    conn = psycopg2.connect(DB_URL, connect_timeout=30)
+    conn = metrics.connect(DB_URL, connect_timeout=30)
     cur = conn.cursor()
     try:
         cur.execute("ALTER TABLE store_price ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT NOW()")
         conn.commit()
     except: conn.rollback()
-    cur.execute("DROP TABLE IF EXISTS tmp_prices")
+    cur.execute("ALTER TABLE store ADD COLUMN IF NOT EXISTS source_address TEXT")
+    cur.execute("ALTER TABLE store ADD COLUMN IF NOT EXISTS needs_geocode BOOLEAN NOT NULL DEFAULT false")
     conn.commit()
-    cur.execute("CREATE TABLE tmp_prices (barcode TEXT, name TEXT, store_id INTEGER, price NUMERIC)")
+    # Staging used to be one shared table; it is now a per-connection temp table
+    cur.execute("DROP TABLE IF EXISTS public.tmp_prices")
+    create_staging(cur)
+    ensure_history(cur)
     conn.commit()
 
     # Stores
     print("\n=== Stores ===", flush=True)
-    for f in sorted([Path(f) for f in store_files]):
+    new_stores = set()
+    for f in store_files:
         chain_key = f.stem.replace('store_file_', '')
         chain_name = CHAIN_MAP.get(chain_key)
         if not chain_name: continue
-        added = process_stores_file(cur, f, chain_name)
-        if added > 0: print(f"  {chain_name}: +{added}", flush=True); conn.commit()
+        with metrics.stage('stores', chain_name) as s:
+            added, updated, moved = process_stores_file(cur, f, chain_name)
+            conn.commit()
+            s.add(rows=added + updated, bytes=f.size)
+        if added: new_stores.add(chain_name)
+        if added or updated:
+            print(f"  {chain_name}: +{added} new, {updated} updated ({moved} to re-geocode)", flush=True)
 
     # Prices
     print("\n=== Prices ===", flush=True)
-    total = 0
-    for f in sorted([Path(f) for f in price_full], key=lambda x: x.stat().st_size):
-        chain_key = f.stem.replace('price_full_file_', '')
-        chain_name = CHAIN_MAP.get(chain_key)
+    ledger = RunLedger(conn, 'update_prices', force=args.force or None)
+    if ledger.resuming: print("  Previous run did not finish, resuming", flush=True)
+    skip_note = "already committed" if ledger.resuming else "unchanged since last run"
+    jobs, loaded = [], set()
+    for f in price_full:
+        chain_name = CHAIN_MAP.get(f.stem.replace('price_full_file_', ''))
         if not chain_name: continue
-        fsize = f.stat().st_size / (1024*1024)
-        if fsize < 0.001: continue
-        print(f"  {chain_name} ({fsize:.1f}MB)...", flush=True)
-        t0 = time.time()
-        u = process_prices_batch(cur, conn, f, chain_name)
-        elapsed = time.time() - t0
-        print(f"    -> {u} prices in {elapsed:.1f}s", flush=True)
-        total += u
-        if time.time() - start > 7200:
-            print("  WARNING: Time limit", flush=True); break
+        fbytes = f.size
+        if fbytes / (1024*1024) < 0.001: continue
+        # Rows of a store that was unknown last time are only picked up by reloading
+        checkpoint = ledger.open(f, reuse=chain_name not in new_stores)
+        if checkpoint.done:
+            print(f"  {chain_name}: {skip_note}, skipping", flush=True); continue
+        jobs.append((f, chain_name, fbytes, checkpoint)); loaded.add(chain_name)
+    # Workers load the saved index instead of each reading the whole product table
+    cache = ProductCache.load(cur)
+    cache.save()
+    conn.commit()
+    if args.workers > 1:
+        total, touched, complete = run_prices_parallel(cur, conn, jobs, args.workers, start, cache, metrics,
+                                                       parse_pool, args.parse_workers)
+    else:
+        total, touched, complete = run_prices_serial(cur, conn, jobs, start, cache, metrics, parse_pool, args.parse_workers)
+    if parse_pool: parse_pool.close()
 
-    # Promos
+    # Promos: each chain's promo files in one pass; reloaded chains are refreshed even if their
+    # promo files did not change, since their new price rows carry no flags yet
     print("\n=== Promos ===", flush=True)
-    promo_total = 0
-    promo_files = sorted([Path(f) for f in all_csvs if "promo_full_file" in f])
+    promo_files = dataset.members("promo_full_file")
     if not promo_files:
-        promo_files = sorted([Path(f) for f in all_csvs if "promo_file" in f and "promo_full" not in f])
+        promo_files = [f for f in dataset.members("promo_file") if "promo_full" not in f.name]
     print(f"  Found {len(promo_files)} promo files", flush=True)
-    for f in promo_files:
-        chain_key = f.stem.replace('promo_full_file_', '').replace('promo_file_', '')
-        chain_name = CHAIN_MAP.get(chain_key)
-        if not chain_name: continue
-        fsize = f.stat().st_size / (1024*1024)
-        if fsize < 0.001: continue
-        print(f"  {chain_name} ({fsize:.1f}MB)...", flush=True)
-        t0 = time.time()
-        u = process_promos_batch(cur, conn, f, chain_name)
-        print(f"    -> {u} promos in {time.time()-t0:.1f}s", flush=True)
-        promo_total += u
+    promos, promos_complete = promo_engine.refresh(conn, promo_files, metrics, ledger, reload=loaded)
+    print(f"  {promos['promotions']} promotions, {promos['items']} item links, "
+          f"{promos['flags']} promo flags changed", flush=True)
+    complete = complete and promos_complete
 
     # Stats
     print("\n=== Stats ===", flush=True)
-    cur.execute("""UPDATE product p SET min_price=sub.min_price, store_count=sub.store_count
-        FROM (SELECT product_id, MIN(price) as min_price, COUNT(DISTINCT store_id) as store_count
-              FROM store_price GROUP BY product_id) sub
-        WHERE p.id=sub.product_id
-        AND (p.min_price IS DISTINCT FROM sub.min_price OR p.store_count IS DISTINCT FROM sub.store_count)""")
-    print(f"  {cur.rowcount} products updated", flush=True); conn.commit()
-    print(f"\n=== DONE: {total} prices in {time.time()-start:.0f}s ===", flush=True)
+    t0 = time.time()
+    with metrics.stage('stats') as s:
+        # Products touched by an interrupted run are unknown, so resumed runs rebuild everything
+        if args.full_stats or ledger.resuming:
+            n = refresh_product_stats(cur)
+            print(f"  full rebuild: {n} products updated in {time.time()-t0:.1f}s", flush=True)
+        else:
+            n = refresh_product_stats(cur, sorted(touched))
+            print(f"  {n} of {len(touched)} touched products updated in {time.time()-t0:.1f}s", flush=True)
+        conn.commit()
+        cache.refresh(cur); cache.save(); conn.commit()
+        s.add(rows=n)
+    if complete: ledger.finish_run()
+    else: print("  Run incomplete, the next run will resume it", flush=True)
+    print(f"\n=== DONE: {total} prices in {time.time()-start:.0f}s, {ledger.summary()} ===", flush=True)
+    metrics.finish(conn, ok=complete)
     conn.close()
 
 if __name__ == '__main__': main()
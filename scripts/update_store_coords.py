@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 import os, time, json, logging, sys
 import urllib.request, urllib.parse
-import psycopg2
+from run_metrics import RunMetrics
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s", handlers=[logging.StreamHandler(sys.stdout)])
 log = logging.getLogger(__name__)
@@ -27,30 +27,37 @@ def geocode(address, city):
 def main():
     db_url = os.environ.get("DATABASE_URL")
     if not db_url: raise ValueError("DATABASE_URL not set")
-    conn = psycopg2.connect(db_url)
+    metrics = RunMetrics("update_store_coords")
+    conn = metrics.connect(db_url)
     conn.autocommit = False
     cur = conn.cursor()
+    # update_prices flags stores whose address changed in the source files
+    cur.execute("ALTER TABLE store ADD COLUMN IF NOT EXISTS needs_geocode BOOLEAN NOT NULL DEFAULT false")
+    conn.commit()
     cur.execute("""
         SELECT id, name, address, city FROM store
-        WHERE lat IS NULL AND address IS NOT NULL AND address != ''
+        WHERE (lat IS NULL OR needs_geocode) AND address IS NOT NULL AND address != ''
         ORDER BY id
     """)
     stores = cur.fetchall()
-    log.info("Found %d stores missing coordinates", len(stores))
+    log.info("Found %d stores missing coordinates or with a changed address", len(stores))
     updated = not_found = 0
     for i, (sid, name, address, city) in enumerate(stores):
-        coords = geocode(address, city or "")
-        if coords:
-            cur.execute("UPDATE store SET lat=%s, lng=%s WHERE id=%s", (coords[0], coords[1], sid))
-            updated += 1
-        else:
-            not_found += 1
-        if (i + 1) % 50 == 0:
-            conn.commit()
-            log.info("  %d/%d - %d updated, %d not found", i+1, len(stores), updated, not_found)
+        with metrics.stage("geocode"):
+            coords = geocode(address, city or "")
+        with metrics.stage("update") as s:
+            if coords:
+                cur.execute("UPDATE store SET lat=%s, lng=%s, needs_geocode=false WHERE id=%s", (coords[0], coords[1], sid))
+                updated += 1; s.add(rows=1)
+            else:
+                not_found += 1
+            if (i + 1) % 50 == 0:
+                conn.commit()
+                log.info("  %d/%d - %d updated, %d not found", i+1, len(stores), updated, not_found)
         time.sleep(DELAY)
     conn.commit()
     log.info("Done - %d/%d stores geocoded", updated, len(stores))
+    metrics.finish(conn)
     conn.close()
 
 if __name__ == "__main__":
@@ -4,8 +4,8 @@ Parse Shufersal Stores XML and update subchain_name + subchain_id in the store t
 Run from repo root: python scripts/update_subchains.py
 """
 import os, sys, xml.etree.ElementTree as ET, glob
-import psycopg2
 from collections import Counter
+from run_metrics import RunMetrics
 
 DB_URL = os.environ.get('DATABASE_URL')
 if not DB_URL:
@@ -22,17 +22,20 @@ if not xml_files:
     print("ERROR: No Stores*.xml found"); sys.exit(1)
 xml_file = xml_files[0]
 print(f"Parsing {xml_file}...")
+metrics = RunMetrics('update_subchains')
 
-tree = ET.parse(xml_file)
-root = tree.getroot()
+with metrics.stage('parse', 'Shufersal') as s:
+    tree = ET.parse(xml_file)
+    root = tree.getroot()
 
-stores = {}
-for store in root.findall('.//STORE'):
-    store_id = store.findtext('STOREID', '').strip()
-    subchain_id = store.findtext('SUBCHAINID', '').strip()
-    subchain_name = store.findtext('SUBCHAINNAME', '').strip()
-    if store_id and subchain_name:
-        stores[store_id] = (int(subchain_id) if subchain_id.isdigit() else None, subchain_name)
+    stores = {}
+    for store in root.findall('.//STORE'):
+        store_id = store.findtext('STOREID', '').strip()
+        subchain_id = store.findtext('SUBCHAINID', '').strip()
+        subchain_name = store.findtext('SUBCHAINNAME', '').strip()
+        if store_id and subchain_name:
+            stores[store_id] = (int(subchain_id) if subchain_id.isdigit() else None, subchain_name)
+    s.add(rows=len(stores), bytes=os.path.getsize(xml_file))
 
 print(f"Found {len(stores)} stores in XML")
 subchain_counts = Counter(v[1] for v in stores.values())
@@ -41,7 +44,7 @@ for name, count in sorted(subchain_counts.items(), key=lambda x: -x[1]):
     print(f"  {name}: {count} stores")
 
 print("\nConnecting to DB...")
-conn = psycopg2.connect(DB_URL, connect_timeout=30)
+conn = metrics.connect(DB_URL, connect_timeout=30)
 cur = conn.cursor()
 
 cur.execute("ALTER TABLE store ADD COLUMN IF NOT EXISTS subchain_name text")
@@ -59,18 +62,19 @@ print(f"DB has {len(db_stores)} Shufersal stores")
 
 updated = 0
 not_found = 0
-for store_code, (subchain_id, subchain_name) in stores.items():
-    db_id = db_stores.get(store_code)
-    if not db_id and store_code.isdigit():
-        db_id = db_stores.get(str(int(store_code)))
-    if not db_id:
-        not_found += 1
-        continue
-    cur.execute("UPDATE store SET subchain_id = %s, subchain_name = %s WHERE id = %s",
-        (subchain_id, subchain_name, db_id))
-    updated += 1
-
-conn.commit()
+with metrics.stage('stores', 'Shufersal') as s:
+    for store_code, (subchain_id, subchain_name) in stores.items():
+        db_id = db_stores.get(store_code)
+        if not db_id and store_code.isdigit():
+            db_id = db_stores.get(str(int(store_code)))
+        if not db_id:
+            not_found += 1
+            continue
+        cur.execute("UPDATE store SET subchain_id = %s, subchain_name = %s WHERE id = %s",
+            (subchain_id, subchain_name, db_id))
+        updated += 1
+    conn.commit()
+    s.add(rows=updated)
 print(f"\nDone! Updated: {updated}, Not found in DB: {not_found}")
 
 cur.execute("""
@@ -82,4 +86,5 @@ print("\nResult in DB:")
 for r in cur.fetchall():
     print(f"  [{r[1]}] {r[0]}: {r[2]} stores")
 
+metrics.finish(conn)
 conn.close()